@@ -1,21 +1,26 @@
 import alchemyjsonschema as ajs
 import bitjws
-import copy
+import datetime
 import imp
 import json
 import logging
 import os
 import sys
+import time
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
-from alchemyjsonschema.dictify import jsonify
-from flask import Flask, request, current_app, make_response
+from flask import Flask, Response, request, current_app, g, make_response, stream_with_context
 from flask.ext.cors import CORS
 from flask.ext.login import login_required, current_user
-from flask_bitjws import FlaskBitjws, load_jws_from_request, FlaskUser
+from flask_bitjws import FlaskBitjws
 from jsonschema import validate, ValidationError
 from sqlalchemy_login_models.model import UserKey, User as SLM_User
 import model
+import nonces
+from cache import TTLCache
+from serializers import compile_serializers
+from pagination import keyset_page, PAGE_SIZE, MAX_PAGE_SIZE
+from jws import JWS
 
 try:
     cfg_loc = os.environ.get('SWAGXAMPLE_CONFIG_FILE', 'example_cfg.py')
@@ -30,49 +35,114 @@ except Exception as e:
 
 # get the swagger spec for this server
 iml = os.path.dirname(os.path.realpath(__file__))
+
+# the book of the node, in the dex_node package above
+sys.path.append(os.path.dirname(iml))
+# the book's number mode, pair and key namespace are the node's shared
+# settings, see interface.FIXED_POINT, PAIR and NAMESPACE. Order prices and
+# amounts are integer units either way.
+import interface
+import metrics
 SWAGGER_SPEC = json.loads(open(iml + '/static/swagger.json').read())
-# invert definitions
+# a serializer per definition, compiled once
+SERIALIZERS = compile_serializers(SWAGGER_SPEC)
+
+
 def jsonify2(obj, name):
-    #TODO replace this with a cached definitions patch
-    #this is inefficient to do each time...
-    spec = copy.copy(SWAGGER_SPEC['definitions'][name])
-    spec['definitions'] = SWAGGER_SPEC['definitions']
-    return jsonify(obj, spec)
+    """
+    Serialize an object as the Swagger definition name.
+    """
+    return SERIALIZERS[name](obj)
+
+
+def jsonify_list(objs, name):
+    """
+    Serialize a list of objects as the Swagger definition name.
+    """
+    serialize = SERIALIZERS[name]
+    return [serialize(obj) for obj in objs]
 
 __all__ = ['app', ]
 
+# how many rows each message of a streamed export holds
+EXPORT_CHUNK = 1000
+
+
+def get_page_args():
+    """
+    Read the after and limit query string arguments of a list request.
+    """
+    after = request.args.get('after', type=int)
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    return after, max(limit, 1)
+
+
+def create_page_response(items, name, cursor):
+    """
+    A signed response holding a page of items. The cursor of the next page
+    is sent in the X-Next-Cursor header, so the payload stays a list.
+    """
+    response = jws.create_response(jsonify_list(items, name))
+    if cursor is not None:
+        response.headers['X-Next-Cursor'] = str(cursor)
+    return response
+
+
+def create_export_response(query, column, name):
+    """
+    Stream every item of a query, as one signed message of up to
+    EXPORT_CHUNK items per line. Memory use stays the same however many
+    items there are.
+    """
+    def generate():
+        after = None
+        while True:
+            items, after = keyset_page(query, column, after, EXPORT_CHUNK)
+            if len(items) > 0:
+                yield jws.sign(jsonify_list(items, name)) + '\n'
+            # drop the rows of this chunk from the session
+            ses.expunge_all()
+            if after is None:
+                break
+    return Response(stream_with_context(generate()), mimetype='application/jose')
+
 
 def get_last_nonce(app, key, nonce):
     """
-    Get the last_nonce used by the given key from the SQLAlchemy database.
-    Update the last_nonce to nonce at the same time.
+    Check that nonce is newer than the last nonce used by the given key,
+    and record it as the last at the same time, see nonces.py.
+
+    The nonce replaced is not read back, to keep this to a single
+    statement. Instead 0 stands for any nonce older than the new one, which
+    is all FlaskBitjws compares the result with.
 
     :param str key: the public key the nonce belongs to
-    :param int nonce: the last nonce used by this key
-    """
-    uk = ses.query(UserKey).filter(UserKey.key==key)\
-            .filter(UserKey.last_nonce<nonce * 1000).first()
-    if not uk:
-        return None
-    lastnonce = copy.copy(uk.last_nonce)
-    # TODO Update DB record in same query as above, if possible
-    uk.last_nonce = nonce * 1000
-    try:
-        ses.commit()
-    except Exception as e:
-        current_app.logger.exception(e)
-        ses.rollback()
-        ses.flush()
-    return lastnonce
+    :param int nonce: the nonce of the request
+    :return: 0, or None if the key is unknown or the nonce is not newer
+    """
+    if nonce_store.advance(key, nonce * 1000):
+        return 0
+    return None
 
 
 def get_user_by_key(app, key):
     """
     An SQLAlchemy User getting function. Get a user by public key.
 
+    Users are cached by key for USER_CACHE_TTL seconds. The cached copy is
+    detached from any session, and merged into the request's session
+    without a query.
+
     :param str key: the public key the user belongs to
     """
+    user = user_cache.get(key)
+    if user is not None:
+        return ses.merge(user, load=False)
     user = ses.query(SLM_User).join(UserKey).filter(UserKey.key==key).first()
+    if user is not None:
+        ses.expunge(user)
+        user_cache.set(key, user)
+        user = ses.merge(user, load=False)
     return user
 
 # Setup flask app and FlaskBitjws
@@ -81,19 +151,92 @@ app._static_folder = "%s/static" % os.path.realpath(os.path.dirname(__file__))
 
 FlaskBitjws(app, privkey=cfg.PRIV_KEY, get_last_nonce=get_last_nonce,
             get_user_by_key=get_user_by_key, basepath=cfg.BASEPATH)
+jws = JWS(cfg.PRIV_KEY)
+app.login_manager.request_loader(metrics.timed('api.load_user')(jws.load_user_from_request))
 
 # Setup logging
 logfile = cfg.LOGFILE if hasattr(cfg, 'LOGFILE') else 'server.log'
 loglevel = cfg.LOGLEVEL if hasattr(cfg, 'LOGLEVEL') else logging.INFO
 logging.basicConfig(filename=logfile, level=loglevel)
 logger = logging.getLogger(__name__)
+
+# record request latencies, served on /metrics and logged every
+# METRICS_LOG_INTERVAL seconds
+metrics.enable(getattr(cfg, 'METRICS_ENABLED', False))
+METRICS_LOG_INTERVAL = getattr(cfg, 'METRICS_LOG_INTERVAL', metrics.LOG_INTERVAL)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.time()
+
+
+@app.after_request
+def record_request_latency(response):
+    if metrics.ENABLED and request.endpoint is not None and 'request_start' in g:
+        metrics.record('api.%s' % request.endpoint, time.time() - g.request_start)
+        metrics.incr('api.status_%s' % response.status_code)
+    metrics.log_periodically(logger, METRICS_LOG_INTERVAL)
+    return response
  
 # Setup CORS
 CORS(app)
 
 # Setup database
-eng = sa.create_engine(cfg.SA_ENGINE_URI)
-ses = orm.sessionmaker(bind=eng)()
+def create_engine(uri):
+    """
+    Create the SQLAlchemy engine, with a connection pool sized by the
+    SA_POOL_* config settings. SQLite has no use for a pool.
+
+    :param str uri: The database URI
+    """
+    options = {}
+    if not uri.startswith('sqlite'):
+        options = {'pool_size': getattr(cfg, 'SA_POOL_SIZE', 10),
+                   'max_overflow': getattr(cfg, 'SA_MAX_OVERFLOW', 20),
+                   'pool_timeout': getattr(cfg, 'SA_POOL_TIMEOUT', 30),
+                   'pool_recycle': getattr(cfg, 'SA_POOL_RECYCLE', 3600)}
+    engine = sa.create_engine(uri, **options)
+
+    # never use a connection opened by another process, i.e. by the parent
+    # of a forking WSGI server
+    @sa.event.listens_for(engine, 'connect')
+    def remember_pid(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @sa.event.listens_for(engine, 'checkout')
+    def check_pid(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise sa.exc.DisconnectionError("connection opened by process %s" %
+                                            connection_record.info['pid'])
+
+    return engine
+
+eng = create_engine(cfg.SA_ENGINE_URI)
+# a session per thread, removed at the end of each request, so requests
+# never share a transaction
+ses = orm.scoped_session(orm.sessionmaker(bind=eng))
+
+
+@app.teardown_appcontext
+def remove_session(exc=None):
+    ses.remove()
+
+# users by public key, see get_user_by_key
+user_cache = TTLCache(getattr(cfg, 'USER_CACHE_SIZE', 10000), getattr(cfg, 'USER_CACHE_TTL', 300.0))
+
+# checks the nonce of every request, NONCE_CACHE chooses where the last
+# nonces are kept: None for SQL only, 'memory' or 'redis'
+NONCE_CACHE = getattr(cfg, 'NONCE_CACHE', None)
+if NONCE_CACHE is None:
+    nonce_store = nonces.SQLNonces(ses, logger)
+else:
+    nonce_options = {'flush_interval': getattr(cfg, 'NONCE_FLUSH_INTERVAL', nonces.FLUSH_INTERVAL)}
+    if NONCE_CACHE == 'redis':
+        nonce_options['url'] = getattr(cfg, 'NONCE_REDIS_URL', None)
+    nonce_store = nonces.NONCE_STORES[NONCE_CACHE](ses, logger, **nonce_options)
+
 SLM_User.metadata.create_all(eng)
 UserKey.metadata.create_all(eng)
 for m in model.__all__:
@@ -124,13 +267,20 @@ def get_coins():
       - typ: []
       - alg: []
     operationId: findCoin
+    parameters:
+      - name: after
+        in: query
+        description: the X-Next-Cursor of the previous page
+        type: integer
+      - name: limit
+        in: query
+        description: the most coins to get
+        type: integer
     """
-    coinsq = ses.query(Coin).all()
-    if not coinsq:
-        return None
-    coins = [jsonify2(c, 'Coin') for c in coinsq]
-    response = current_app.bitjws.create_response(coins)
-    return response
+    after, limit = get_page_args()
+    coins, cursor = keyset_page(ses.query(Coin).filter(Coin.user_id == current_user.id),
+                                Coin.id, after, limit)
+    return create_page_response(coins, 'Coin', cursor)
 
 
 @app.route('/coin', methods=['POST'])
@@ -174,7 +324,158 @@ def post_coin():
         return 'Could not create coin', 500
     current_app.logger.info("created coin %s" % coin)
     newcoin = jsonify2(coin, 'Coin')
-    return current_app.bitjws.create_response(newcoin)
+    return jws.create_response(newcoin)
+
+
+# the most orders POST /orders accepts at once
+MAX_BULK_ORDERS = getattr(cfg, 'MAX_BULK_ORDERS', 100)
+ORDERS_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'maxItems': MAX_BULK_ORDERS,
+    'items': {
+        'type': 'object',
+        'required': ['pair', 'side', 'price', 'amount'],
+        'properties': {
+            'pair': {'enum': [interface.PAIR]},
+            'side': {'enum': ['bid', 'ask']},
+            'price': {'type': 'integer', 'minimum': 1},
+            'amount': {'type': 'integer', 'minimum': 1}
+        }
+    }
+}
+
+
+@app.route('/orders', methods=['POST'])
+@login_required
+def post_orders():
+    """
+    Submit a list of orders at once.
+    All orders are validated first, then saved in one transaction and
+    added to the book in one pipelined write. If any order is invalid,
+    none are saved.
+    ---
+    operationId: addOrders
+    responses:
+      '200':
+        description: the new orders
+        schema:
+          items:
+            $ref: '#/definitions/Order'
+          type: array
+      default:
+        description: unexpected error
+        schema:
+          $ref: '#/definitions/errorModel'
+    parameters:
+      - schema:
+          items:
+            $ref: '#/definitions/Order'
+          type: array
+        description: The orders, with prices and amounts in integer units
+        required: true
+        name: orders
+        in: body
+    security:
+      - kid: []
+      - typ: []
+      - alg: []
+    """
+    data = request.jws_payload['data'].get('orders')
+    try:
+        validate(data, ORDERS_SCHEMA)
+    except ValidationError as ve:
+        return 'Invalid orders: %s' % ve.message, 400
+    now = datetime.datetime.utcnow()
+    orders = [model.Order(pair=o['pair'], side=o['side'], price=o['price'], amount=o['amount'],
+                          time=now, user_id=current_user.id) for o in data]
+    ses.add_all(orders)
+    try:
+        # the orders are read while still loaded, as the commit expires them
+        # and reading them after would cost a SELECT each
+        ses.flush()
+        book_orders = [interface.create_order_from_Order(o) for o in orders]
+        result = jsonify_list(orders, 'Order')
+        ses.commit()
+    except Exception as ie:
+        current_app.logger.exception(ie)
+        ses.rollback()
+        ses.flush()
+        return 'Could not create orders', 500
+    try:
+        interface.insert_many_orders(book_orders)
+    except Exception as e:
+        # the orders are saved, and will be booked by the next bootstrap
+        current_app.logger.exception(e)
+        return 'Orders saved but not booked', 500
+    current_app.logger.info("created %s orders for user %s" % (len(orders), current_user.id))
+    return jws.create_response(result)
+
+
+@app.route('/orders', methods=['GET'])
+@login_required
+def get_orders():
+    """
+    Get a page of the orders of the signing user, oldest first.
+    ---
+    operationId: findOrders
+    parameters:
+      - name: after
+        in: query
+        description: the X-Next-Cursor of the previous page
+        type: integer
+      - name: limit
+        in: query
+        description: the most orders to get
+        type: integer
+    responses:
+      '200':
+        description: order response
+        schema:
+          items:
+            $ref: '#/definitions/Order'
+          type: array
+      default:
+        description: unexpected error
+        schema:
+          $ref: '#/definitions/errorModel'
+    security:
+      - kid: []
+      - typ: []
+      - alg: []
+    """
+    after, limit = get_page_args()
+    orders, cursor = keyset_page(ses.query(model.Order).filter(model.Order.user_id == current_user.id),
+                                 model.Order.id, after, limit)
+    return create_page_response(orders, 'Order', cursor)
+
+
+@app.route('/orders/export', methods=['GET'])
+@login_required
+def export_orders():
+    """
+    Stream every order of the signing user, oldest first, as one signed
+    message of orders per line.
+    ---
+    operationId: exportOrders
+    responses:
+      '200':
+        description: order lists, one signed message per line
+        schema:
+          items:
+            $ref: '#/definitions/Order'
+          type: array
+      default:
+        description: unexpected error
+        schema:
+          $ref: '#/definitions/errorModel'
+    security:
+      - kid: []
+      - typ: []
+      - alg: []
+    """
+    return create_export_response(ses.query(model.Order).filter(model.Order.user_id == current_user.id),
+                                  model.Order.id, 'Order')
 
 
 @app.route('/user', methods=['GET'])
@@ -204,7 +505,7 @@ def get_user():
     operationId: getUserList
     """
     userdict = jsonify2(current_user.db_user, 'User')
-    return current_app.bitjws.create_response(userdict)
+    return jws.create_response(userdict)
 
 
 @app.route('/user', methods=['POST'])
@@ -236,7 +537,7 @@ def add_user():
       - typ: []
       - alg: []
     """
-    load_jws_from_request(request)
+    jws.load_jws_from_request(request)
     if not hasattr(request, 'jws_header') or request.jws_header is None:
         return "Invalid Payload", 401
     username = request.jws_payload['data'].get('username')
@@ -262,9 +563,31 @@ def add_user():
         #ses.delete(user)
         #ses.commit()
         return 'username taken', 400
+    user_cache.invalidate(address)
     jresult = jsonify2(userkey, 'UserKey')
     current_app.logger.info("registered user %s with key %s" % (user.id, userkey.key))
-    return current_app.bitjws.create_response(jresult)
+    return jws.create_response(jresult)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    The request latencies and cache statistics of this process, in the
+    Prometheus text format, for scraping.
+    ---
+    operationId: getMetrics
+    produces:
+      - text/plain
+    responses:
+      '200':
+        description: the metrics
+        schema:
+          type: string
+    """
+    lines = [metrics.render_text()]
+    for stat, value in sorted(user_cache.stats().items()):
+        lines.append('%suser_cache_%s %d\n' % (metrics.PREFIX, stat, value))
+    return Response(''.join(lines), mimetype='text/plain')
 
 
 if __name__ == "__main__":
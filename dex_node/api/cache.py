@@ -0,0 +1,63 @@
+"""
+A small in-process cache for lookups which rarely change.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    A thread-safe mapping holding at most maxsize entries, each for at most
+    ttl seconds. The least recently used entry is evicted first.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        """
+        :param int maxsize: The most entries to keep
+        :param float ttl: The most seconds to keep an entry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        :return: the value cached for key, or default if none or expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return default
+            # move to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: a dict of the hits, misses and size of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,79 @@
+"""
+bitjws verification and signing, in one place for the request loaders,
+responses and streamed exports.
+"""
+import time
+import urlparse
+import bitjws
+from flask import Response, current_app
+from flask_bitjws import FlaskUser
+
+
+class JWS(object):
+    """
+    Verifies requests and signs responses.
+    """
+
+    def __init__(self, wif):
+        """
+        :param str wif: The private key to sign with, WIF encoded
+        """
+        self.privkey = bitjws.PrivateKey(bitjws.wif_to_privkey(wif))
+
+    def verify(self, raw, requrl):
+        """
+        Verify and decode a bitjws message.
+
+        :param unicode raw: The message
+        :param str requrl: The URL it must have been signed for
+        :return: a tuple of the header and payload
+        """
+        return bitjws.validate_deserialize(raw, requrl=requrl)
+
+    def sign(self, payload, requrl='/response'):
+        """
+        Sign a payload as a bitjws message.
+
+        :param payload: The JSON serializable payload
+        :return: the signed message
+        """
+        return bitjws.sign_serialize(self.privkey, requrl=requrl, iat=time.time(), data=payload)
+
+    def create_response(self, payload):
+        """
+        A signed bitjws response, like FlaskBitjws.create_response.
+        """
+        return Response(self.sign(payload), mimetype='application/jose')
+
+    def load_jws_from_request(self, req):
+        """
+        Like flask_bitjws.load_jws_from_request, verifying with this JWS.
+        """
+        content_type = req.headers.get('Content-Type', '')
+        if 'application/jose' not in content_type:
+            return
+        rule = req.url_rule
+        if rule is None or urlparse.urlsplit(req.url).path != rule.rule:
+            return
+        req.jws_header, req.jws_payload = self.verify(req.get_data().decode('utf8'),
+                                                      current_app.bitjws.basepath + rule.rule)
+
+    def load_user_from_request(self, req):
+        """
+        Like flask_bitjws.load_user_from_request, verifying with this JWS.
+        """
+        self.load_jws_from_request(req)
+        if not hasattr(req, 'jws_header') or req.jws_header is None or \
+                'iat' not in req.jws_payload:
+            current_app.logger.info("invalid jws request.")
+            return None
+        ln = current_app.bitjws.get_last_nonce(current_app, req.jws_header['kid'],
+                                               req.jws_payload['iat'])
+        if ln is None or req.jws_payload['iat'] * 1000 <= ln:
+            current_app.logger.info("invalid nonce. lastnonce: %s" % ln)
+            return None
+        rawu = current_app.bitjws.get_user_by_key(current_app, req.jws_header['kid'])
+        if rawu is None:
+            return None
+        current_app.logger.info("logging in user: %s" % rawu)
+        return FlaskUser(rawu)
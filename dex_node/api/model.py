@@ -19,6 +19,9 @@ class Order(Base):
     amount = sa.Column(sa.Integer, nullable=False)
     price = sa.Column(sa.Integer, nullable=False)
     time = sa.Column(sa.DateTime, nullable=False)
+    # open, partial or filled, kept up to date by trade_consumer
+    state = sa.Column(sa.String(7), nullable=False, default='open')
+    filled = sa.Column(sa.Integer, nullable=False, default=0)
 
     user_id = sa.Column(sa.String(120), sa.ForeignKey('user.id'), nullable=False)
     user = orm.relationship("User")
@@ -79,6 +82,10 @@ class Trade(Base):
     ask = orm.relationship("Order")
     bid_id = sa.Column(sa.Integer, sa.ForeignKey('order.id'), nullable=False)
     bid = orm.relationship("Order")
+    # the matcher's sequence number of the trade, 0 if unknown. With the bid
+    # and ask it identifies a trade, see trade_consumer.write_trades
+    seq = sa.Column(sa.BigInteger, nullable=False, default=0)
+    __table_args__ = (sa.UniqueConstraint('bid_id', 'ask_id', 'seq'),)
 
     def __repr__(self):
         return "<Trade(id=%s, pair='%s', amount=%s, price=%s)>" % (self.id, self.pair, self.amount, self.price)
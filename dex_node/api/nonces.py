@@ -0,0 +1,194 @@
+"""
+Nonce checks for authenticated requests.
+
+Each request must carry a nonce greater than the last one used by its key.
+SQLNonces checks and records it with a single conditional UPDATE, so
+concurrent requests can never both use the same nonce. MemoryNonces and
+RedisNonces keep the last nonces in front of SQL instead, and write them
+behind to the UserKey table every flush_interval seconds.
+"""
+import threading
+import time
+import redis
+
+# the most seconds nonces stay in a cache before being written to SQL
+FLUSH_INTERVAL = 5.0
+# Redis hashes from key to its last nonce, and to those not yet in SQL
+REDIS_NONCES = 'api_nonces'
+REDIS_DIRTY = 'api_nonces_dirty'
+# set for flush_interval by the API process flushing, so others skip it
+REDIS_FLUSHING = 'api_nonces_flushing'
+
+# Compare and set the last nonce of key ARGV[1] in KEYS[1] to ARGV[2],
+# marking it dirty in KEYS[2]. Returns 1 if set, 0 if not newer and -1 if
+# the key is not cached.
+ADVANCE_NONCE = """
+local last = redis.call('HGET', KEYS[1], ARGV[1])
+if not last then
+    return -1
+end
+if tonumber(last) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+
+class SQLNonces(object):
+    """
+    The last nonces, in the UserKey table.
+    """
+
+    def __init__(self, session, logger=None, UserKey=None):
+        """
+        :param session: The SQLAlchemy session, or scoped_session, to use
+        :param logger: Where to log failed commits
+        :param UserKey: The model holding the last nonce of each key, by
+                        default sqlalchemy_login_models' UserKey
+        """
+        if UserKey is None:
+            from sqlalchemy_login_models.model import UserKey
+        self.session = session
+        self.logger = logger
+        self.UserKey = UserKey
+
+    def advance(self, key, nonce):
+        """
+        Record nonce as the last nonce of key, if greater than the current
+        one, in a single statement.
+
+        :param str key: The public key the nonce belongs to
+        :param nonce: The nonce, in the units of UserKey.last_nonce
+        :return: True if recorded, False if the key is unknown or the nonce
+                 is not newer
+        """
+        return self.write_many({key: nonce}) == 1
+
+    def get(self, key):
+        """
+        :return: the last nonce of key, or None for an unknown key
+        """
+        return self.session.query(self.UserKey.last_nonce).filter(self.UserKey.key == key).scalar()
+
+    def write_many(self, nonces):
+        """
+        Record the last nonces of several keys in one transaction, leaving
+        alone any already newer.
+
+        :param dict nonces: key -> nonce
+        :return: the number of keys updated
+        """
+        UserKey = self.UserKey
+        count = 0
+        for key, nonce in nonces.items():
+            count += self.session.query(UserKey)\
+                .filter(UserKey.key == key, UserKey.last_nonce < nonce)\
+                .update({UserKey.last_nonce: nonce}, synchronize_session=False)
+        try:
+            self.session.commit()
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.exception(e)
+            self.session.rollback()
+            return 0
+        return count
+
+
+class MemoryNonces(object):
+    """
+    The last nonces, cached in this process. Only safe while a single API
+    process serves the keys, since other processes would not see them.
+    Nonces used in the last flush_interval are lost on a crash.
+    """
+
+    def __init__(self, session, logger=None, flush_interval=FLUSH_INTERVAL, UserKey=None):
+        self.sql = SQLNonces(session, logger, UserKey)
+        self.flush_interval = flush_interval
+        self._nonces = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flushed = time.time()
+
+    def advance(self, key, nonce):
+        """
+        See SQLNonces.advance.
+        """
+        if key not in self._nonces:
+            last = self.sql.get(key)
+            if last is None:
+                return False
+            with self._lock:
+                self._nonces.setdefault(key, last)
+        with self._lock:
+            if self._nonces[key] >= nonce:
+                return False
+            self._nonces[key] = self._dirty[key] = nonce
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Write the nonces used since the last flush to SQL.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flushed = time.time()
+        if len(dirty) > 0:
+            self.sql.write_many(dirty)
+
+
+class RedisNonces(object):
+    """
+    The last nonces, cached in Redis and shared by every API process.
+    """
+
+    def __init__(self, session, logger=None, flush_interval=FLUSH_INTERVAL, url=None, UserKey=None):
+        """
+        :param str url: A redis:// URL, instead of localhost
+        """
+        self.sql = SQLNonces(session, logger, UserKey)
+        self.flush_interval = flush_interval
+        self.red = redis.StrictRedis.from_url(url) if url is not None else redis.StrictRedis()
+        self._advance = self.red.register_script(ADVANCE_NONCE)
+        self._flushed = time.time()
+
+    def advance(self, key, nonce):
+        """
+        See SQLNonces.advance.
+        """
+        res = self._advance(keys=[REDIS_NONCES, REDIS_DIRTY], args=[key, nonce])
+        if res == -1:
+            last = self.sql.get(key)
+            if last is None:
+                return False
+            self.red.hsetnx(REDIS_NONCES, key, last)
+            res = self._advance(keys=[REDIS_NONCES, REDIS_DIRTY], args=[key, nonce])
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+        return res == 1
+
+    def flush(self):
+        """
+        Write the nonces used since the last flush by any API process to
+        SQL, unless another process is at it.
+        """
+        self._flushed = time.time()
+        if not self.red.set(REDIS_FLUSHING, 1, ex=max(int(self.flush_interval), 1), nx=True):
+            return
+        pipe = self.red.pipeline()
+        pipe.hgetall(REDIS_DIRTY)
+        pipe.delete(REDIS_DIRTY)
+        dirty = pipe.execute()[0]
+        if len(dirty) > 0:
+            self.sql.write_many(dict((k, _number(n)) for k, n in dirty.items()))
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+NONCE_STORES = {None: SQLNonces, 'memory': MemoryNonces, 'redis': RedisNonces}
@@ -0,0 +1,29 @@
+"""
+Keyset pagination of list queries.
+"""
+
+# how many items a list endpoint returns by default, and at most
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def keyset_page(query, column, after=None, limit=PAGE_SIZE):
+    """
+    Get one page of a query, ordered by a unique column. Unlike OFFSET,
+    seeking past the last key of the previous page costs the same for
+    every page.
+
+    :param query: The SQLAlchemy query
+    :param column: The unique column to order and seek by, i.e. Model.id
+    :param after: The last key of the previous page, None for the first
+    :param int limit: The most items to get
+    :return: a tuple of the items and the key to get the next page after,
+             None on the last page
+    """
+    if after is not None:
+        query = query.filter(column > after)
+    items = query.order_by(column).limit(limit + 1).all()
+    if len(items) > limit:
+        items = items[:limit]
+        return items, getattr(items[-1], column.key)
+    return items, None
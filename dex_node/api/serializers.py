@@ -0,0 +1,67 @@
+"""
+JSON serializers compiled from the Swagger definitions.
+
+alchemyjsonschema's jsonify walks the schema again for every object it
+serializes. compile_serializers walks each definition once, at startup,
+into a function producing the same output, so serializing only costs the
+attribute reads and conversions.
+"""
+from alchemyjsonschema.dictify import ConvertionError, get_properties, jsonify_dict
+
+
+def compile_serializers(spec):
+    """
+    Compile a serializer for every definition of a Swagger spec.
+
+    :param dict spec: The Swagger spec
+    :return: a dict from definition name to a function taking an object and
+             returning its JSON compatible dict, as jsonify would
+    """
+    compiled = {}
+    return dict((name, _compile_properties(get_properties(definition, spec), spec, compiled))
+                for name, definition in spec['definitions'].items())
+
+
+# how each field is serialized
+_SCALAR, _OBJECT, _ARRAY = range(3)
+
+
+def _compile_properties(properties, root, compiled):
+    # definitions may refer to themselves, so each set of properties is
+    # registered before compiling its fields
+    if id(properties) in compiled:
+        return compiled[id(properties)]
+    fields = []
+
+    def fold(ob):
+        if ob is None:
+            return None
+        out = {}
+        for name, kind, convert in fields:
+            if kind == _SCALAR:
+                val = convert(getattr(ob, name, None))
+            elif kind == _OBJECT:
+                val = convert(getattr(ob, name))
+            else:
+                val = [convert(e) for e in getattr(ob, name, [])]
+            if val is not None:
+                out[name] = val
+        return out
+    compiled[id(properties)] = fold
+    for name, schema in properties.items():
+        fields.append(_compile_field(name, schema, root, compiled))
+    return fold
+
+
+def _compile_field(name, schema, root, compiled):
+    type_ = schema.get('type')
+    if type_ == 'array':
+        return name, _ARRAY, _compile_properties(get_properties(schema, root), root, compiled)
+    elif type_ is None or type_ == 'object':
+        return name, _OBJECT, _compile_properties(get_properties(schema, root), root, compiled)
+    convert = jsonify_dict.get((type_, schema.get('format')))
+    if convert is None:
+        def convert(value):
+            raise ConvertionError(name, "convert %s failure. unknown format %s of %s" %
+                                  (name, (type_, schema.get('format')), value))
+    return name, _SCALAR, convert
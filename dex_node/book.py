@@ -0,0 +1,297 @@
+"""
+An in-process orderbook with price-time priority.
+
+Each side of the book keeps a sorted list of price levels, and each level
+is a FIFO queue of BookOrders. The OrderBook exposes the same operations as
+the Redis backed functions in interface.py, so match_orders can run against
+either one. When used, Redis only serves to persist and publish the book
+(see OrderBook.load and OrderBook.persist, and store.MemoryBookStore which
+writes every change through).
+"""
+import bisect
+from collections import deque
+import redis_keys
+import interface
+from interface import BookOrder, create_index_entry, create_order_key, decode_order
+
+SIDES = ('bid', 'ask')
+
+
+def _queue_key(order):
+    return order.priority, order.time
+
+
+class OrderBook(object):
+    """
+    A single pair orderbook held in memory.
+    """
+
+    def __init__(self, orders=None):
+        # ascending list of the prices with resting orders, per side
+        self._prices = {'bid': [], 'ask': []}
+        # price -> [live order count, deque of cells], per side. A cell is a
+        # one item list holding a BookOrder in priority, then arrival, order,
+        # or None once removed. Removed cells are dropped as they reach
+        # either end of the queue.
+        self._levels = {'bid': {}, 'ask': {}}
+        # str(order id) -> cell, so any order is replaced or removed in O(1)
+        self._cells = {}
+        if orders is not None:
+            self.insert_many_orders(orders)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __contains__(self, oid):
+        return str(oid) in self._cells
+
+    def _resting(self, oid):
+        cell = self._cells.get(str(oid))
+        return cell[0] if cell is not None else None
+
+    def _insert(self, order):
+        levels = self._levels[order.side]
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = [0, deque()]
+            bisect.insort(self._prices[order.side], order.price)
+        queue = level[1]
+        while len(queue) > 0 and queue[-1][0] is None:
+            queue.pop()
+        cell = [order]
+        if len(queue) == 0 or _queue_key(queue[-1][0]) <= _queue_key(order):
+            queue.append(cell)
+        else:
+            # out of order arrival, i.e. a higher priority order
+            key = _queue_key(order)
+            cells = [c for c in queue if c[0] is not None]
+            i = 0
+            while _queue_key(cells[i][0]) <= key:
+                i += 1
+            cells.insert(i, cell)
+            level[1] = deque(cells)
+        level[0] += 1
+        self._cells[str(order.id)] = cell
+
+    def _remove(self, resting, oid=None):
+        cell = self._cells.pop(str(resting.id) if oid is None else oid)
+        cell[0] = None
+        levels = self._levels[resting.side]
+        level = levels[resting.price]
+        level[0] -= 1
+        if level[0] == 0:
+            del levels[resting.price]
+            prices = self._prices[resting.side]
+            del prices[bisect.bisect_left(prices, resting.price)]
+        elif level[1][0] is cell:
+            level[1].popleft()
+
+    def _replace(self, resting, order):
+        # an order staying at the same price keeps its place in the queue
+        if resting.side == order.side and resting.price == order.price:
+            self._cells[str(order.id)][0] = order
+        else:
+            self._remove(resting)
+            self._insert(order)
+
+    def _changed(self, removed, added, trades=()):
+        """
+        Called with the orders removed and added by every change, as they
+        rest in the book. Subclasses override this to persist them.
+        """
+        pass
+
+    def get_order(self, oid):
+        """
+        Get a resting order by id.
+
+        :param oid: The order id
+        :rtype: BookOrder or None
+        """
+        return self._resting(oid)
+
+    def insert_order(self, order):
+        """
+        Insert a single order.
+        """
+        self.insert_many_orders([order])
+
+    def insert_many_orders(self, orders):
+        """
+        Insert a list of orders. An order already in the book is replaced.
+
+        :rtype: None
+        """
+        removed = []
+        added = []
+        for order in orders:
+            if order.side not in SIDES:
+                continue
+            resting = self._resting(order.id)
+            if resting is not None:
+                self._replace(resting, order)
+                removed.append(resting)
+            else:
+                self._insert(order)
+            added.append(order)
+        if len(added) > 0:
+            self._changed(removed, added)
+
+    def best_price(self, side='bid'):
+        """
+        Get the best price on one side of the book.
+
+        :param str side: The side 'bid' or 'ask'
+        :rtype: float or None
+        """
+        prices = self._prices[side]
+        if len(prices) == 0:
+            return None
+        return prices[-1] if side == 'bid' else prices[0]
+
+    def get_next_order(self, side='bid', pop=False):
+        """
+        Get the next order, using the following priorities in descending
+        order: price, priority, time, arrival.
+
+        :param str side: The side 'bid' or 'ask' to get from
+        :param bool pop: Remove the order after getting
+        :rtype: BookOrder or None
+        """
+        price = self.best_price(side)
+        if price is None:
+            return None
+        queue = self._levels[side][price][1]
+        while queue[0][0] is None:
+            queue.popleft()
+        order = queue[0][0]
+        if pop:
+            self.rem_order(side, order)
+        return order
+
+    def rem_order(self, side, order):
+        """
+        Remove an order from the book.
+
+        :param str side: The side 'bid' or 'ask' the order rests on
+        :param order: The BookOrder, or its id
+        :return: True if the order was found and removed
+        """
+        oid = str(order.id) if isinstance(order, BookOrder) else str(order)
+        resting = self._resting(oid)
+        if resting is None or resting.side != side:
+            return False
+        self._remove(resting, oid)
+        self._changed([resting], [])
+        return True
+
+    def cancel_order(self, oid):
+        """
+        Remove a resting order by id.
+
+        :param oid: The order id
+        :return: True if the order was found and removed
+        """
+        order = self._resting(oid)
+        if order is None:
+            return False
+        return self.rem_order(order.side, order)
+
+    def update_order(self, order, upsert=True):
+        """
+        Replace the resting order with the same id. An order staying at the
+        same price keeps its place in the queue.
+
+        :param BookOrder order: The new version of the order
+        :param bool upsert: Insert the order if it is not in the book already
+        """
+        resting = self._resting(order.id)
+        if resting is not None:
+            self._replace(resting, order)
+            self._changed([resting], [order])
+        elif upsert:
+            self.insert_order(order)
+
+    def apply_book_changes(self, removed, added, trades=()):
+        """
+        Remove and add orders. Orders both removed and added are updated in
+        place, keeping their place in the queue.
+
+        :param list removed: The BookOrders to remove
+        :param list added: The BookOrders to add
+        :param list trades: The Trades causing the changes, if any
+        """
+        added_ids = set(str(o.id) for o in added)
+        resting_removed = []
+        for order in removed:
+            oid = str(order.id)
+            cell = self._cells.get(oid)
+            if cell is None:
+                continue
+            resting_removed.append(cell[0])
+            if oid not in added_ids:
+                self._remove(cell[0], oid)
+        for order in added:
+            resting = self._resting(order.id)
+            if resting is not None:
+                self._replace(resting, order)
+            else:
+                self._insert(order)
+        self._changed(resting_removed, added, trades)
+
+    def iter_orders(self, side='bid'):
+        """
+        Iterate over the orders on one side of the book, best first.
+
+        :param str side: The side 'bid' or 'ask'
+        """
+        prices = self._prices[side]
+        if side == 'bid':
+            prices = reversed(prices)
+        for price in prices:
+            for cell in self._levels[side][price][1]:
+                if cell[0] is not None:
+                    yield cell[0]
+
+    def _load(self, raw_bids, raw_asks):
+        for side, raw in (('bid', raw_bids), ('ask', raw_asks)):
+            for o in raw:
+                order = decode_order(side, o)
+                resting = self._resting(order.id)
+                if resting is not None:
+                    self._replace(resting, order)
+                else:
+                    self._insert(order)
+
+    def load(self):
+        """
+        Load the orders resting in the Redis book into this one.
+        """
+        pipe = interface.red.pipeline()
+        for side in SIDES:
+            pipe.zrange(redis_keys.RKEY['book_side'] % side, 0, -1, withscores=True)
+        self._load(*pipe.execute())
+
+    def persist(self):
+        """
+        Replace the Redis book with the contents of this one, in a single
+        transaction, then rebuild the market data from it, i.e. to restore a
+        replayed journal.
+        """
+        interface.check_book_mode()
+        pipe = interface.red.pipeline()
+        pipe.delete(redis_keys.RKEY['book_index'])
+        for side in SIDES:
+            key = redis_keys.RKEY['book_side'] % side
+            pipe.delete(key)
+            members = []
+            for order in self.iter_orders(side):
+                members.append(order.price)
+                members.append(create_order_key(order))
+            if len(members) > 0:
+                pipe.zadd(key, *members)
+        if len(self._cells) > 0:
+            pipe.hmset(redis_keys.RKEY['book_index'],
+                       dict((c[0].id, create_index_entry(c[0])) for c in self._cells.values()))
+        pipe.execute()
+        interface.rebuild_market_data()
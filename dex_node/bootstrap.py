@@ -0,0 +1,147 @@
+"""
+Bulk load the Redis book from the SQL Order table, i.e. at a cold start
+after Redis was flushed.
+
+Resting orders are streamed out of the database with a server side cursor,
+converted in batches, and written in pipelines of CHUNK_SIZE orders, so
+that no single command blocks Redis for long. The market data is rebuilt
+once, at the end. The chunks are not journaled, so with interface.JOURNAL
+set, a journal checkpoint of the loaded book is taken instead.
+
+    python bootstrap.py sqlite:////tmp/dexnode.db --pair BTCUSD
+"""
+import argparse
+import sys
+import time
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+import redis_keys
+import interface
+import journal
+from interface import create_order_from_Order, get_depth_deltas
+
+# how many rows to fetch from the database at once
+BATCH_SIZE = 10000
+# how many orders to write to Redis per pipeline
+CHUNK_SIZE = 1000
+# the Order states with an amount left to fill
+RESTING_STATES = ('open', 'partial')
+
+
+def query_resting_orders(session, Order, pair=None):
+    """
+    Query the orders still resting, oldest first, by the state and filled
+    amount the trade consumer keeps up to date. Each row has the id, pair,
+    side, price, time and the amount left of an order.
+
+    :param session: The SQLAlchemy session to query with
+    :param Order: The Order model
+    :param str pair: Only query the orders of this pair
+    """
+    remaining = Order.amount - Order.filled
+    query = session.query(Order.id, Order.pair, Order.side, Order.price, Order.time,
+                          remaining.label('amount'))\
+                   .filter(Order.state.in_(RESTING_STATES), remaining > 0)
+    if pair is not None:
+        query = query.filter(Order.pair == pair)
+    # yield_per streams the rows with a server side cursor where the
+    # database driver supports one, instead of buffering them all
+    return query.order_by(Order.id).yield_per(BATCH_SIZE)
+
+
+def load_orders(rows, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Write orders to the Redis book in chunks, then rebuild the market data,
+    from the whole book if it already held orders, and checkpoint the
+    journal if kept.
+
+    :param rows: Order rows, see query_resting_orders
+    :param int chunk_size: The number of orders to write per pipeline
+    :param progress: Called with the number of orders written so far after
+                     every chunk
+    :return: the number of orders written
+    """
+    interface.check_book_mode()
+    # the depth of the loaded orders alone is only the whole depth when
+    # loading into an empty book
+    empty = not any(interface.red.exists(redis_keys.RKEY['book_side'] % side)
+                    for side in ('bid', 'ask'))
+    count = 0
+    depth = {}
+    chunk = []
+    for row in rows:
+        chunk.append(create_order_from_Order(row))
+        if len(chunk) >= chunk_size:
+            count += _write_chunk(chunk, depth)
+            chunk = []
+            if progress is not None:
+                progress(count)
+    if len(chunk) > 0:
+        count += _write_chunk(chunk, depth)
+        if progress is not None:
+            progress(count)
+    if empty:
+        interface.rebuild_market_data([(side, price, size) for (side, price), size in depth.items()])
+    else:
+        interface.rebuild_market_data()
+    if interface.JOURNAL:
+        # replays start from here, with the orders loaded
+        journal.checkpoint()
+    return count
+
+
+def _write_chunk(orders, depth):
+    members = {'bid': [], 'ask': []}
+    index = {}
+    for order in orders:
+        key = interface.create_order_key(order)
+        members[order.side].append(order.price)
+        members[order.side].append(key)
+        index[order.id] = redis_keys.RKEY['book_index_entry'] % (order.side, order.price, key)
+    pipe = interface.red.pipeline(transaction=False)
+    for side in ('bid', 'ask'):
+        if len(members[side]) > 0:
+            pipe.zadd(redis_keys.RKEY['book_side'] % side, *members[side])
+    pipe.hmset(redis_keys.RKEY['book_index'], index)
+    pipe.execute()
+    for side, price, delta in get_depth_deltas(added=orders):
+        depth[(side, price)] = depth.get((side, price), 0) + delta
+    return len(orders)
+
+
+def clear_book():
+    """
+    Delete the Redis book and its order index.
+    """
+    interface.red.delete(redis_keys.RKEY['book_bid'], redis_keys.RKEY['book_ask'],
+                         redis_keys.RKEY['book_index'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('db', help='the SQLAlchemy database URI')
+    parser.add_argument('--pair', default=interface.PAIR,
+                        help='the pair to load, $DEX_PAIR by default')
+    parser.add_argument('--replace', action='store_true', help='delete the current Redis book first')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='orders written per pipeline')
+    args = parser.parse_args()
+    try:
+        interface.get_pair_units(args.pair)
+    except ValueError as e:
+        parser.error(str(e))
+    from api.model import Order
+    interface.set_pair(args.pair)
+    if args.replace:
+        clear_book()
+    session = orm.sessionmaker(bind=sa.create_engine(args.db))()
+    start = time.time()
+
+    def progress(count):
+        sys.stderr.write("\rloaded %s orders, %.0f/s" % (count, count / max(time.time() - start, 1e-6)))
+
+    count = load_orders(query_resting_orders(session, Order, args.pair), args.chunk_size, progress)
+    sys.stderr.write("\nloaded %s orders in %.1fs\n" % (count, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Follow the L2 depth without polling Redis.
+
+With DEX_DEPTH_FEED set, see interface.DEPTH_FEED, every market data
+update publishes the levels it changed on redis_keys.DEPTH_CHANNEL, numbered with the book sequence number, and
+matchers publish a snapshot of the whole depth every SNAPSHOT_INTERVAL
+seconds. Both are JSON, i.e.
+
+    {"type": "delta", "seq": 42, "time": 1466000000.0,
+     "bids": [[price, size], ...], "asks": [[price, size], ...]}
+
+A delta holds the new size of each changed level, 0 once empty. A snapshot
+holds every level. DepthBook applies both in order and notices gaps in the
+sequence numbers, so a subscriber only needs a snapshot to start from and
+after a lost message.
+"""
+import json
+import interface
+import redis_keys
+
+
+class DepthBook(object):
+    """
+    A copy of the L2 depth kept up to date from depth feed messages.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.bids = {}
+        self.asks = {}
+
+    @property
+    def synced(self):
+        """
+        False until a snapshot is loaded, and again after a gap.
+        """
+        return self.seq is not None
+
+    def load(self, snapshot):
+        """
+        Replace the depth with a snapshot, see interface.get_depth_snapshot.
+        """
+        self.bids = dict((price, size) for price, size in snapshot['bids'] or [])
+        self.asks = dict((price, size) for price, size in snapshot['asks'] or [])
+        self.seq = snapshot['seq']
+
+    def apply(self, message):
+        """
+        Apply a decoded depth feed message.
+
+        :param dict message: A delta or a snapshot
+        :return: False if a delta was missed, in which case the book stays
+                 out of sync until the next snapshot is loaded
+        """
+        if message['type'] == 'snapshot':
+            if self.seq is None or message['seq'] >= self.seq:
+                self.load(message)
+            return True
+        if self.seq is None:
+            return False
+        if message['seq'] <= self.seq:
+            # already part of the snapshot loaded
+            return True
+        if message['seq'] != self.seq + 1:
+            self.seq = None
+            return False
+        for levels, changes in ((self.bids, message['bids']), (self.asks, message['asks'])):
+            for price, size in changes or []:
+                if size == 0:
+                    levels.pop(price, None)
+                else:
+                    levels[price] = size
+        self.seq = message['seq']
+        return True
+
+    def get_depth(self, count=None):
+        """
+        :param int count: The most levels per side, or None for all
+        :return: a dict of the seq, bids and asks, each side a list of
+                 [price, size] pairs, best first, like interface.get_depth
+        """
+        bids = sorted(self.bids.items(), reverse=True)[:count]
+        asks = sorted(self.asks.items())[:count]
+        return {'seq': self.seq, 'bids': [list(l) for l in bids], 'asks': [list(l) for l in asks]}
+
+
+def follow(pubsub=None, timeout=1.0):
+    """
+    Subscribe to DEPTH_CHANNEL and keep a DepthBook in sync, loading a
+    snapshot from Redis at the start and after every gap.
+
+    :param pubsub: The redis PubSub to subscribe with, instead of a new one
+    :param float timeout: The most seconds to wait for a message before
+                          yielding the unchanged book
+    :return: a generator yielding the DepthBook after every message
+    """
+    if pubsub is None:
+        pubsub = interface.red.pubsub()
+    # subscribe before reading the snapshot, so no delta falls in between
+    pubsub.subscribe(redis_keys.DEPTH_CHANNEL)
+    book = DepthBook()
+    book.load(interface.get_depth_snapshot())
+    while True:
+        msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if msg is not None and not book.apply(json.loads(msg['data'])):
+            book.load(interface.get_depth_snapshot())
+        yield book
@@ -1,43 +1,667 @@
 from collections import namedtuple
+from decimal import Decimal
 import json
+import os
 import uuid
 import redis
+from redis.exceptions import NoScriptError
+import struct
 import sys
+import threading
 import time
+import metrics
 import redis_keys
+import scripts
 
 sys.path.append('../')
 
-red = redis.StrictRedis()
-red_sub = red.pubsub()
+# Redis connection settings used by connect and Connection, i.e.
+# max_connections, socket_timeout, socket_connect_timeout,
+# socket_keepalive, socket_keepalive_options and retry_on_timeout. The
+# default client is only created on first use, so these can be set first.
+REDIS_URL = os.environ.get('DEX_REDIS_URL')
+REDIS_OPTIONS = {}
+
+
+class Connection(object):
+    """
+    A Redis client with a connection pool of its own, and the scripts
+    registered with it.
+    """
+
+    def __init__(self, url=None, **options):
+        """
+        :param str url: A redis:// URL, instead of REDIS_URL or localhost
+        :param options: ConnectionPool options, overriding REDIS_OPTIONS
+        """
+        url = url or REDIS_URL
+        kwargs = dict(REDIS_OPTIONS, **options)
+        if url is not None:
+            pool = redis.ConnectionPool.from_url(url, **kwargs)
+        else:
+            pool = redis.ConnectionPool(**kwargs)
+        self.red = redis.StrictRedis(connection_pool=pool)
+        self.red_sub = self.red.pubsub()
+        self.match_orders_script = self.red.register_script(scripts.MATCH_ORDERS)
+        self.market_data_script = self.red.register_script(scripts.UPDATE_MARKET_DATA)
+        self.journal_script = self.red.register_script(scripts.APPEND_JOURNAL)
+        self.read_market_data_script = self.red.register_script(scripts.READ_MARKET_DATA)
+        self.change_orders_script = self.red.register_script(scripts.CHANGE_ORDERS)
+        self.scripts = (self.match_orders_script, self.market_data_script, self.journal_script,
+                        self.read_market_data_script, self.change_orders_script)
+
+
+# the connection used outside of using blocks, created by connect
+_default = None
+# the connection of the innermost using block, per thread
+_active = threading.local()
+
+
+def connect(url=None, **options):
+    """
+    Replace the default Redis client used by every function in this module,
+    with a connection pool of its own.
+
+    :param str url: A redis:// URL, instead of REDIS_URL or localhost
+    :param options: ConnectionPool options, overriding REDIS_OPTIONS
+    :return: the new client
+    """
+    global _default
+    _default = Connection(url, **options)
+    return _default.red
+
+
+def get_connection():
+    """
+    :return: the Connection of the innermost using block of this thread, or
+             else the default one, created on first use
+    """
+    connection = getattr(_active, 'connection', None)
+    if connection is not None:
+        return connection
+    if _default is None:
+        connect()
+    return _default
+
+
+class using(object):
+    """
+    Run the functions of this module on another Connection within a with
+    block, in this thread, i.e.
+
+        with using(store.connection):
+            insert_order(order)
+
+    None keeps the current connection.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self._previous = getattr(_active, 'connection', None)
+        if self.connection is not None:
+            _active.connection = self.connection
+        return get_connection()
+
+    def __exit__(self, *exc):
+        _active.connection = self._previous
+
+
+class _Current(object):
+    """
+    Stands for an attribute of the current Connection, see get_connection.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(get_connection(), self._name), attr)
+
+    def __call__(self, *args, **kwargs):
+        return getattr(get_connection(), self._name)(*args, **kwargs)
+
+
+# the client and scripts of the current connection, for this module and as
+# interface.red etc. for the others
+red = _Current('red')
+red_sub = _Current('red_sub')
+match_orders_script = _Current('match_orders_script')
+market_data_script = _Current('market_data_script')
+journal_script = _Current('journal_script')
+read_market_data_script = _Current('read_market_data_script')
+change_orders_script = _Current('change_orders_script')
+
+
+def env_flag(name, default=False):
+    """
+    Read a boolean node setting from the environment, where every process
+    of a node, i.e. the API, the matchers, bootstrap and the trade consumer,
+    finds the same value.
+
+    :param str name: The variable, i.e. 'DEX_FIXED_POINT'
+    :return: True for '1', 'true' or 'yes', default when unset
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+# the pair whose book this process works on, see set_pair
+PAIR = os.environ.get('DEX_PAIR', 'BTCUSD')
+# When NAMESPACE is set, the Redis keys and channels are namespaced under
+# PAIR, so the books of several pairs can share one Redis server. Every
+# process of a node must agree, so it is read from DEX_NAMESPACE.
+NAMESPACE = env_flag('DEX_NAMESPACE')
+
+
+def set_pair(pair, namespace=None):
+    """
+    Choose the pair this process works on. With several pairs sharing a
+    Redis server, every process must choose its pair before touching the
+    book, as the supervisor does for its workers.
+
+    :param str pair: The pair, i.e. 'BTCUSD'
+    :param bool namespace: Override NAMESPACE. Only a node serving a single
+                           pair may do without.
+    """
+    global PAIR, NAMESPACE
+    PAIR = pair
+    if namespace is not None:
+        NAMESPACE = namespace
+    redis_keys.set_pair(pair if NAMESPACE else None)
+
+
+set_pair(PAIR)
+
 
 BookOrder = namedtuple('BookOrder', 'side price priority time amount id')
+# seq is the market data sequence number of the match, when known. With
+# bid_id and ask_id it identifies a trade, so a redelivered one is stored once.
+Trade = namedtuple('Trade', 'pair price amount bid_id ask_id seq')
+Trade.__new__.__defaults__ = (None,)
+
+# how many price levels per side get_depth returns
+MARKET_DEPTH = 20
+# in float mode, depth levels smaller than this are considered empty
+DUST = 1e-9
+# the most price levels rebuild_market_data applies per script call
+REBUILD_CHUNK = 1000
+
+# the format new book members are written in, 'text' or 'binary'
+MEMBER_FORMAT = 'text'
+MEMBER_FORMATS = ('text', 'binary')
+_member_v1 = struct.Struct(redis_keys.RKEY['book_member_v1'])
+
+
+def set_member_format(fmt):
+    """
+    Choose the format new book members are written in. Members already in
+    the book stay readable, see migrate_members to convert them.
+
+    :param str fmt: 'text' or 'binary'
+    """
+    global MEMBER_FORMAT
+    if fmt not in MEMBER_FORMATS:
+        raise ValueError("unknown member format %s" % fmt)
+    MEMBER_FORMAT = fmt
+
+
+# When FIXED_POINT is set, prices and amounts in the book, and in Trades,
+# are integers counted in the units below instead of floats. All processes
+# of a node must agree, so it is read from DEX_FIXED_POINT, and a Redis
+# book refuses writes in the other mode, see check_book_mode.
+FIXED_POINT = env_flag('DEX_FIXED_POINT')
+# per pair, how many integer units make one of the quote currency (price)
+# and one of the base currency (amount), e.g. cents and satoshis. Pairs are
+# added, or overridden, by DEX_PAIR_UNITS, see parse_pair_units.
+PAIR_UNITS = {
+    'BTCUSD': {'price': 100, 'amount': 100000000}
+}
+
+
+def parse_pair_units(value):
+    """
+    Read pair units from a setting like DEX_PAIR_UNITS, a comma separated
+    list of pair:price units:amount units, i.e.
+
+        ETHUSD:100:100000000,LTCBTC:100000000:100000000
+
+    :rtype: dict
+    :raises ValueError: if malformed
+    """
+    units = {}
+    for entry in value.split(','):
+        if entry.strip() == '':
+            continue
+        parts = entry.strip().split(':')
+        if len(parts) != 3:
+            raise ValueError("pair units %r are not pair:price:amount" % entry)
+        units[parts[0]] = {'price': int(parts[1]), 'amount': int(parts[2])}
+    return units
+
+
+PAIR_UNITS.update(parse_pair_units(os.environ.get('DEX_PAIR_UNITS', '')))
+
+
+def get_pair_units(pair):
+    """
+    :return: the price and amount units of pair, see PAIR_UNITS
+    :raises ValueError: if pair has none
+    """
+    units = PAIR_UNITS.get(pair)
+    if units is None:
+        raise ValueError("no units for the pair %s, add them to DEX_PAIR_UNITS" % pair)
+    return units
+
+
+# every process of a node needs the units of its pair, so fail at startup
+get_pair_units(PAIR)
+
+
+def set_fixed_point(enabled=True):
+    """
+    Switch this process between float and fixed-point integer numbers,
+    overriding DEX_FIXED_POINT. A Redis book is only ever written in one of
+    the two modes, see check_book_mode.
+
+    :param bool enabled: Use integer prices and amounts
+    """
+    global FIXED_POINT
+    FIXED_POINT = enabled
+    # claim or check the book again in the new mode
+    _checked_modes.clear()
+
+
+# (connection, book mode key, mode) triples check_book_mode found
+_checked_modes = set()
+
+
+class BookModeError(Exception):
+    """
+    The Redis book was written in the other number mode.
+    """
+
+
+def check_book_mode():
+    """
+    Make sure the Redis book is kept in the mode of this process, claiming
+    an empty book for it. Every function writing the book calls this first,
+    and it only costs a round trip once per connection, book and mode.
+
+    :raises BookModeError: if the book was written in the other mode
+    """
+    key = redis_keys.RKEY['book_mode']
+    mode = 'fixed' if FIXED_POINT else 'float'
+    checked = (get_connection(), key, mode)
+    if checked in _checked_modes:
+        return
+    pipe = red.pipeline()
+    pipe.setnx(key, mode)
+    pipe.get(key)
+    stored = pipe.execute()[1]
+    if stored != mode:
+        raise BookModeError("the book at %s is in %s mode, this process in %s mode" % (key, stored, mode))
+    _checked_modes.add(checked)
+
+
+# When JOURNAL is set, every change to the Redis book is also appended to
+# the journal, in the same transaction. See journal.py to replay it. A
+# journal missing the writes of any process replays a wrong book, so all
+# processes of a node must agree, and it is read from DEX_JOURNAL.
+JOURNAL = env_flag('DEX_JOURNAL')
+
+
+def set_journal(enabled=True):
+    """
+    Start or stop journaling the changes to the Redis book, overriding
+    DEX_JOURNAL.
+
+    :param bool enabled: Journal book changes
+    """
+    global JOURNAL
+    JOURNAL = enabled
+
+
+# When BOOK_INBOX is set, the orders inserted, updated, cancelled and
+# removed through this module are also queued on the book inbox, in the
+# same pipeline, for a matcher holding the book in memory to pick up. See
+# store.MemoryBookStore. The API and that matcher must agree, so it is read
+# from DEX_BOOK_INBOX.
+BOOK_INBOX = env_flag('DEX_BOOK_INBOX')
+# the most inbox events read_inbox takes at once
+INBOX_BATCH = 1000
+
+
+def set_book_inbox(enabled=True):
+    """
+    Start or stop queuing book changes on the book inbox, overriding
+    DEX_BOOK_INBOX.
+
+    :param bool enabled: Queue the changes made through this module
+    """
+    global BOOK_INBOX
+    BOOK_INBOX = enabled
+
+
+# When DEPTH_FEED is set, every market data update publishes the depth
+# levels it changed on redis_keys.DEPTH_CHANNEL. See depth_feed.py. It is
+# read from DEX_DEPTH_FEED, and off by default: it costs a PUBLISH on every
+# book change, for every process writing the book.
+DEPTH_FEED = env_flag('DEX_DEPTH_FEED')
+
+
+def set_depth_feed(enabled=True):
+    """
+    Start or stop publishing depth deltas, overriding DEX_DEPTH_FEED.
+
+    :param bool enabled: Publish the changed levels of every update
+    """
+    global DEPTH_FEED
+    DEPTH_FEED = enabled
+
+
+def to_number(value):
+    """
+    Cast a price or amount to the number type of the book.
+    """
+    if FIXED_POINT:
+        return int(round(float(value)))
+    return float(value)
+
+
+def to_units(pair, price=None, amount=None):
+    """
+    Convert a decimal price and amount to integer units of pair.
+
+    :return: a tuple of price and amount units, None for each not given
+    :raises ValueError: if either is more precise than the units, or pair
+                        has none
+    """
+    units = get_pair_units(pair)
+    if price is not None:
+        price = _to_units(price, units['price'], pair)
+    if amount is not None:
+        amount = _to_units(amount, units['amount'], pair)
+    return price, amount
+
+
+def _to_units(value, units, pair):
+    scaled = Decimal(str(value)) * units
+    if scaled != scaled.to_integral_value():
+        raise ValueError("%s is more precise than the units of %s" % (value, pair))
+    return int(scaled)
+
+
+def from_units(pair, price=None, amount=None):
+    """
+    Convert integer units of pair back to a decimal price and amount.
+
+    :return: a tuple of Decimal price and amount, None for each not given
+    :raises ValueError: if pair has no units
+    """
+    units = get_pair_units(pair)
+    if price is not None:
+        price = Decimal(price) / units['price']
+    if amount is not None:
+        amount = Decimal(amount) / units['amount']
+    return price, amount
+
+
+def queue_script(pipe, script, keys=(), args=()):
+    """
+    Queue a registered script on a pipeline by sha alone. Passing the
+    pipeline to the script instead costs a SCRIPT EXISTS round trip on
+    every execute.
+    """
+    return pipe.evalsha(script.sha, len(keys), *(tuple(keys) + tuple(args)))
+
+
+def execute_pipeline(pipe):
+    """
+    Execute a pipeline with queued scripts. Should Redis have forgotten the
+    scripts, i.e. after a restart, every other command of the pipeline ran
+    already, so the scripts are loaded again and only the script commands
+    that failed are retried.
+
+    :return: the results of the pipeline's commands
+    """
+    commands = list(pipe.command_stack)
+    results = pipe.execute(raise_on_error=False)
+    missing = [i for i, result in enumerate(results) if isinstance(result, NoScriptError)]
+    if len(missing) > 0:
+        for script in get_connection().scripts:
+            red.script_load(script.script)
+        for i in missing:
+            args, options = commands[i]
+            results[i] = red.execute_command(*args, **options)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def journal_events(removed=(), added=(), trades=()):
+    """
+    Describe book changes as journal events, which are lists of
+    ['fill', trade], ['insert', order], ['amend', order] or
+    ['remove', side, order id]. Trades and orders are lists of their fields,
+    with string ids.
+
+    :param list removed: The BookOrders removed, as they rested in the book
+    :param list added: The BookOrders added
+    :param list trades: The Trades causing the changes, if any
+    """
+    def fields(order):
+        return list(order[:-1]) + [str(order[-1])]
+    added_by_id = dict((str(order.id), order) for order in added)
+    removed_ids = set(str(order.id) for order in removed)
+    events = [['fill', list(trade[:3]) + [str(trade.bid_id), str(trade.ask_id)]] for trade in trades]
+    for order in removed:
+        if str(order.id) in added_by_id:
+            events.append(['amend', fields(added_by_id[str(order.id)])])
+        else:
+            events.append(['remove', order.side, str(order.id)])
+    for order in added:
+        if str(order.id) not in removed_ids:
+            events.append(['insert', fields(order)])
+    return events
+
+
+def queue_journal(pipe, removed=(), added=(), trades=()):
+    """
+    Queue the journal events of book changes on a pipeline, if JOURNAL is
+    set. See journal_events for the parameters.
+    """
+    if not JOURNAL:
+        return
+    events = journal_events(removed, added, trades)
+    if len(events) > 0:
+        queue_script(pipe, journal_script, [redis_keys.RKEY['journal_seq'], redis_keys.RKEY['journal']],
+                     [json.dumps(event) for event in events])
+
+
+def queue_inbox(pipe, removed=(), added=()):
+    """
+    Queue book changes on the book inbox, as journal events, if BOOK_INBOX
+    is set. See journal_events for the parameters.
+    """
+    if not BOOK_INBOX:
+        return
+    events = journal_events(removed, added)
+    if len(events) > 0:
+        pipe.rpush(redis_keys.RKEY['book_inbox'], *[json.dumps(event) for event in events])
+
+
+def read_inbox(count=INBOX_BATCH):
+    """
+    Take the oldest events off the book inbox.
+
+    :param int count: The most events to take
+    :return: a list of JSON decoded journal events, oldest first
+    """
+    pipe = red.pipeline()
+    pipe.lrange(redis_keys.RKEY['book_inbox'], 0, count - 1)
+    pipe.ltrim(redis_keys.RKEY['book_inbox'], count, -1)
+    return [json.loads(event) for event in pipe.execute()[0]]
 
 
 def create_book_order(side, price, priority, time, amount, oid=None):
     if oid is None:
         oid = uuid.uuid4()
-    return BookOrder(side, float(price), float(priority), float(time), float(amount), oid)
+    return BookOrder(side, to_number(price), float(priority), float(time), to_number(amount), oid)
 
 
 def create_order_from_Order(order):
+    """
+    Convert an SQL Order to a BookOrder. Order prices and amounts are
+    integer units of the order's pair, converted to decimals unless
+    FIXED_POINT is set.
+    """
     ti = time.mktime(order.time.timetuple())
-    return create_book_order(order.side, order.price, 0.0, 
-                             ti, order.amount, 
+    price, amount = order.price, order.amount
+    if not FIXED_POINT:
+        price, amount = from_units(order.pair, price, amount)
+    return create_book_order(order.side, price, 0.0, 
+                             ti, amount, 
                              oid=order.id)
 
 
+def market_data_keys():
+    """
+    :return: the keys the market data scripts take, see
+             scripts.MARKET_DATA_FUNCTIONS
+    """
+    return [redis_keys.RKEY['depth_side'] % 'bid', redis_keys.RKEY['depth_side'] % 'ask',
+            redis_keys.RKEY['depth_levels'] % 'bid', redis_keys.RKEY['depth_levels'] % 'ask',
+            redis_keys.RKEY['book_seq'], redis_keys.RKEY['volume']]
+
+
+def read_market_data(top=MARKET_DEPTH, publish=False):
+    """
+    Read the L2 depth, the 24h volume and the last trade price, as of the
+    sequence number of the latest market data update.
+
+    :param int top: The number of price levels per side to read, 0 for all
+    :param bool publish: Also publish the depth on DEPTH_CHANNEL, as a
+                         snapshot
+    :return: a dict of the seq, time, bids, asks, volume and last, each side
+             a list of [price, size] pairs, best first
+    """
+    data = json.loads(read_market_data_script(
+        keys=market_data_keys(), args=[top, time.time(), redis_keys.DEPTH_CHANNEL if publish else '']))
+    # Lua encodes empty lists as objects
+    data['bids'] = data['bids'] or []
+    data['asks'] = data['asks'] or []
+    return data
+
+
 def get_ticker():
     """
-    Return the current ticker based on the fully merged orderbook (merged
-    external + internal orderbook).
+    Return the current ticker: the best bid and ask, the last trade price
+    and the 24h volume.
+    """
+    data = read_market_data(1)
+    return {'seq': data['seq'], 'time': data['time'], 'volume': data['volume'], 'last': data['last'],
+            'bid': data['bids'][0][0] if len(data['bids']) > 0 else None,
+            'ask': data['asks'][0][0] if len(data['asks']) > 0 else None}
+
+
+def get_depth():
+    """
+    Return the top MARKET_DEPTH price levels per side, as lists of
+    [price, size] pairs.
+    """
+    data = read_market_data()
+    return dict((k, data[k]) for k in ('seq', 'time', 'bids', 'asks'))
+
+
+def get_depth_deltas(removed=(), added=()):
+    """
+    Aggregate the size changes per price level caused by removing and adding
+    orders.
+
+    :return: a list of (side, price, size change) tuples
+    """
+    deltas = {}
+    for order in removed:
+        deltas[(order.side, order.price)] = deltas.get((order.side, order.price), 0) - order.amount
+    for order in added:
+        deltas[(order.side, order.price)] = deltas.get((order.side, order.price), 0) + order.amount
+    return [(side, price, delta) for (side, price), delta in deltas.items() if delta != 0]
+
+
+def _market_data_args(trades=()):
+    # the time, dust, last price, volume and channel of a market data update
+    return [time.time(), 0 if FIXED_POINT else DUST, trades[-1].price if len(trades) > 0 else '',
+            sum(t.amount for t in trades), redis_keys.DEPTH_CHANNEL if DEPTH_FEED else '']
+
+
+@metrics.timed('interface.update_market_data')
+def update_market_data(deltas=(), trades=(), pipe=None):
+    """
+    Apply size changes to the L2 depth and record trades, with a new
+    sequence number. Only the changed levels are written, and published on
+    DEPTH_CHANNEL with that number, see DEPTH_FEED.
+
+    :param deltas: (side, price, size change) tuples, see get_depth_deltas
+    :param trades: The Trades executed, oldest first
+    :param pipe: A pipeline to queue the update on, instead of running it now
+    :return: the new sequence number, or the pipeline when given one
+    """
+    args = _market_data_args(trades)
+    for delta in deltas:
+        args.extend(delta)
+    if pipe is not None:
+        return queue_script(pipe, market_data_script, market_data_keys(), args)
+    return market_data_script(keys=market_data_keys(), args=args)
+
+
+def rebuild_market_data(deltas=None):
+    """
+    Recompute the L2 depth from the whole book, i.e. after the book was
+    written without maintaining it.
+
+    :param deltas: The sizes of every price level, as (side, price, size)
+                   tuples, when already known. Read from the book otherwise.
+    :return: the new sequence number
+    """
+    check_book_mode()
+    if deltas is None:
+        orders = []
+        for side in ('bid', 'ask'):
+            orders.extend(decode_order(side, raw)
+                          for raw in red.zscan_iter(redis_keys.RKEY['book_side'] % side))
+        deltas = get_depth_deltas(added=orders)
+    red.delete(redis_keys.RKEY['depth_side'] % 'bid', redis_keys.RKEY['depth_side'] % 'ask',
+               redis_keys.RKEY['depth_levels'] % 'bid', redis_keys.RKEY['depth_levels'] % 'ask')
+    # many levels are applied in several script calls, so that none blocks
+    # Redis for long
+    for i in range(0, max(len(deltas), 1), REBUILD_CHUNK):
+        seq = update_market_data(deltas[i:i + REBUILD_CHUNK])
+    # the deltas never removed the levels deleted above, so depth feed
+    # subscribers must start over from a snapshot
+    if DEPTH_FEED:
+        get_depth_snapshot(publish=True)
+    return seq
+
+
+def get_depth_snapshot(publish=False):
+    """
+    Read every level of the L2 depth, with the sequence number of the
+    market data update it is current at.
+
+    :param bool publish: Also publish the snapshot on DEPTH_CHANNEL
+    :return: a dict of the seq, time, bids and asks, each side a list of
+             [price, size] pairs, best first
     """
-    ticker = red.get(redis_keys.RKEY['ticker'])
-    if ticker is None:
-        raise Exception("no ticker available")
-    return json.loads(ticker)
+    data = read_market_data(0, publish)
+    return dict((k, data[k]) for k in ('type', 'seq', 'time', 'bids', 'asks'))
 
 
+@metrics.timed('interface.get_next_order')
 def get_next_order(side='bid', pop=False, raw=False):
     """
     Get the next order, using the following priorities in descending order: priority, price, time, amount, order id
@@ -53,14 +677,28 @@ def get_next_order(side='bid', pop=False, raw=False):
         raw_order = red.zrange(redis_keys.RKEY['book_side'] % side, 0, 0, withscores=True)
     if raw_order is None or len(raw_order) == 0:
         return None
-    if not raw:
-        order = decode_order(side, raw_order)
-    else:
-        order = raw_order
+    order = decode_order(side, raw_order)
     if pop:
-        order_key, price = get_order_details(raw_order)
-        rem_order(side, order_key)
-    return order
+        # by the member read, which may be in another format than
+        # create_order_key would write
+        _remove_order(side, raw_order[0][0], order)
+    return raw_order if raw else order
+
+
+@metrics.timed('interface.get_top_orders')
+def get_top_orders(count=1):
+    """
+    Get the best orders on both sides of the book in one round trip.
+
+    :param int count: The maximum number of orders to get per side
+    :return: a tuple of bids and asks, each a list in descending priority
+    """
+    pipe = red.pipeline(transaction=False)
+    pipe.zrevrange(redis_keys.RKEY['book_side'] % 'bid', 0, count - 1, withscores=True)
+    pipe.zrange(redis_keys.RKEY['book_side'] % 'ask', 0, count - 1, withscores=True)
+    raw_bids, raw_asks = pipe.execute()
+    return ([decode_order('bid', o) for o in raw_bids],
+            [decode_order('ask', o) for o in raw_asks])
 
 
 def get_order_details(raw_order):
@@ -68,38 +706,247 @@ def get_order_details(raw_order):
         return raw_order[0]
 
 
+@metrics.timed('interface.decode_order')
 def decode_order(side, raw_order):
     if len(raw_order) == 2 and isinstance(raw_order[0], str) and isinstance(raw_order[1], float):
         order_key = raw_order[0]
         price = raw_order[1]
     else:
         order_key, price = get_order_details(raw_order)
-    olist = order_key.split(redis_keys.SEP)
+    if order_key[:1] == redis_keys.MEMBER_V1:
+        olist = unpack_order_key(order_key)
+    else:
+        olist = order_key.split(redis_keys.SEP)
     return create_book_order(side, price, *olist)
 
 
+def pack_order_key(order, oid=None):
+    """
+    Encode an order as a binary book member. Order ids must be UUIDs or
+    non-negative integers.
+
+    :param str oid: str(order.id), when already known
+    """
+    oid = str(order.id) if oid is None else oid
+    if oid.isdigit():
+        idtype, idbytes = redis_keys.ID_INT, uuid.UUID(int=int(oid)).bytes
+    else:
+        idtype, idbytes = redis_keys.ID_UUID, uuid.UUID(oid).bytes
+    return _member_v1.pack(redis_keys.MEMBER_V1, order.priority, order.time,
+                           order.amount, idtype, idbytes)
+
+
+def unpack_order_key(order_key):
+    """
+    Decode a binary book member.
+
+    :return: a tuple of priority, time, amount and order id
+    """
+    version, priority, ti, amount, idtype, idbytes = _member_v1.unpack(order_key)
+    oid = uuid.UUID(bytes=idbytes)
+    if idtype == redis_keys.ID_INT:
+        return priority, ti, amount, str(oid.int)
+    return priority, ti, amount, str(oid)
+
+
+@metrics.timed('interface.rem_order')
 def rem_order(side, order_key):
-    red.zrem(redis_keys.RKEY['book_side'] % side, order_key)
+    """
+    Remove an order from the book.
+
+    :param str side: The side 'bid' or 'ask' the order rests on
+    :param order_key: The sorted set member, or the BookOrder itself, which
+                      is removed through the order index
+    """
+    if isinstance(order_key, BookOrder):
+        _remove_order(side, None, order_key)
+        return
+    price = red.zscore(redis_keys.RKEY['book_side'] % side, order_key)
+    if price is None:
+        return
+    _remove_order(side, order_key, decode_order(side, (order_key, price)))
+
+
+def _remove_order(side, order_key, order):
+    check_book_mode()
+    pipe = red.pipeline()
+    if order_key is None:
+        queue_book_changes(pipe, [order], ())
+    else:
+        pipe.zrem(redis_keys.RKEY['book_side'] % side, order_key)
+        pipe.hdel(redis_keys.RKEY['book_index'], order.id)
+        update_market_data(get_depth_deltas(removed=[order]), pipe=pipe)
+    queue_journal(pipe, removed=[order])
+    queue_inbox(pipe, removed=[order])
+    execute_pipeline(pipe)
+
+
+def get_index_entry(oid):
+    """
+    Look up where an order rests in the book.
+
+    :param oid: The order id
+    :return: a tuple of side, price and sorted set member, or None
+    """
+    entry = red.hget(redis_keys.RKEY['book_index'], oid)
+    if entry is None:
+        return None
+    side, price, order_key = entry.split(redis_keys.SEP, 2)
+    return side, float(price), order_key
 
 
+def create_index_entry(order):
+    return redis_keys.RKEY['book_index_entry'] % (order.side, order.price, create_order_key(order))
+
+
+@metrics.timed('interface.get_order')
+def get_order(oid):
+    """
+    Get a resting order by id.
+
+    :param oid: The order id
+    :rtype: BookOrder or None
+    """
+    entry = get_index_entry(oid)
+    if entry is None:
+        return None
+    side, price, order_key = entry
+    return decode_order(side, (order_key, price))
+
+
+@metrics.timed('interface.cancel_order')
+def cancel_order(oid):
+    """
+    Remove a resting order by id.
+
+    :param oid: The order id
+    :return: True if the order was found and removed
+    """
+    entry = get_index_entry(oid)
+    if entry is None:
+        return False
+    side, price, order_key = entry
+    order = decode_order(side, (order_key, price))
+    check_book_mode()
+    pipe = red.pipeline()
+    pipe.zrem(redis_keys.RKEY['book_side'] % side, order_key)
+    pipe.hdel(redis_keys.RKEY['book_index'], oid)
+    update_market_data(get_depth_deltas(removed=[order]), pipe=pipe)
+    queue_journal(pipe, removed=[order])
+    queue_inbox(pipe, removed=[order])
+    execute_pipeline(pipe)
+    return True
+
+
+@metrics.timed('interface.update_order')
 def update_order(order, upsert=True):
-    orders = red.zrangebyscore(redis_keys.RKEY['book_side'] % order.side, order.price, order.price, withscores=True)
-    # print "updating order %s" % repr(order)
-    found = False
-    for o in orders:
-        ord = decode_order(order.side, o)
-        if ord.id == str(order.id):
-            found = True
-            pipe = red.pipeline()
-            pipe.zrem(redis_keys.RKEY['book_side'] % order.side, o[0])
-            pipe.zadd(redis_keys.RKEY['book_side'] % order.side, order.price, create_order_key(order))
-            pipe.execute()
-    if not found and upsert:
-        red.zadd(redis_keys.RKEY['book_side'] % order.side, order)
+    """
+    Replace the resting order with the same id, found through the order
+    index.
+
+    :param BookOrder order: The new version of the order
+    :param bool upsert: Insert the order if it is not in the book already
+    """
+    entry = get_index_entry(order.id)
+    if entry is None:
+        if upsert:
+            insert_order(order)
+        return
+    side, price, order_key = entry
+    old = decode_order(side, (order_key, price))
+    check_book_mode()
+    pipe = red.pipeline()
+    pipe.zrem(redis_keys.RKEY['book_side'] % side, order_key)
+    pipe.zadd(redis_keys.RKEY['book_side'] % order.side, order.price, create_order_key(order))
+    pipe.hset(redis_keys.RKEY['book_index'], order.id, create_index_entry(order))
+    update_market_data(get_depth_deltas([old], [order]), pipe=pipe)
+    queue_journal(pipe, [old], [order])
+    queue_inbox(pipe, [old], [order])
+    pipe.publish(redis_keys.BOOK_CHANNEL, order.side)
+    execute_pipeline(pipe)
 
 
-def create_order_key(order):
-    return redis_keys.RKEY['book_member'] % (order.priority, order.time, order.amount, order.id)
+@metrics.timed('interface.apply_book_changes')
+def apply_book_changes(removed, added, trades=()):
+    """
+    Remove and add orders, and update the market data to match, in a
+    single script call, atomic on its own. With the journal, it runs in one
+    transaction with the journal entries.
+
+    :param list removed: The BookOrders to remove, as they rest in the book.
+                         They are found through the order index.
+    :param list added: The BookOrders to add
+    :param list trades: The Trades causing the changes, if any
+    """
+    check_book_mode()
+    if not JOURNAL:
+        queue_book_changes(None, removed, added, trades)
+        return
+    pipe = red.pipeline()
+    queue_book_changes(pipe, removed, added, trades)
+    queue_journal(pipe, removed, added, trades)
+    execute_pipeline(pipe)
+
+
+def queue_book_changes(pipe, removed, added, trades=()):
+    """
+    Queue the removal of orders by id, through the order index, and the
+    addition of others, with the market data update they make, on a
+    pipeline. Never remove orders by the member create_order_key would
+    write for them: the member in the book may be in another format, see
+    set_member_format.
+
+    :param pipe: The pipeline, or None to run the changes now
+    :param list removed: The BookOrders to remove
+    :param list added: The BookOrders to add
+    :param list trades: The Trades causing the changes, if any
+    :return: the new market data sequence number, or the pipeline when
+             given one
+    """
+    args = [redis_keys.SEP, len(removed), len(added)] + _market_data_args(trades)
+    args.extend(str(order.id) for order in removed)
+    for order in added:
+        args.extend((order.side, order.price, create_order_key(order), str(order.id)))
+    for delta in get_depth_deltas(removed, added):
+        args.extend(delta)
+    keys = [redis_keys.RKEY['book_bid'], redis_keys.RKEY['book_ask'],
+            redis_keys.RKEY['book_index']] + market_data_keys()
+    if pipe is None:
+        return change_orders_script(keys=keys, args=args)
+    return queue_script(pipe, change_orders_script, keys, args)
+
+
+def create_order_key(order, oid=None):
+    if MEMBER_FORMAT == 'binary':
+        return pack_order_key(order, oid)
+    return redis_keys.RKEY['book_member'] % (order.priority, order.time, order.amount,
+                                             order.id if oid is None else oid)
+
+
+def migrate_members(batch=1000):
+    """
+    Rewrite every book member still in another format into MEMBER_FORMAT.
+
+    :param int batch: The number of members to rewrite per pipeline
+    :return: the number of members rewritten
+    """
+    count = 0
+    for side in ('bid', 'ask'):
+        key = redis_keys.RKEY['book_side'] % side
+        pipe = red.pipeline()
+        for raw in red.zscan_iter(key):
+            order = decode_order(side, raw)
+            new_key = create_order_key(order)
+            if new_key == raw[0]:
+                continue
+            pipe.zrem(key, raw[0])
+            pipe.zadd(key, order.price, new_key)
+            pipe.hset(redis_keys.RKEY['book_index'], order.id, create_index_entry(order))
+            count += 1
+            if count % batch == 0:
+                pipe.execute()
+        pipe.execute()
+    return count
 
 
 def insert_order(order, **kwargs):
@@ -109,26 +956,46 @@ def insert_order(order, **kwargs):
     insert_many_orders([order], **kwargs)
 
 
+@metrics.timed('interface.insert_many_orders')
 def insert_many_orders(orders):
     """
-    Insert a list of orders.
+    Insert a list of orders, update the market data, and notify
+    BOOK_CHANNEL subscribers.
 
     :rtype: None
     """
     bids = []
     asks = []
+    index = {}
+    entry = redis_keys.RKEY['book_index_entry']
     for order in orders:
+        # the id and member are encoded once, for both the sorted set and
+        # the index
+        oid = str(order.id)
+        key = create_order_key(order, oid)
         if order.side == 'bid':
             bids.append(order.price)
-            bids.append(create_order_key(order))
-        if order.side == 'ask':
+            bids.append(key)
+        elif order.side == 'ask':
             asks.append(order.price)
-            asks.append(create_order_key(order))
+            asks.append(key)
+        index[oid] = entry % (order.side, order.price, key)
 
+    # the journal must be written in the same transaction as the book
+    check_book_mode()
+    pipe = red.pipeline(transaction=JOURNAL)
+    if len(index) > 0:
+        pipe.hmset(redis_keys.RKEY['book_index'], index)
+        update_market_data(get_depth_deltas(added=orders), pipe=pipe)
+        queue_journal(pipe, added=orders)
     if len(bids) > 0:
-        #print "zadding %s" % bids
-        red.zadd(redis_keys.RKEY['book_side'] % 'bid', *bids)
+        pipe.zadd(redis_keys.RKEY['book_side'] % 'bid', *bids)
+        pipe.publish(redis_keys.BOOK_CHANNEL, 'bid')
     if len(asks) > 0:
-        #print "zadding %s" % asks
-        red.zadd(redis_keys.RKEY['book_side'] % 'ask', *asks)
+        pipe.zadd(redis_keys.RKEY['book_side'] % 'ask', *asks)
+        pipe.publish(redis_keys.BOOK_CHANNEL, 'ask')
+    # queued last, so a matcher loading the book in between reads the orders
+    # at worst twice, and never misses them
+    queue_inbox(pipe, added=orders)
+    execute_pipeline(pipe)
 
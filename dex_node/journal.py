@@ -0,0 +1,193 @@
+"""
+The journal of book changes, and the tools to checkpoint and replay it.
+
+With DEX_JOURNAL=1 in the environment of every process of the node, see
+interface.JOURNAL, every change to the Redis book is appended to a Redis
+list in the same transaction as the change itself, as a sequence
+number followed by a JSON event, see interface.journal_events. Replaying
+the events after the latest checkpoint rebuilds the book and the trades up
+to any sequence number, so recovery only reads the journal tail.
+
+    python journal.py --checkpoint --trim
+    python journal.py --seq 1200 --trades
+"""
+import argparse
+import json
+import sys
+import redis_keys
+import interface
+from interface import Trade, create_book_order, to_number
+from book import OrderBook
+
+# how many entries to read from Redis at once
+READ_BATCH = 1000
+
+
+def get_seq():
+    """
+    :return: the sequence number of the latest journal entry, 0 if none
+    """
+    return int(interface.red.get(redis_keys.RKEY['journal_seq']) or 0)
+
+
+def _first_seq():
+    entry = interface.red.lindex(redis_keys.RKEY['journal'], 0)
+    if entry is None:
+        return None
+    return int(entry.split(' ', 1)[0])
+
+
+def decode_event(event):
+    """
+    Convert the trade or order of a JSON decoded journal event to a Trade
+    or a BookOrder.
+    """
+    if event[0] == 'fill':
+        pair, price, amount, bid_id, ask_id = event[1]
+        return ['fill', Trade(pair, to_number(price), to_number(amount), bid_id, ask_id)]
+    elif event[0] in ('insert', 'amend'):
+        return [event[0], create_book_order(*event[1])]
+    return event
+
+
+def read_journal(start=1, stop=None):
+    """
+    Iterate over the journal entries from sequence number start to stop,
+    both included.
+
+    :param int start: The first sequence number to read
+    :param int stop: The last sequence number to read, None for the latest
+    :return: a generator of (sequence number, event) tuples
+    """
+    first = _first_seq()
+    if first is None:
+        return
+    if start < first:
+        raise ValueError("the journal starts at %s, after %s" % (first, start))
+    pos = start - first
+    while True:
+        end = pos + READ_BATCH - 1
+        if stop is not None:
+            end = min(end, stop - first)
+        if end < pos:
+            return
+        entries = interface.red.lrange(redis_keys.RKEY['journal'], pos, end)
+        for entry in entries:
+            seq, event = entry.split(' ', 1)
+            yield int(seq), decode_event(json.loads(event))
+        if len(entries) < end - pos + 1:
+            return
+        pos = end + 1
+
+
+def apply_event(book, trades, event):
+    """
+    Apply one decoded journal event to an OrderBook and a list of Trades.
+    """
+    if event[0] == 'fill':
+        trades.append(event[1])
+    elif event[0] == 'insert':
+        book.insert_order(event[1])
+    elif event[0] == 'amend':
+        book.update_order(event[1])
+    elif event[0] == 'remove':
+        book.cancel_order(event[2])
+    else:
+        raise ValueError("unknown journal event %s" % event[0])
+
+
+def checkpoint(trim=False):
+    """
+    Save the whole Redis book as of the latest journal entry, so replays can
+    start from it.
+
+    :param bool trim: Drop the journal entries the checkpoint includes
+    :return: the sequence number of the checkpoint
+    """
+    pipe = interface.red.pipeline()
+    pipe.get(redis_keys.RKEY['journal_seq'])
+    pipe.zrange(redis_keys.RKEY['book_side'] % 'bid', 0, -1, withscores=True)
+    pipe.zrange(redis_keys.RKEY['book_side'] % 'ask', 0, -1, withscores=True)
+    seq, bids, asks = pipe.execute()
+    seq = int(seq or 0)
+    orders = [interface.decode_order('bid', raw) for raw in bids] + \
+             [interface.decode_order('ask', raw) for raw in asks]
+    # journal entries are only ever appended, so positions from the head are
+    # still valid here
+    first = _first_seq()
+    pipe = interface.red.pipeline()
+    pipe.set(redis_keys.RKEY['journal_checkpoint'],
+             json.dumps({'seq': seq, 'orders': [list(o[:-1]) + [str(o.id)] for o in orders]}))
+    if trim and first is not None and seq >= first:
+        pipe.ltrim(redis_keys.RKEY['journal'], seq - first + 1, -1)
+    pipe.execute()
+    return seq
+
+
+def replay(seq=None):
+    """
+    Rebuild the book and the trades, from the latest usable checkpoint and
+    the journal entries after it.
+
+    :param int seq: The sequence number to replay up to, None for the latest
+    :return: a tuple of the OrderBook, the Trades since the checkpoint and
+             the sequence number reached
+    """
+    book = OrderBook()
+    start = 0
+    saved = interface.red.get(redis_keys.RKEY['journal_checkpoint'])
+    if saved is not None:
+        saved = json.loads(saved)
+        if seq is None or saved['seq'] <= seq:
+            book.insert_many_orders([create_book_order(*o) for o in saved['orders']])
+            start = saved['seq']
+    trades = []
+    reached = start
+    for reached, event in read_journal(start + 1, seq):
+        apply_event(book, trades, event)
+    return book, trades, reached
+
+
+def restore(book, seq):
+    """
+    Replace the Redis book with a replayed one, dropping the journal entries
+    after seq.
+
+    :param OrderBook book: The book replayed up to seq
+    :param int seq: The sequence number the book was replayed to
+    """
+    book.persist()
+    first = _first_seq()
+    pipe = interface.red.pipeline()
+    if first is not None:
+        pipe.ltrim(redis_keys.RKEY['journal'], 0, seq - first)
+    pipe.set(redis_keys.RKEY['journal_seq'], seq)
+    pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--pair', help='the pair whose book to use, $DEX_PAIR by default')
+    parser.add_argument('--seq', type=int, help='replay up to this sequence number, by default the latest')
+    parser.add_argument('--trades', action='store_true', help='print the replayed trades, one JSON list per line')
+    parser.add_argument('--restore', action='store_true',
+                        help='write the replayed book to Redis, dropping any later journal entries')
+    parser.add_argument('--checkpoint', action='store_true', help='checkpoint the Redis book instead of replaying')
+    parser.add_argument('--trim', action='store_true', help='drop the journal entries the checkpoint includes')
+    args = parser.parse_args()
+    if args.pair is not None:
+        interface.set_pair(args.pair)
+    if args.checkpoint:
+        print "checkpoint at %s" % checkpoint(args.trim)
+        return
+    book, trades, seq = replay(args.seq)
+    if args.trades:
+        for trade in trades:
+            print json.dumps(trade)
+    if args.restore:
+        restore(book, seq)
+    sys.stderr.write("replayed to %s: %s orders, %s trades\n" % (seq, len(book), len(trades)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Latency histograms and counters for the hot paths.
+
+Functions decorated with timed, and blocks run under timing, record their
+latency into a histogram per name while instrumentation is enabled. It is
+disabled by default, when a timed call only costs a global lookup more.
+
+Latencies are recorded in microseconds into HDR style histograms: values
+are exact below 2**PRECISION_BITS, and above it fall in buckets whose
+width is at most 1/2**(PRECISION_BITS - 1) of their value. Percentiles are
+accurate to that ratio whatever the range, in a few hundred counters.
+
+The summaries are exposed in the Prometheus text format by render_text,
+served by serve or the API's /metrics, and logged by log_summary.
+"""
+import BaseHTTPServer
+import functools
+import threading
+import time
+
+ENABLED = False
+# histogram precision, see the module docstring: 5 bits keeps values
+# within about 6%
+PRECISION_BITS = 5
+# the percentiles of every summary
+PERCENTILES = (50, 90, 99, 99.9)
+# the least seconds between two lines logged by log_periodically
+LOG_INTERVAL = 60.0
+# prefixes every name rendered by render_text
+PREFIX = 'dex_'
+
+
+def enable(enabled=True):
+    """
+    Start or stop recording latencies and counts in this process.
+
+    :param bool enabled: Record
+    """
+    global ENABLED
+    ENABLED = enabled
+
+
+class Histogram(object):
+    """
+    A latency histogram with a bounded relative error, see the module
+    docstring.
+    """
+
+    def __init__(self, precision_bits=PRECISION_BITS):
+        self.precision_bits = precision_bits
+        self._sub_buckets = 1 << precision_bits
+        self._half = self._sub_buckets >> 1
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return shift * self._half + (value >> shift)
+
+    def _highest(self, index):
+        # the highest value counted in the bucket at index
+        if index < self._sub_buckets:
+            return index
+        shift = index // self._half - 1
+        return ((index - shift * self._half + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        :param int value: A non-negative latency, in microseconds
+        """
+        value = max(int(value), 0)
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, pct):
+        """
+        :param float pct: The percentile, from 0 to 100
+        :return: the highest value equivalent to the one at pct, or 0 when
+                 empty
+        """
+        with self._lock:
+            counts = sorted(self._counts.items())
+            count = self.count
+        rank = max(int(round(pct / 100.0 * count)), 1)
+        seen = 0
+        for index, n in counts:
+            seen += n
+            if seen >= rank:
+                return min(self._highest(index), self.max)
+        return 0
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self.count = self.total = self.max = 0
+
+    def get_summary(self):
+        """
+        :return: a dict of the count, sum, mean, max and PERCENTILES
+        """
+        summary = dict(('p%s' % pct, self.percentile(pct)) for pct in PERCENTILES)
+        summary.update({'count': self.count, 'sum': self.total, 'max': self.max,
+                        'mean': self.total / float(self.count) if self.count else 0})
+        return summary
+
+
+# the histograms and counters of this process, by name
+HISTOGRAMS = {}
+COUNTERS = {}
+_lock = threading.Lock()
+
+
+def get_histogram(name):
+    histogram = HISTOGRAMS.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = HISTOGRAMS.setdefault(name, Histogram())
+    return histogram
+
+
+def record(name, seconds):
+    """
+    Record a latency, if enabled.
+
+    :param str name: The histogram to record in
+    :param float seconds: The latency
+    """
+    if ENABLED:
+        get_histogram(name).record(seconds * 1000000)
+
+
+def incr(name, count=1):
+    """
+    Add to a counter, if enabled.
+    """
+    if ENABLED:
+        with _lock:
+            COUNTERS[name] = COUNTERS.get(name, 0) + count
+
+
+def timed(name):
+    """
+    Decorate a function to record the latency of its calls as name.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                get_histogram(name).record((time.time() - start) * 1000000)
+        return wrapper
+    return decorate
+
+
+class timing(object):
+    """
+    Record the latency of a with block as name, i.e.
+
+        with timing('matcher.publish'):
+            publisher.add(trades)
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        record(self.name, time.time() - self.start)
+
+
+def get_summary():
+    """
+    :return: a dict of the histogram summaries and of the counters
+    """
+    return {'histograms': dict((name, h.get_summary()) for name, h in HISTOGRAMS.items()),
+            'counters': dict(COUNTERS)}
+
+
+def reset():
+    """
+    Clear every histogram and counter.
+    """
+    with _lock:
+        for histogram in HISTOGRAMS.values():
+            histogram.reset()
+        COUNTERS.clear()
+
+
+def _metric_name(name):
+    return PREFIX + name.replace('.', '_')
+
+
+def render_text():
+    """
+    Render the histograms as Prometheus summaries, in seconds, and the
+    counters as Prometheus counters.
+
+    :rtype: str
+    """
+    lines = []
+    for name, histogram in sorted(HISTOGRAMS.items()):
+        metric = _metric_name(name) + '_seconds'
+        summary = histogram.get_summary()
+        lines.append('# TYPE %s summary' % metric)
+        for pct in PERCENTILES:
+            lines.append('%s{quantile="%s"} %.6f' % (metric, pct / 100.0, summary['p%s' % pct] / 1e6))
+        lines.append('%s_sum %.6f' % (metric, summary['sum'] / 1e6))
+        lines.append('%s_count %d' % (metric, summary['count']))
+    for name, count in sorted(COUNTERS.items()):
+        metric = _metric_name(name) + '_total'
+        lines.append('# TYPE %s counter' % metric)
+        lines.append('%s %d' % (metric, count))
+    return '\n'.join(lines) + '\n'
+
+
+def log_summary(logger):
+    """
+    Log one line with the count, p50, p99 and max microseconds of every
+    histogram, and every counter.
+    """
+    parts = []
+    for name, histogram in sorted(HISTOGRAMS.items()):
+        summary = histogram.get_summary()
+        parts.append('%s n=%d p50=%d p99=%d max=%d' % (name, summary['count'], summary['p50'],
+                                                       summary['p99'], summary['max']))
+    parts.extend('%s=%d' % item for item in sorted(COUNTERS.items()))
+    logger.info('metrics: %s', '; '.join(parts))
+
+
+_logged_at = time.time()
+
+
+def log_periodically(logger, interval=LOG_INTERVAL):
+    """
+    Log a summary if enabled and the last one is interval seconds old.
+    """
+    global _logged_at
+    if ENABLED and time.time() - _logged_at >= interval:
+        _logged_at = time.time()
+        log_summary(logger)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_text()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host=''):
+    """
+    Serve render_text over HTTP on port, from a daemon thread, for the
+    processes without an API to scrape.
+
+    :return: the server
+    """
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,228 @@
+"""
+Aggregate external tickers into a price index, and compare it with ours.
+
+External feeds publish their tickers as JSON on TICKER_EXTERNAL_CHANNEL,
+i.e. {"source": "bitstamp", "bid": 240.1, "ask": 240.3}, with a "last"
+price instead or as well. The external index is the mean price of the
+sources heard from in the last SOURCE_TTL seconds, and its mean and
+standard deviation over the last WINDOW seconds are kept as well. Every
+update costs O(1), amortized, so one process keeps up with many feeds.
+
+Every PUBLISH_INTERVAL seconds the internal index, the mid of our own
+ticker, is published on INDEX_EXTERNAL_CHANNEL next to the external one,
+with warning=True when they diverge by more than MAX_DIVERGENCE.
+
+    python price_index.py --pair BTCUSD
+"""
+import argparse
+from collections import deque, OrderedDict
+import json
+import math
+import time
+import interface
+import redis_keys
+
+# the most seconds a source's last price counts towards the index
+SOURCE_TTL = 30.0
+# the seconds of external index history the rolling statistics cover
+WINDOW = 300.0
+# the relative difference of the internal and external index to warn at
+MAX_DIVERGENCE = 0.02
+# how often to publish the indexes, in seconds
+PUBLISH_INTERVAL = 1.0
+
+
+def ticker_price(ticker):
+    """
+    :param dict ticker: A ticker with a bid and ask, or a last price
+    :return: the mid price, else the last price, or None
+    """
+    bid, ask = ticker.get('bid'), ticker.get('ask')
+    if bid is not None and ask is not None:
+        return (float(bid) + float(ask)) / 2
+    last = ticker.get('last')
+    return float(last) if last is not None else None
+
+
+class IndexAggregator(object):
+    """
+    The external index and its rolling statistics, updated incrementally.
+    """
+
+    def __init__(self, source_ttl=SOURCE_TTL, window=WINDOW, max_divergence=MAX_DIVERGENCE):
+        """
+        :param float source_ttl: The most seconds a source's price counts
+        :param float window: The seconds the rolling statistics cover
+        :param float max_divergence: The relative divergence to warn at
+        """
+        self.source_ttl = source_ttl
+        self.window = window
+        self.max_divergence = max_divergence
+        # source -> (time, price), least recently updated first
+        self._sources = OrderedDict()
+        self._total = 0.0
+        # (time, index) samples in the window, and their sums relative to
+        # the first index seen, which keeps the variance numerically stable
+        self._samples = deque()
+        self._shift = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+    @property
+    def external(self):
+        """
+        The external index, or None without live sources.
+        """
+        if len(self._sources) == 0:
+            return None
+        return self._total / len(self._sources)
+
+    def add_ticker(self, source, price, now=None):
+        """
+        Record the latest price of a source.
+
+        :param str source: The name of the external feed
+        :param float price: Its price, see ticker_price
+        :param float now: The current time, instead of time.time()
+        """
+        now = time.time() if now is None else now
+        old = self._sources.pop(source, None)
+        if old is not None:
+            self._total -= old[1]
+        self._sources[source] = (now, price)
+        self._total += price
+        self._expire(now)
+        self._add_sample(now, self.external)
+
+    def _expire(self, now):
+        while len(self._sources) > 0:
+            source, (updated, price) = next(self._sources.iteritems())
+            if now - updated <= self.source_ttl:
+                break
+            del self._sources[source]
+            self._total -= price
+        if len(self._sources) == 0:
+            # drop the rounding errors accumulated in the running total
+            self._total = 0.0
+        while len(self._samples) > 0 and now - self._samples[0][0] > self.window:
+            value = self._samples.popleft()[1] - self._shift
+            self._sum -= value
+            self._sumsq -= value * value
+
+    def _add_sample(self, now, index):
+        if index is None:
+            return
+        if self._shift is None or len(self._samples) == 0:
+            self._shift, self._sum, self._sumsq = index, 0.0, 0.0
+        value = index - self._shift
+        self._samples.append((now, index))
+        self._sum += value
+        self._sumsq += value * value
+
+    def stats(self, now=None):
+        """
+        :return: a tuple of the mean and standard deviation of the external
+                 index over the window, and the number of samples
+        """
+        self._expire(time.time() if now is None else now)
+        count = len(self._samples)
+        if count == 0:
+            return None, None, 0
+        mean = self._sum / count
+        variance = max(self._sumsq / count - mean * mean, 0.0)
+        return self._shift + mean, math.sqrt(variance), count
+
+    def get_index(self, internal, now=None):
+        """
+        Compare the internal index with the external one.
+
+        :param float internal: The internal index, or None
+        :param float now: The current time, instead of time.time()
+        :return: a dict of the internal and external index, the window
+                 mean and stdev, the number of sources, the divergence and
+                 whether it exceeds max_divergence
+        """
+        now = time.time() if now is None else now
+        mean, stdev, count = self.stats(now)
+        external = self.external
+        divergence = None
+        if internal is not None and external is not None and external != 0:
+            divergence = abs(internal - external) / external
+        return {'time': now, 'internal': internal, 'external': external, 'mean': mean,
+                'stdev': stdev, 'sources': len(self._sources), 'divergence': divergence,
+                'warning': divergence is not None and divergence > self.max_divergence}
+
+
+def get_internal_index():
+    """
+    :return: the mid price of our own ticker, or None without one
+    """
+    try:
+        ticker = interface.get_ticker()
+    except Exception:
+        return None
+    price = ticker_price(ticker)
+    if price is not None and interface.FIXED_POINT:
+        price = float(interface.from_units(interface.PAIR, price=price)[0])
+    return price
+
+
+def publish_index(aggregator):
+    """
+    Publish the internal and external index on INDEX_EXTERNAL_CHANNEL.
+
+    :return: the index published
+    """
+    index = aggregator.get_index(get_internal_index())
+    interface.red.publish(redis_keys.INDEX_EXTERNAL_CHANNEL, json.dumps(index))
+    return index
+
+
+def run(aggregator, pubsub=None, interval=PUBLISH_INTERVAL):
+    """
+    Consume the external tickers and publish the indexes until interrupted.
+
+    :param IndexAggregator aggregator: Where to aggregate the tickers
+    :param pubsub: The redis PubSub to subscribe with, instead of a new one
+    :param float interval: How often to publish, in seconds
+    """
+    if pubsub is None:
+        pubsub = interface.red.pubsub()
+    pubsub.subscribe(redis_keys.TICKER_EXTERNAL_CHANNEL)
+    publish_at = time.time() + interval
+    while True:
+        msg = pubsub.get_message(ignore_subscribe_messages=True,
+                                 timeout=max(publish_at - time.time(), 0))
+        if msg is not None:
+            try:
+                ticker = json.loads(msg['data'])
+                price = ticker_price(ticker)
+            except (ValueError, TypeError, AttributeError):
+                # skip malformed tickers
+                price = None
+            if price is not None:
+                aggregator.add_ticker(ticker.get('source'), price)
+        if time.time() >= publish_at:
+            publish_index(aggregator)
+            publish_at = time.time() + interval
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--pair', help='the pair to index, $DEX_PAIR by default')
+    parser.add_argument('--interval', type=float, default=PUBLISH_INTERVAL, help='seconds between publications')
+    parser.add_argument('--window', type=float, default=WINDOW, help='seconds of rolling statistics')
+    parser.add_argument('--max-divergence', type=float, default=MAX_DIVERGENCE,
+                        help='relative divergence to warn at')
+    args = parser.parse_args()
+    if args.pair is not None:
+        interface.set_pair(args.pair)
+    try:
+        run(IndexAggregator(window=args.window, max_divergence=args.max_divergence),
+            interval=args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Batched publication of Trades to the message queue.
+
+A message carries either a single Trade, or a batch of them, encoded as
+JSON or in a compact binary format. decode_trades reads every variant.
+Whether prices and amounts are fixed-point units travels with the message,
+in the binary flags or the units parameter of its content type, see
+content_type and is_fixed_point.
+"""
+import json
+import struct
+import time
+import interface
+import metrics
+from interface import Trade
+
+ENCODINGS = ('json', 'binary')
+CONTENT_TYPES = {'json': 'text/plain', 'binary': 'application/octet-stream'}
+# the content type parameter naming the units of a message, 'fixed' or 'float'
+UNITS_PARAMETER = 'units'
+
+# binary messages start with TRADES_V1, then a header, the pair and one
+# record per trade. Each record holds the price and amount, followed by the
+# bid and ask ids, then the seq if FLAG_SEQ is set. The pair and the ids are
+# each prefixed by their length in one byte.
+TRADES_V1 = '\x02'
+FLAG_FIXED_POINT = 1
+FLAG_SEQ = 2
+_header = struct.Struct('>cBH')  # version, flags, count
+_float_record = struct.Struct('>dd')
+_fixed_record = struct.Struct('>qq')
+_seq = struct.Struct('>Q')
+
+
+def content_type(encoding, fixed=None):
+    """
+    :param str encoding: 'json' or 'binary'
+    :param bool fixed: Whether prices and amounts are fixed-point units,
+                       interface.FIXED_POINT by default
+    :return: the content type to publish messages in encoding with
+    """
+    if fixed is None:
+        fixed = interface.FIXED_POINT
+    return '%s; %s=%s' % (CONTENT_TYPES[encoding], UNITS_PARAMETER, 'fixed' if fixed else 'float')
+
+
+def is_fixed_point(body, content_type=None):
+    """
+    Tell whether the prices and amounts of a message are fixed-point units.
+    Binary messages say so in their flags, JSON ones in the units parameter
+    of their content type, and are decimals without one.
+
+    :param str body: The message body
+    :param str content_type: The content type the message was published with
+    :rtype: bool
+    """
+    if body[:1] == TRADES_V1:
+        return bool(_header.unpack_from(body)[1] & FLAG_FIXED_POINT)
+    for param in (content_type or '').split(';')[1:]:
+        name, sep, value = param.partition('=')
+        if name.strip() == UNITS_PARAMETER:
+            return value.strip() == 'fixed'
+    return False
+
+
+def _length(value):
+    if len(value) > 255:
+        raise ValueError("%r is too long to encode" % value)
+    return chr(len(value))
+
+
+def encode_trades(trades, encoding='json'):
+    """
+    Encode a batch of Trades of a single pair as one message body.
+
+    :param list trades: The Trades to encode
+    :param str encoding: 'json' or 'binary'
+    :raises ValueError: if a pair or id is over 255 bytes, in binary
+    :rtype: str
+    """
+    if encoding == 'json':
+        return json.dumps(trades)
+    fixed = interface.FIXED_POINT
+    # the seq is only sent when every trade has one
+    sequenced = all(trade.seq is not None for trade in trades)
+    record = _fixed_record if fixed else _float_record
+    pair = str(trades[0].pair)
+    flags = (FLAG_FIXED_POINT if fixed else 0) | (FLAG_SEQ if sequenced else 0)
+    parts = [_header.pack(TRADES_V1, flags, len(trades)), _length(pair), pair]
+    for trade in trades:
+        parts.append(record.pack(trade.price, trade.amount))
+        for oid in (str(trade.bid_id), str(trade.ask_id)):
+            parts.append(_length(oid))
+            parts.append(oid)
+        if sequenced:
+            parts.append(_seq.pack(trade.seq))
+    return ''.join(parts)
+
+
+def decode_trades(body):
+    """
+    Decode a message body published by the matcher.
+
+    :param str body: A single JSON trade, or a JSON or binary batch
+    :return: a list of Trades
+    """
+    if body[:1] != TRADES_V1:
+        trades = json.loads(body)
+        if len(trades) > 0 and not isinstance(trades[0], list):
+            trades = [trades]
+        return [Trade(*t) for t in trades]
+    version, flags, count = _header.unpack_from(body)
+    record = _fixed_record if flags & FLAG_FIXED_POINT else _float_record
+    pos = _header.size
+    size = ord(body[pos])
+    pair = body[pos + 1:pos + 1 + size]
+    pos += 1 + size
+    trades = []
+    for i in range(count):
+        price, amount = record.unpack_from(body, pos)
+        pos += record.size
+        ids = []
+        for j in range(2):
+            size = ord(body[pos])
+            ids.append(body[pos + 1:pos + 1 + size])
+            pos += 1 + size
+        seq = None
+        if flags & FLAG_SEQ:
+            seq, = _seq.unpack_from(body, pos)
+            pos += _seq.size
+        trades.append(Trade(pair, price, amount, ids[0], ids[1], seq))
+    return trades
+
+
+class TradePublisher(object):
+    """
+    Collects Trades and publishes them in batches of up to max_batch,
+    holding a trade back at most max_linger seconds.
+
+    With the defaults every Trade is published on its own as a JSON array,
+    like the matcher always did.
+    """
+
+    def __init__(self, client, max_batch=1, max_linger=0.0, encoding='json'):
+        """
+        :param client: The message queue client to publish with
+        :param int max_batch: The most Trades to put in one message
+        :param float max_linger: The most seconds to hold a Trade back
+        :param str encoding: 'json' or 'binary'
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError("unknown trade encoding %s" % encoding)
+        self.client = client
+        self.max_batch = max_batch
+        self.max_linger = max_linger
+        self.encoding = encoding
+        self._pending = []
+        self._oldest = None
+
+    def add(self, trades):
+        """
+        Queue Trades for publication, publishing every full batch.
+
+        :param list trades: The Trades to publish
+        """
+        if len(trades) > 0 and len(self._pending) == 0:
+            self._oldest = time.time()
+        self._pending.extend(trades)
+        while len(self._pending) >= self.max_batch:
+            self._publish(self._pending[:self.max_batch])
+            self._pending = self._pending[self.max_batch:]
+            self._oldest = time.time()
+        self.poll()
+
+    def poll(self):
+        """
+        Publish the pending Trades if the oldest has lingered long enough.
+        """
+        if len(self._pending) > 0 and time.time() - self._oldest >= self.max_linger:
+            self.flush()
+
+    def flush(self):
+        """
+        Publish all pending Trades now.
+        """
+        while len(self._pending) > 0:
+            self._publish(self._pending[:self.max_batch])
+            self._pending = self._pending[self.max_batch:]
+
+    @metrics.timed('publisher.publish')
+    def _publish(self, trades):
+        if self.max_batch == 1 and self.encoding == 'json':
+            self.client.publish(json.dumps(trades[0]))
+        else:
+            self.client.publish(encode_trades(trades, self.encoding))
@@ -7,6 +7,11 @@ reduce code rewrite just to rename keys.
 
 SEP = '_'
 
+# leading byte of binary book members, see RKEY['book_member_v1']
+MEMBER_V1 = '\x01'
+ID_UUID = 0
+ID_INT = 1
+
 RKEY = {
     # the two sides of the merged orderbook stored as sorted sets
     'book_bid': 'book' + SEP + 'bid',
@@ -18,10 +23,82 @@ RKEY = {
     # and an order id, e.g. book_member % (priority, time.time(), 3.2, order_id)
     # This ordering is designed to take advantage of the Lexicographical scores sorting.
     'book_member': '%s' + SEP + '%s' + SEP + '%s' + SEP + '%s',
+    # alternatively members use the fixed width binary format below, chosen
+    # with interface.set_member_format. Readers accept both formats.
+    # Big-endian non-negative doubles sort the same lexicographically, and
+    # the id type follows them so it never decides the priority.
+    #   version (1 byte, MEMBER_V1), priority, time, amount (big-endian
+    #   doubles), id type (1 byte, ID_UUID or ID_INT), id (16 bytes)
+    'book_member_v1': '>cdddB16s',
+
+    # hash from order id to where the order rests in the book, as
+    # book_index_entry % (side, price, book_member)
+    'book_index': 'book' + SEP + 'index',
+    'book_index_entry': '%s' + SEP + '%s' + SEP + '%s',
+    # 'float' or 'fixed', the number mode the book is written in, see
+    # interface.check_book_mode
+    'book_mode': 'book' + SEP + 'mode',
+    # list of the changes other processes made to the book, as JSON journal
+    # events, for a matcher holding the book in memory, see
+    # interface.BOOK_INBOX
+    'book_inbox': 'book' + SEP + 'inbox',
 
-    'ticker': 'ticker'  # ticker based on the latest book
+    # aggregated L2 depth, maintained incrementally with every book change:
+    # a hash from price to total size and a sorted set of the prices, per side
+    'depth_side': 'depth' + SEP + '%s',
+    'depth_levels': 'depth' + SEP + 'levels' + SEP + '%s',
+    # sequence number of the latest market data update
+    'book_seq': 'book' + SEP + 'seq',
+    # rolling 24h trade volume buckets, running total and last trade price
+    'volume': 'volume',
+
+    # append-only list of book events, each as journal_entry % (seq, event),
+    # see journal.py. journal_seq holds the sequence number of the latest.
+    'journal': 'journal',
+    'journal_seq': 'journal' + SEP + 'seq',
+    'journal_entry': '%s %s',
+    # JSON checkpoint of the whole book at a journal sequence number
+    'journal_checkpoint': 'journal' + SEP + 'checkpoint'
 }
 
+# publishes the side ('bid' or 'ask') whenever orders are inserted or
+# updated, so matchers can wake up instead of polling the book
+BOOK_CHANNEL = 'book_changed'
+# publishes the depth levels changed by every market data update, and
+# periodic snapshots of the whole depth, see depth_feed.py
+DEPTH_CHANNEL = 'depth_feed'
 # publishes our internal index, an index generated based on
 # tickers alone, and warning=True in case of divergences
 INDEX_EXTERNAL_CHANNEL = 'index_external'
+# where external feeds publish their tickers, see price_index.py
+TICKER_EXTERNAL_CHANNEL = 'ticker_external'
+
+# RKEY entries which name keys, rather than formats of members and values.
+# set_pair namespaces these.
+KEY_NAMES = ('book_bid', 'book_ask', 'book_side', 'book_index', 'book_mode', 'book_inbox',
+             'depth_side', 'depth_levels', 'book_seq', 'volume', 'journal', 'journal_seq',
+             'journal_checkpoint')
+_BASE_RKEY = dict(RKEY)
+_BASE_BOOK_CHANNEL = BOOK_CHANNEL
+_BASE_DEPTH_CHANNEL = DEPTH_CHANNEL
+_BASE_INDEX_EXTERNAL_CHANNEL = INDEX_EXTERNAL_CHANNEL
+_BASE_TICKER_EXTERNAL_CHANNEL = TICKER_EXTERNAL_CHANNEL
+
+
+def set_pair(pair):
+    """
+    Namespace the book keys and channels under pair, e.g. BTCUSD_book_bid,
+    so the books of several pairs can share one Redis server. RKEY is
+    updated in place, so always look keys up when using them.
+
+    :param str pair: The pair to namespace under, or None for the
+                     un-namespaced keys of a single pair node
+    """
+    global BOOK_CHANNEL, DEPTH_CHANNEL, INDEX_EXTERNAL_CHANNEL, TICKER_EXTERNAL_CHANNEL
+    prefix = '' if pair is None else pair + SEP
+    for name in KEY_NAMES:
+        RKEY[name] = prefix + _BASE_RKEY[name]
+    BOOK_CHANNEL = prefix + _BASE_BOOK_CHANNEL
+    DEPTH_CHANNEL = prefix + _BASE_DEPTH_CHANNEL
+    INDEX_EXTERNAL_CHANNEL = prefix + _BASE_INDEX_EXTERNAL_CHANNEL
+    TICKER_EXTERNAL_CHANNEL = prefix + _BASE_TICKER_EXTERNAL_CHANNEL
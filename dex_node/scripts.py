@@ -0,0 +1,338 @@
+"""
+Lua scripts run inside Redis, for book operations which must be atomic.
+
+Scripts are registered with the client in interface.py and loaded by sha
+on first use.
+"""
+
+# Maintain the L2 depth and the 24h volume, shared by the scripts changing
+# the book. Each function takes the market data keys: the depth hashes and
+# level sorted sets of the bid and ask sides, the sequence counter and the
+# volume hash.
+# update_market_data applies (side, price, size change) triplets to the
+# depth, records the volume and price of trades, and publishes the changed
+# levels with a new sequence number. The published delta holds the new size
+# of every changed level, 0 once empty, see depth_feed.py. The ticker and
+# depth snapshot are only assembled when read, see READ_MARKET_DATA.
+# The 24h volume is summed in 5 minute buckets, keeping a running total so
+# every update is O(1) amortized.
+MARKET_DATA_FUNCTIONS = """
+local BUCKET, BUCKETS = 300, 288
+
+-- the depth hash and level sorted set of one side
+local function depth_keys(keys, side)
+    if side == 'bid' then
+        return keys[1], keys[3]
+    end
+    return keys[2], keys[4]
+end
+
+local function update_market_data(keys, now, dust, deltas, last, volume, channel)
+    -- the changed levels per side, and where each is in that list
+    local changes, changed = {bid = {}, ask = {}}, {bid = {}, ask = {}}
+    for i = 1, #deltas, 3 do
+        local side = deltas[i]
+        local price = tonumber(deltas[i + 1])
+        local field = string.format('%.17g', price)
+        local hash, zset = depth_keys(keys, side)
+        local size = tonumber(redis.call('HINCRBYFLOAT', hash, field, deltas[i + 2]))
+        if size <= dust then
+            redis.call('HDEL', hash, field)
+            redis.call('ZREM', zset, field)
+            size = 0
+        else
+            redis.call('ZADD', zset, price, field)
+        end
+        if channel ~= '' then
+            local j = changed[side][field]
+            if j == nil then
+                table.insert(changes[side], {price, size})
+                changed[side][field] = #changes[side]
+            else
+                changes[side][j] = {price, size}
+            end
+        end
+    end
+
+    if last ~= '' then
+        local vkey = keys[6]
+        local bucket = math.floor(now / BUCKET)
+        local cutoff = bucket - BUCKETS + 1
+        local oldest = tonumber(redis.call('HGET', vkey, 'oldest') or bucket)
+        if oldest < cutoff - BUCKETS then
+            redis.call('DEL', vkey)
+            oldest = cutoff
+        end
+        while oldest < cutoff do
+            local expired = redis.call('HGET', vkey, tostring(oldest))
+            if expired then
+                redis.call('HINCRBYFLOAT', vkey, 'total', -tonumber(expired))
+                redis.call('HDEL', vkey, tostring(oldest))
+            end
+            oldest = oldest + 1
+        end
+        redis.call('HINCRBYFLOAT', vkey, tostring(bucket), volume)
+        redis.call('HINCRBYFLOAT', vkey, 'total', volume)
+        redis.call('HMSET', vkey, 'oldest', tostring(oldest), 'last', last)
+    end
+
+    local seq = redis.call('INCR', keys[5])
+    if channel ~= '' then
+        redis.call('PUBLISH', channel, cjson.encode({type = 'delta', seq = seq, time = now,
+                                                     bids = changes.bid, asks = changes.ask}))
+    end
+    return seq
+end
+
+-- the top count levels of one side, best first, or all of them for 0
+local function levels(keys, side, count)
+    local hash, zset = depth_keys(keys, side)
+    local prices
+    if side == 'bid' then
+        prices = redis.call('ZREVRANGE', zset, 0, count - 1, 'WITHSCORES')
+    else
+        prices = redis.call('ZRANGE', zset, 0, count - 1, 'WITHSCORES')
+    end
+    local out = {}
+    for j = 1, #prices, 2 do
+        table.insert(out, {tonumber(prices[j + 1]), tonumber(redis.call('HGET', hash, prices[j]))})
+    end
+    return out
+end
+
+-- the volume of the buckets of the last 24h, without pruning the older ones
+local function volume_total(keys, now)
+    local vkey = keys[6]
+    local cutoff = math.floor(now / BUCKET) - BUCKETS + 1
+    local oldest = tonumber(redis.call('HGET', vkey, 'oldest'))
+    if oldest == nil or oldest < cutoff - BUCKETS then
+        return 0
+    end
+    local total = tonumber(redis.call('HGET', vkey, 'total') or 0)
+    while oldest < cutoff do
+        total = total - tonumber(redis.call('HGET', vkey, tostring(oldest)) or 0)
+        oldest = oldest + 1
+    end
+    return total
+end
+"""
+
+# Match up to ARGV[1] crossing bid/ask pairs of the book in KEYS[1] and
+# KEYS[2], keeping the order index in KEYS[3] in sync. Mirrors
+# matcher.fill_orders: the trade takes the price of the lower priority
+# order, and remainders keep their priority and time. ARGV[3] is '1' when
+# the book is in fixed-point mode, see interface.FIXED_POINT.
+# When ARGV[4] is '1', each fill and book change is appended to the journal
+# in KEYS[5], sequenced by KEYS[4], as Trades of the pair in ARGV[5]. The
+# events follow interface.journal_events.
+# The market data is updated in the same step, like UPDATE_MARKET_DATA:
+# KEYS[6] to KEYS[11] are the market data keys, and ARGV[6] to ARGV[8] the
+# current time, the dust size and the depth channel (or '').
+# Returns the sequence number of the market data update, 0 without trades,
+# and a flat list of price, amount, bid id and ask id per trade.
+MATCH_ORDERS = MARKET_DATA_FUNCTIONS + """
+local sep = string.gsub(ARGV[2], '%p', '%%%0')
+local pattern = '^(.-)' .. sep .. '(.-)' .. sep .. '(.-)' .. sep .. '(.*)$'
+
+local function fmt_amount(amount)
+    if ARGV[3] == '1' then
+        return string.format('%d', amount)
+    end
+    local s = string.format('%.12g', amount)
+    if not string.find(s, '[%.eni]') then
+        s = s .. '.0'
+    end
+    return s
+end
+
+-- binary members follow redis_keys.RKEY['book_member_v1']
+local function is_binary(member)
+    return string.byte(member, 1) == 1
+end
+
+local function binary_id(member)
+    local raw = string.sub(member, 27, 42)
+    if string.byte(member, 26) == 0 then
+        local hex = string.gsub(raw, '.', function(c) return string.format('%02x', string.byte(c)) end)
+        return string.sub(hex, 1, 8) .. '-' .. string.sub(hex, 9, 12) .. '-' .. string.sub(hex, 13, 16) ..
+               '-' .. string.sub(hex, 17, 20) .. '-' .. string.sub(hex, 21, 32)
+    end
+    local n = 0
+    for i = 1, 16 do
+        n = n * 256 + string.byte(raw, i)
+    end
+    return string.format('%d', n)
+end
+
+local function parse(member)
+    if is_binary(member) then
+        local priority, time, amount = struct.unpack('>ddd', string.sub(member, 2, 25))
+        return priority, time, amount, binary_id(member)
+    end
+    local priority, time, amount, oid = string.match(member, pattern)
+    return tonumber(priority), tonumber(time), tonumber(amount), oid
+end
+
+local function with_amount(member, amount)
+    if is_binary(member) then
+        return string.sub(member, 1, 17) .. struct.pack('>d', amount) .. string.sub(member, 26)
+    end
+    local priority, time, old_amount, oid = string.match(member, pattern)
+    return priority .. ARGV[2] .. time .. ARGV[2] .. fmt_amount(amount) .. ARGV[2] .. oid
+end
+
+local function journal(event)
+    if ARGV[4] == '1' then
+        local seq = redis.call('INCR', KEYS[4])
+        redis.call('RPUSH', KEYS[5], seq .. ' ' .. cjson.encode(event))
+    end
+end
+
+-- numbers are journaled as strings, as cjson would round them
+local function num(n)
+    return string.format('%.17g', n)
+end
+
+local function rest(side, key, member, score, priority, time, amount, oid)
+    redis.call('ZREM', key, member)
+    if amount ~= 0 then
+        member = with_amount(member, amount)
+        redis.call('ZADD', key, score, member)
+        redis.call('HSET', KEYS[3], oid, side .. ARGV[2] .. score .. ARGV[2] .. member)
+        local stored = num(amount)
+        if not is_binary(member) then
+            stored = fmt_amount(amount)
+        end
+        journal({'amend', {side, score, num(priority), num(time), stored, oid}})
+    else
+        redis.call('HDEL', KEYS[3], oid)
+        journal({'remove', side, oid})
+    end
+end
+
+local trades = {}
+local deltas = {}
+local volume = 0
+local fills = 0
+while fills < tonumber(ARGV[1]) do
+    local bid = redis.call('ZREVRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #bid == 0 then break end
+    local ask = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if #ask == 0 then break end
+    if tonumber(ask[2]) > tonumber(bid[2]) then break end
+
+    local bprio, btime, bamount, bid_id = parse(bid[1])
+    local aprio, atime, aamount, ask_id = parse(ask[1])
+
+    local amount = math.min(bamount, aamount)
+    local price = ask[2]
+    if aprio < bprio or (aprio == bprio and atime < btime) then
+        price = bid[2]
+    end
+    journal({'fill', {ARGV[5], price, num(amount), bid_id, ask_id}})
+    rest('bid', KEYS[1], bid[1], bid[2], bprio, btime, bamount - amount, bid_id)
+    rest('ask', KEYS[2], ask[1], ask[2], aprio, atime, aamount - amount, ask_id)
+
+    table.insert(trades, price)
+    table.insert(trades, string.format('%.17g', amount))
+    table.insert(trades, bid_id)
+    table.insert(trades, ask_id)
+    for _, v in ipairs({'bid', bid[2], -amount, 'ask', ask[2], -amount}) do
+        table.insert(deltas, v)
+    end
+    volume = volume + amount
+    fills = fills + 1
+end
+local seq = 0
+if fills > 0 then
+    seq = update_market_data({KEYS[6], KEYS[7], KEYS[8], KEYS[9], KEYS[10], KEYS[11]},
+                             tonumber(ARGV[6]), tonumber(ARGV[7]), deltas, trades[#trades - 3],
+                             volume, ARGV[8])
+end
+return {seq, trades}
+"""
+
+# Remove and add book orders by id, keeping the order index in KEYS[3] in
+# sync, and update the market data to match, in a single call. KEYS[1] and
+# KEYS[2] are the bid and ask sides, KEYS[4] to KEYS[9] the market data
+# keys, see MARKET_DATA_FUNCTIONS. ARGV[1] is redis_keys.SEP, ARGV[2] and
+# ARGV[3] the numbers of orders to remove and to add, and ARGV[4] to
+# ARGV[8] the current time, dust, last trade price, traded volume and
+# channel, as for UPDATE_MARKET_DATA.
+# The ids of the orders to remove follow. Each is removed by the member its
+# index entry holds, so members written in another format, or amended
+# since they were read, still go. Side, price, member and id quadruplets of
+# the orders to add follow, then the depth delta triplets.
+# Returns the new sequence number.
+CHANGE_ORDERS = MARKET_DATA_FUNCTIONS + """
+local sides = {bid = KEYS[1], ask = KEYS[2]}
+local sep = ARGV[1]
+local removed, added = tonumber(ARGV[2]), tonumber(ARGV[3])
+local first = 9
+for i = first, first + removed - 1 do
+    local entry = redis.call('HGET', KEYS[3], ARGV[i])
+    if entry then
+        local first = string.find(entry, sep, 1, true)
+        local second = string.find(entry, sep, first + 1, true)
+        redis.call('ZREM', sides[string.sub(entry, 1, first - 1)], string.sub(entry, second + 1))
+        redis.call('HDEL', KEYS[3], ARGV[i])
+    end
+end
+first = first + removed
+for i = first, first + 4 * added - 1, 4 do
+    redis.call('ZADD', sides[ARGV[i]], ARGV[i + 1], ARGV[i + 2])
+    redis.call('HSET', KEYS[3], ARGV[i + 3], ARGV[i] .. sep .. ARGV[i + 1] .. sep .. ARGV[i + 2])
+end
+local deltas = {}
+for i = first + 4 * added, #ARGV do
+    table.insert(deltas, ARGV[i])
+end
+return update_market_data({KEYS[4], KEYS[5], KEYS[6], KEYS[7], KEYS[8], KEYS[9]}, tonumber(ARGV[4]),
+                          tonumber(ARGV[5]), deltas, ARGV[6], tonumber(ARGV[7]), ARGV[8])
+"""
+
+# Update the market data after a change of the book, in O(1) per changed
+# depth level. See MARKET_DATA_FUNCTIONS.
+# KEYS are the market data keys, see MARKET_DATA_FUNCTIONS. ARGV holds the
+# current time, the dust size under which a level is empty, the last trade
+# price (or '' without trades), the traded volume, the channel to publish
+# the changed levels on (or ''), followed by side, price and size delta
+# triplets to apply to the depth.
+# Returns the new sequence number.
+UPDATE_MARKET_DATA = MARKET_DATA_FUNCTIONS + """
+local deltas = {}
+for i = 6, #ARGV do
+    table.insert(deltas, ARGV[i])
+end
+return update_market_data(KEYS, tonumber(ARGV[1]), tonumber(ARGV[2]), deltas,
+                          ARGV[3], tonumber(ARGV[4]), ARGV[5])
+"""
+
+# Read the ticker and the L2 depth, with the sequence number they are
+# current at. KEYS are the market data keys, see MARKET_DATA_FUNCTIONS.
+# ARGV holds the number of depth levels per side to read (0 for all), the
+# current time, and the channel to also publish the depth on as a snapshot
+# (or '').
+# Returns the JSON snapshot, with the 24h volume and last trade price.
+READ_MARKET_DATA = MARKET_DATA_FUNCTIONS + """
+local top, now = tonumber(ARGV[1]), tonumber(ARGV[2])
+local data = {type = 'snapshot', seq = tonumber(redis.call('GET', KEYS[5]) or 0), time = now,
+              bids = levels(KEYS, 'bid', top), asks = levels(KEYS, 'ask', top)}
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], cjson.encode(data))
+end
+local last = redis.call('HGET', KEYS[6], 'last')
+data.volume = volume_total(KEYS, now)
+data.last = last and tonumber(last) or cjson.null
+return cjson.encode(data)
+"""
+
+# Append the JSON events in ARGV to the journal in KEYS[2], numbering them
+# with the sequence counter in KEYS[1]. Returns the last sequence number.
+APPEND_JOURNAL = """
+local first = redis.call('INCRBY', KEYS[1], #ARGV) - #ARGV
+for i = 1, #ARGV do
+    redis.call('RPUSH', KEYS[2], string.format('%d %s', first + i, ARGV[i]))
+end
+return first + #ARGV
+"""
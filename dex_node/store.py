@@ -0,0 +1,158 @@
+"""
+Book storage backends.
+
+Every backend offers the same book operations: insert_order,
+insert_many_orders, get_next_order, get_order, update_order, rem_order,
+cancel_order and apply_book_changes. match_orders, sweep_orders and
+MatchRunner accept any of them as their book.
+
+    redis   the shared Redis book of interface.py, with a tunable
+            connection pool
+    memory  an in-process OrderBook, for a single matcher owning the book,
+            writing every change through to the Redis book
+
+Each store has a Redis client of its own, see interface.Connection, which
+the functions of interface.py use while the store calls them.
+"""
+import interface
+import journal
+import redis_keys
+from book import OrderBook, SIDES
+
+BACKENDS = ('redis', 'memory')
+
+
+class RedisBookStore(object):
+    """
+    The Redis book, through the functions of interface.py.
+    """
+
+    def __init__(self, url=None, **options):
+        """
+        :param str url: A redis:// URL, instead of interface.REDIS_URL or
+                        localhost
+        :param options: ConnectionPool options, i.e. max_connections,
+                        socket_timeout, socket_connect_timeout,
+                        socket_keepalive, socket_keepalive_options and
+                        retry_on_timeout
+        """
+        self.connection = interface.Connection(url, **options)
+
+    @property
+    def red(self):
+        return self.connection.red
+
+    @property
+    def pool(self):
+        return self.connection.red.connection_pool
+
+    def insert_order(self, order):
+        with interface.using(self.connection):
+            interface.insert_order(order)
+
+    def insert_many_orders(self, orders):
+        with interface.using(self.connection):
+            interface.insert_many_orders(orders)
+
+    def get_next_order(self, side='bid', pop=False):
+        with interface.using(self.connection):
+            return interface.get_next_order(side, pop=pop)
+
+    def get_order(self, oid):
+        with interface.using(self.connection):
+            return interface.get_order(oid)
+
+    def update_order(self, order, upsert=True):
+        with interface.using(self.connection):
+            interface.update_order(order, upsert=upsert)
+
+    def rem_order(self, side, order):
+        with interface.using(self.connection):
+            interface.rem_order(side, order)
+
+    def cancel_order(self, oid):
+        with interface.using(self.connection):
+            return interface.cancel_order(oid)
+
+    def apply_book_changes(self, removed, added, trades=()):
+        with interface.using(self.connection):
+            interface.apply_book_changes(removed, added, trades)
+
+
+class MemoryBookStore(OrderBook):
+    """
+    An in-process OrderBook owning the Redis book. Every change is written
+    through to the Redis book as it is applied, and the orders other
+    processes insert, update or cancel reach this one through the book
+    inbox, see sync and interface.BOOK_INBOX.
+    """
+
+    def __init__(self, url=None, write_through=True, **options):
+        """
+        :param str url: A redis:// URL, instead of interface.REDIS_URL or
+                        localhost
+        :param bool write_through: Write every change to the Redis book
+        :param options: ConnectionPool options, see RedisBookStore
+        """
+        super(MemoryBookStore, self).__init__()
+        self.write_through = write_through
+        self.connection = interface.Connection(url, **options)
+
+    def _changed(self, removed, added, trades=()):
+        if self.write_through:
+            with interface.using(self.connection):
+                interface.apply_book_changes(removed, added, trades)
+
+    def load(self):
+        """
+        Load the orders resting in the Redis book, and drop the inbox events
+        the book already includes, in one transaction.
+        """
+        pipe = self.connection.red.pipeline()
+        for side in SIDES:
+            pipe.zrange(redis_keys.RKEY['book_side'] % side, 0, -1, withscores=True)
+        pipe.delete(redis_keys.RKEY['book_inbox'])
+        self._load(*pipe.execute()[:2])
+
+    def sync(self):
+        """
+        Apply the changes other processes queued on the book inbox. The Redis
+        book holds them already, so they are not written back.
+
+        :return: the number of inbox events applied
+        """
+        count = 0
+        while True:
+            with interface.using(self.connection):
+                events = interface.read_inbox()
+            for event in events:
+                event = journal.decode_event(event)
+                if event[0] == 'remove':
+                    resting = self._resting(event[2])
+                    if resting is not None:
+                        self._remove(resting)
+                    continue
+                resting = self._resting(event[1].id)
+                if resting is not None:
+                    self._replace(resting, event[1])
+                else:
+                    self._insert(event[1])
+            count += len(events)
+            if len(events) < interface.INBOX_BATCH:
+                return count
+
+
+def create_store(backend='redis', url=None, **options):
+    """
+    Create a book store.
+
+    :param str backend: 'redis' or 'memory'
+    :param str url: A redis:// URL, instead of interface.REDIS_URL or
+                    localhost
+    :param options: ConnectionPool options, see RedisBookStore
+    """
+    if backend == 'redis':
+        return RedisBookStore(url, **options)
+    elif backend == 'memory':
+        return MemoryBookStore(url, **options)
+    raise ValueError("unknown book store backend %s" % backend)
@@ -0,0 +1,164 @@
+"""
+Runs one matcher worker process per pair.
+
+With DEX_NAMESPACE set, each worker namespaces its Redis keys under its
+pair, see interface.set_pair, and publishes its trades with a per pair
+routing key, so the pairs of one node match in parallel on separate cores
+without conflicting over keys. Several pairs are refused without it.
+
+    DEX_NAMESPACE=1 python supervisor.py BTCUSD ETHUSD --sweep
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+import interface
+import matcher
+import metrics
+import store
+
+PAIRS = ('BTCUSD',)
+# how often the supervisor checks on its workers, in seconds
+CHECK_INTERVAL = 1.0
+# the least seconds between two starts of a worker, so one which fails
+# right away does not spin
+RESTART_INTERVAL = 5.0
+
+
+def run_pair(pair, sweep=False, atomic=False, backend='redis', metrics_ports=None, redis_url=None,
+             redis_options=None):
+    """
+    Match the book of a single pair until stopped. The target of the
+    worker processes.
+
+    :param str pair: The pair to match
+    :param bool sweep: See MatchRunner
+    :param bool atomic: See MatchRunner
+    :param str backend: 'redis', or 'memory' to match a copy of the book
+                        held in the worker, see store.MemoryBookStore
+    :param dict metrics_ports: The port to serve each pair's metrics on,
+                               None to not record metrics
+    :param str redis_url: A redis:// URL, instead of interface.REDIS_URL or
+                          localhost
+    :param dict redis_options: ConnectionPool options, see
+                               store.RedisBookStore
+    """
+    interface.set_pair(pair)
+    if metrics_ports is not None:
+        metrics.enable()
+        metrics.serve(metrics_ports[pair])
+    # a client of its own, never sharing the connections of the parent
+    book = store.create_store(backend, redis_url, **(redis_options or {}))
+    if backend == 'memory':
+        book.load()
+    runner = matcher.MatchRunner(book, sweep=sweep, atomic=atomic)
+    # a single un-namespaced pair publishes like a lone matcher
+    matcher.create_trade_client(runner, pair if interface.NAMESPACE else None).run()
+
+
+class Supervisor(object):
+    """
+    Starts a worker process per pair, and restarts any which exit.
+    """
+
+    def __init__(self, pairs=PAIRS, target=run_pair, **options):
+        """
+        :param list pairs: The pairs to run a worker for
+        :param target: The function each worker runs, called with its pair
+                       followed by options
+        :param options: Keyword arguments for target
+        :raises ValueError: for several pairs, unless interface.NAMESPACE, or
+                            for a pair without units, or for the memory
+                            backend without interface.BOOK_INBOX
+        """
+        if len(pairs) > 1 and not interface.NAMESPACE:
+            raise ValueError("several pairs share the Redis keys unless namespaced, set DEX_NAMESPACE")
+        if options.get('backend') == 'memory' and not interface.BOOK_INBOX:
+            raise ValueError("the memory backend misses the orders of the API unless it queues them "
+                             "on the book inbox, set DEX_BOOK_INBOX")
+        for pair in pairs:
+            interface.get_pair_units(pair)
+        self.pairs = list(pairs)
+        self.target = target
+        self.options = options
+        self.workers = {}
+        self._started = {}
+
+    def start_worker(self, pair):
+        worker = multiprocessing.Process(target=self.target, args=(pair,), kwargs=self.options,
+                                         name='matcher-%s' % pair)
+        worker.daemon = True
+        worker.start()
+        self.workers[pair] = worker
+        self._started[pair] = time.time()
+        return worker
+
+    def start(self):
+        for pair in self.pairs:
+            self.start_worker(pair)
+
+    def check(self):
+        """
+        Restart the workers which exited, at most once every
+        RESTART_INTERVAL.
+
+        :return: the pairs whose worker was restarted
+        """
+        restarted = []
+        for pair, worker in self.workers.items():
+            if worker.is_alive() or time.time() - self._started[pair] < RESTART_INTERVAL:
+                continue
+            worker.join()
+            self.start_worker(pair)
+            restarted.append(pair)
+        return restarted
+
+    def stop(self, timeout=5.0):
+        for worker in self.workers.values():
+            worker.terminate()
+        for worker in self.workers.values():
+            worker.join(timeout)
+        self.workers = {}
+
+    def run(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(CHECK_INTERVAL)
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('pairs', nargs='*', metavar='pair',
+                        help='pairs to match, by default %s' % ', '.join(PAIRS))
+    parser.add_argument('--sweep', action='store_true', help='match every crossing order each iteration')
+    parser.add_argument('--atomic', action='store_true', help='match inside Redis with a Lua script')
+    parser.add_argument('--backend', choices=store.BACKENDS, default='redis',
+                        help='match the Redis book, or a copy in memory fed by the book inbox')
+    parser.add_argument('--metrics-port', type=int,
+                        help='record latencies, and serve those of the nth pair on this port + n')
+    parser.add_argument('--redis-url', help='a redis:// URL, by default $DEX_REDIS_URL or localhost')
+    parser.add_argument('--max-connections', type=int, help='the Redis connection pool size of each worker')
+    args = parser.parse_args()
+    pairs = args.pairs or PAIRS
+    options = {'sweep': args.sweep, 'atomic': args.atomic, 'backend': args.backend,
+               'redis_url': args.redis_url}
+    if args.max_connections is not None:
+        options['redis_options'] = {'max_connections': args.max_connections}
+    if args.metrics_port is not None:
+        logging.basicConfig(level=logging.INFO)
+        options['metrics_ports'] = dict((pair, args.metrics_port + i) for i, pair in enumerate(pairs))
+    try:
+        supervisor = Supervisor(pairs, **options)
+    except ValueError as e:
+        parser.error(str(e))
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
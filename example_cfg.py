@@ -1,6 +1,25 @@
 import logging
 
 SA_ENGINE_URI = 'sqlite:////tmp/dexnode.db'
+# connection pool per API process, unused with SQLite
+SA_POOL_SIZE = 10
+SA_MAX_OVERFLOW = 20
+SA_POOL_TIMEOUT = 30
+SA_POOL_RECYCLE = 3600
+# cache the last nonce of each key in 'memory' (single API process only) or
+# 'redis', writing them to SQL every NONCE_FLUSH_INTERVAL seconds
+NONCE_CACHE = None
+NONCE_FLUSH_INTERVAL = 5.0
+NONCE_REDIS_URL = None
+# how many users to cache by key, and for how many seconds
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300.0
+# the most orders accepted by one POST /orders
+MAX_BULK_ORDERS = 100
+# record latency histograms, served on /metrics and logged every
+# METRICS_LOG_INTERVAL seconds
+METRICS_ENABLED = False
+METRICS_LOG_INTERVAL = 60.0
 PRIV_KEY = "L4vB5fomsK8L95wQ7GFzvErYGht49JsCPJyJMHpB4xGM6xgi2jvG"
 PUB_KEY = "1F26pNMrywyZJdr22jErtKcjF8R3Ttt55G"
 BASEPATH = ""
@@ -0,0 +1,98 @@
+import sys
+import time
+import unittest
+import redis
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from sqlalchemy.ext.declarative import declarative_base
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node.api.cache import TTLCache
+from dex_node.api.nonces import MemoryNonces, RedisNonces, SQLNonces
+
+Base = declarative_base()
+
+
+class UserKey(Base):
+    __tablename__ = "user_key"
+    key = sa.Column(sa.String(36), primary_key=True)
+    last_nonce = sa.Column(sa.BigInteger, nullable=False)
+
+
+def create_session():
+    eng = sa.create_engine('sqlite://')
+    Base.metadata.create_all(eng)
+    ses = orm.sessionmaker(bind=eng)()
+    ses.add(UserKey(key='alice', last_nonce=1000))
+    ses.commit()
+    return ses
+
+
+class Nonces(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        self.ses = create_session()
+
+    def check_replays(self, nonces):
+        self.assertFalse(nonces.advance('bob', 2000))
+        self.assertFalse(nonces.advance('alice', 1000))
+        self.assertTrue(nonces.advance('alice', 2000))
+        # the same request again, and an older one
+        self.assertFalse(nonces.advance('alice', 2000))
+        self.assertFalse(nonces.advance('alice', 1500))
+        self.assertTrue(nonces.advance('alice', 2001))
+
+    def test_sql(self):
+        nonces = SQLNonces(self.ses, UserKey=UserKey)
+        self.check_replays(nonces)
+        self.assertEqual(nonces.get('alice'), 2001)
+        self.assertIsNone(nonces.get('bob'))
+        self.assertEqual(nonces.write_many({'alice': 1800, 'bob': 3000}), 0)
+
+    def test_memory(self):
+        nonces = MemoryNonces(self.ses, flush_interval=60, UserKey=UserKey)
+        self.check_replays(nonces)
+        self.assertEqual(nonces.sql.get('alice'), 1000)
+        nonces.flush()
+        self.assertEqual(nonces.sql.get('alice'), 2001)
+
+    def test_redis(self):
+        nonces = RedisNonces(self.ses, flush_interval=60, UserKey=UserKey)
+        self.check_replays(nonces)
+        # another API process sees the nonces already used
+        other = RedisNonces(self.ses, flush_interval=60, UserKey=UserKey)
+        self.assertFalse(other.advance('alice', 2001))
+        self.assertTrue(other.advance('alice', 2002))
+        self.assertEqual(nonces.sql.get('alice'), 1000)
+        nonces.flush()
+        self.assertEqual(nonces.sql.get('alice'), 2002)
+
+
+class UserCache(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set('alice', 1)
+        self.assertEqual(cache.get('alice'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('alice'))
+        # expired entries are dropped once read
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 0})
+
+    def test_least_recently_used(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('alice', 1)
+        cache.set('bob', 2)
+        cache.get('alice')
+        cache.set('carol', 3)
+        self.assertIsNone(cache.get('bob'))
+        self.assertEqual((cache.get('alice'), cache.get('carol')), (1, 3))
+        cache.invalidate('alice')
+        self.assertEqual(cache.get('alice', 0), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
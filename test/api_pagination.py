@@ -0,0 +1,59 @@
+import datetime
+import sys
+import unittest
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from sqlalchemy.ext.declarative import declarative_base
+
+sys.path.append('../')
+
+from dex_node.api.pagination import keyset_page
+
+Base = declarative_base()
+
+
+class Order(Base):
+    __tablename__ = "order"
+    id = sa.Column(sa.Integer, primary_key=True)
+    user_id = sa.Column(sa.String(120), nullable=False)
+    time = sa.Column(sa.DateTime, nullable=False)
+
+
+class KeysetPages(unittest.TestCase):
+    def setUp(self):
+        eng = sa.create_engine('sqlite://')
+        Base.metadata.create_all(eng)
+        self.ses = orm.sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 3, 1, 12, 30)
+        # orders of two users interleaved, many created in the same instant
+        for i in range(1, 15):
+            self.ses.add(Order(id=i, user_id='alice' if i % 2 else 'bob',
+                               time=now if i < 12 else now + datetime.timedelta(seconds=1)))
+        self.ses.commit()
+
+    def read_pages(self, user_id, limit):
+        query = self.ses.query(Order).filter(Order.user_id == user_id)
+        pages = []
+        after = None
+        while True:
+            items, after = keyset_page(query, Order.id, after, limit)
+            pages.append(([o.id for o in items], after))
+            if after is None:
+                return pages
+
+    def test_duplicate_times(self):
+        self.assertEqual(self.read_pages('alice', 3), [([1, 3, 5], 5), ([7, 9, 11], 11), ([13], None)])
+
+    def test_exact_last_page(self):
+        # a last page exactly limit long has no next page
+        self.assertEqual(self.read_pages('bob', 7), [([2, 4, 6, 8, 10, 12, 14], None)])
+        self.assertEqual(self.read_pages('bob', 6), [([2, 4, 6, 8, 10, 12], 12), ([14], None)])
+
+    def test_empty(self):
+        self.assertEqual(self.read_pages('carol', 3), [([], None)])
+        query = self.ses.query(Order).filter(Order.user_id == 'alice')
+        self.assertEqual(keyset_page(query, Order.id, 13, 3), ([], None))
+
+
+if __name__ == "__main__":
+    unittest.main()
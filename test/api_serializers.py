@@ -0,0 +1,67 @@
+import datetime
+import sys
+import unittest
+from alchemyjsonschema.dictify import jsonify
+
+sys.path.append('../')
+
+from dex_node.api.serializers import compile_serializers
+
+# shaped like the Swagger definitions the API generates from its models
+SPEC = {'definitions': {
+    'User': {'properties': {'id': {'type': 'string'},
+                            'createtime': {'type': 'string', 'format': 'date-time'},
+                            'keys': {'type': 'array', 'items': {'$ref': '#/definitions/UserKey'}},
+                            'referrer': {'$ref': '#/definitions/User'}}},
+    'UserKey': {'properties': {'key': {'type': 'string'},
+                               'last_nonce': {'type': 'integer', 'format': 'int64'},
+                               'active': {'type': 'boolean'}}},
+    'Order': {'properties': {'id': {'type': 'integer'},
+                             'pair': {'type': 'string'},
+                             'amount': {'type': 'integer'},
+                             'price': {'type': 'number'},
+                             'time': {'type': 'string', 'format': 'date-time'},
+                             'day': {'type': 'string', 'format': 'date'},
+                             'user': {'$ref': '#/definitions/User'}}},
+}}
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def jsonify_definition(obj, name):
+    # what the API called for every object before serializers were compiled
+    schema = dict(SPEC['definitions'][name], definitions=SPEC['definitions'])
+    return jsonify(obj, schema)
+
+
+class CompiledSerializers(unittest.TestCase):
+    def setUp(self):
+        self.serializers = compile_serializers(SPEC)
+        now = datetime.datetime(2016, 3, 1, 12, 30, 15, 250)
+        key = Obj(key='1Hs4', last_nonce=1456835415000, active=True)
+        referrer = Obj(id='u1', createtime=now, keys=[], referrer=None)
+        self.user = Obj(id='u2', createtime=now, keys=[key, Obj(key='1Ab9', last_nonce=None)],
+                        referrer=referrer)
+        self.order = Obj(id=7, pair='BTCUSD', amount=100000000, price=24001, time=now, day=now.date(),
+                         user=self.user)
+
+    def test_same_output(self):
+        for obj, name in ((self.order, 'Order'), (self.user, 'User'), (self.user.keys[0], 'UserKey')):
+            self.assertEqual(self.serializers[name](obj), jsonify_definition(obj, name))
+
+    def test_conversions(self):
+        out = self.serializers['Order'](self.order)
+        self.assertEqual(out['time'], '2016-03-01T12:30:15.000250+00:00')
+        self.assertEqual(out['day'], '2016-03-01')
+        self.assertIsInstance(out['price'], float)
+        # None values and missing attributes are left out
+        self.assertEqual(out['user']['keys'][1], {'key': '1Ab9'})
+        self.assertNotIn('referrer', out['user']['referrer'])
+        self.assertIsNone(self.serializers['User'](None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+Matching engine benchmarks.
+
+Measures insert, top of book reads, match_orders, update_order at a deep
+price level and full sweeps, against the local Redis book or the in-process
+OrderBook. Prints one JSON object per benchmark with ops/s and latency
+percentiles in microseconds.
+
+    python benchmark.py --backend redis --size 10000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from util import create_order_book
+
+sys.path.append('../')
+
+from dex_node import interface
+from dex_node.interface import create_book_order
+from dex_node.book import OrderBook
+from dex_node.store import BACKENDS, create_store
+from dex_node.matcher import match_orders, sweep_orders
+
+BENCHMARKS = ('insert', 'top_of_book', 'match', 'update_deep', 'sweep')
+
+
+def percentile(latencies, q):
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def report(name, backend, latencies, ops=None):
+    """
+    Summarize the latencies of one benchmark.
+
+    :param list latencies: Seconds taken by each timed call
+    :param int ops: The operations done, if not one per call
+    """
+    total = sum(latencies)
+    ops = len(latencies) if ops is None else ops
+    latencies = sorted(latencies)
+    return {'bench': name,
+            'backend': backend,
+            'ops': ops,
+            'seconds': round(total, 6),
+            'ops_per_sec': round(ops / total, 1) if total > 0 else None,
+            'p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+            'p99_us': round(percentile(latencies, 0.99) * 1e6, 1),
+            'p999_us': round(percentile(latencies, 0.999) * 1e6, 1)}
+
+
+def timed(func, *args):
+    t = time.time()
+    res = func(*args)
+    return time.time() - t, res
+
+
+def crossing_orders(size, tsize=0.1):
+    now = round(time.time(), 2)
+    orders = []
+    for i in range(size):
+        orders.append(create_book_order('bid', 250, 0.0, now, tsize, uuid.uuid4()))
+        orders.append(create_book_order('ask', 250, 0.0, now, tsize, uuid.uuid4()))
+    return orders
+
+
+class Backend(object):
+    """
+    The book store under test.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # the memory backend measures the matching alone, without writing
+        # through to Redis
+        self.book = self.ops = OrderBook() if name == 'memory' else create_store(name)
+
+    def reset(self):
+        if self.name == 'memory':
+            self.book = self.ops = OrderBook()
+        else:
+            interface.red.flushall()
+
+    def create_order_book(self, **kwargs):
+        orders = create_order_book(insert=False, **kwargs)
+        self.ops.insert_many_orders(orders['bids'] + orders['asks'])
+
+
+def bench_insert(backend, size):
+    now = round(time.time(), 2)
+    latencies = []
+    for i in range(size):
+        side = 'bid' if i % 2 == 0 else 'ask'
+        price = random.uniform(200, 300)
+        order = create_book_order(side, price, 0.0, now, 0.1, uuid.uuid4())
+        latencies.append(timed(backend.ops.insert_order, order)[0])
+    return report('insert', backend.name, latencies)
+
+
+def bench_top_of_book(backend, size):
+    backend.create_order_book(price=250.0, tsize=0.1, size=size, offset=10)
+    return report('top_of_book', backend.name,
+                  [timed(backend.ops.get_next_order, 'bid')[0] for i in range(size)])
+
+
+def bench_match(backend, size):
+    backend.ops.insert_many_orders(crossing_orders(size))
+    latencies = []
+    while True:
+        elapsed, trade = timed(match_orders, backend.book)
+        if trade is None:
+            break
+        latencies.append(elapsed)
+    return report('match', backend.name, latencies)
+
+
+def bench_update_deep(backend, size):
+    orders = crossing_orders(size)
+    bids = [o for o in orders if o.side == 'bid']
+    backend.ops.insert_many_orders(bids)
+    latencies = []
+    for i in range(size):
+        order = random.choice(bids)
+        latencies.append(timed(backend.ops.update_order, order._replace(amount=random.uniform(0.1, 1)))[0])
+    return report('update_deep', backend.name, latencies)
+
+
+def bench_sweep(backend, size):
+    backend.ops.insert_many_orders(crossing_orders(size))
+    latencies = []
+    fills = 0
+    while True:
+        elapsed, trades = timed(sweep_orders, backend.book)
+        if len(trades) == 0:
+            break
+        latencies.append(elapsed)
+        fills += len(trades)
+    return report('sweep', backend.name, latencies, ops=fills)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--backend', choices=BACKENDS, default='redis',
+                        help='book to benchmark; redis flushes the local Redis server')
+    parser.add_argument('--size', type=int, default=10000, help='orders per benchmark')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='benchmarks to run, all by default: %s' % ', '.join(BENCHMARKS))
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % name)
+    random.seed(args.seed)
+    backend = Backend(args.backend)
+    for name in args.benchmarks or BENCHMARKS:
+        backend.reset()
+        print json.dumps(globals()['bench_' + name](backend, args.size), sort_keys=True)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
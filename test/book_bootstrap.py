@@ -0,0 +1,91 @@
+import datetime
+import sys
+import unittest
+import redis
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from sqlalchemy.ext.declarative import declarative_base
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node.bootstrap import load_orders, query_resting_orders
+from dex_node.interface import BookModeError, get_depth, get_next_order, get_order, set_fixed_point
+
+Base = declarative_base()
+
+
+class Order(Base):
+    __tablename__ = "order"
+    id = sa.Column(sa.Integer, primary_key=True)
+    pair = sa.Column(sa.String(6), nullable=False)
+    side = sa.Column(sa.String(3), nullable=False)
+    amount = sa.Column(sa.Integer, nullable=False)
+    price = sa.Column(sa.Integer, nullable=False)
+    time = sa.Column(sa.DateTime, nullable=False)
+    state = sa.Column(sa.String(7), nullable=False, default='open')
+    filled = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class Bootstrap(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_fixed_point()
+        eng = sa.create_engine('sqlite://')
+        Base.metadata.create_all(eng)
+        self.ses = orm.sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 1, 1)
+        self.ses.add_all([Order(id=1, pair='BTCUSD', side='bid', amount=300, price=24000, time=now,
+                                state='partial', filled=100),
+                          Order(id=2, pair='BTCUSD', side='ask', amount=100, price=24000, time=now,
+                                state='filled', filled=100),
+                          Order(id=3, pair='BTCUSD', side='bid', amount=200, price=23900, time=now),
+                          Order(id=4, pair='BTCUSD', side='ask', amount=500, price=24100, time=now),
+                          Order(id=5, pair='ETHUSD', side='ask', amount=500, price=1000, time=now),
+                          # not resting, whatever its filled amount
+                          Order(id=6, pair='BTCUSD', side='bid', amount=100, price=23800, time=now,
+                                state='filled')])
+        self.ses.commit()
+
+    def tearDown(self):
+        set_fixed_point(False)
+
+    def test_query_resting_orders(self):
+        rows = query_resting_orders(self.ses, Order, 'BTCUSD').all()
+        self.assertEqual([(r.id, r.amount) for r in rows], [(1, 200), (3, 200), (4, 500)])
+        self.assertEqual(len(query_resting_orders(self.ses, Order).all()), 4)
+
+    def test_load_orders(self):
+        counts = []
+        rows = query_resting_orders(self.ses, Order, 'BTCUSD')
+        self.assertEqual(load_orders(rows, chunk_size=2, progress=counts.append), 3)
+        self.assertEqual(counts, [2, 3])
+        self.assertEqual(get_next_order('bid').amount, 200)
+        self.assertEqual(get_next_order('ask').price, 24100)
+        self.assertEqual(get_order(3).price, 23900)
+        depth = get_depth()
+        self.assertEqual(depth['bids'], [[24000, 200], [23900, 200]])
+        self.assertEqual(depth['asks'], [[24100, 500]])
+
+    def test_load_into_book(self):
+        rows = query_resting_orders(self.ses, Order, 'BTCUSD')
+        load_orders([row for row in rows if row.id != 4])
+        load_orders(query_resting_orders(self.ses, Order, 'BTCUSD').filter(Order.id == 4))
+        # the depth of the orders already in the book is kept
+        depth = get_depth()
+        self.assertEqual(depth['bids'], [[24000, 200], [23900, 200]])
+        self.assertEqual(depth['asks'], [[24100, 500]])
+
+    def test_float_book(self):
+        set_fixed_point(False)
+        self.assertEqual(load_orders(query_resting_orders(self.ses, Order, 'BTCUSD')), 3)
+        self.assertEqual(get_order(4).price, 241.0)
+        self.assertEqual(get_order(4).amount, 0.000005)
+        # the book was claimed for floats
+        set_fixed_point()
+        self.assertRaises(BookModeError, load_orders, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import sys
+import time
+import unittest
+import uuid
+import redis
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node.depth_feed import DepthBook, follow
+from dex_node.interface import (cancel_order, create_book_order, get_depth_snapshot,
+                                insert_many_orders, rebuild_market_data, set_depth_feed)
+from dex_node.matcher import match_orders, match_orders_atomic
+from dex_node.redis_keys import DEPTH_CHANNEL
+
+
+def read_messages(sub):
+    messages = []
+    msg = sub.get_message(ignore_subscribe_messages=True, timeout=1)
+    while msg is not None:
+        messages.append(json.loads(msg['data']))
+        msg = sub.get_message(ignore_subscribe_messages=True, timeout=0.1)
+    return messages
+
+
+class DepthFeed(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_depth_feed(True)
+        self.sub = red.pubsub()
+        self.sub.subscribe(DEPTH_CHANNEL)
+        self.sub.get_message(timeout=1)
+
+    def tearDown(self):
+        set_depth_feed(False)
+        self.sub.close()
+
+    def test_deltas(self):
+        now = round(time.time(), 2)
+        orders = [create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4())),
+                  create_book_order('bid', 240, 0.0, now, 2, str(uuid.uuid4())),
+                  create_book_order('bid', 239, 0.0, now, 1, str(uuid.uuid4())),
+                  create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))]
+        insert_many_orders(orders)
+        messages = read_messages(self.sub)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['type'], 'delta')
+        self.assertEqual(sorted(messages[0]['bids']), [[239, 1], [240, 3]])
+        self.assertEqual(messages[0]['asks'], [[241, 1]])
+        book = DepthBook()
+        self.assertTrue(book.apply(get_depth_snapshot()))
+        cancel_order(orders[2].id)
+        insert_many_orders([create_book_order('ask', 240, 0.0, now, 0.5, str(uuid.uuid4())),
+                            create_book_order('ask', 239, 0.0, now, 0.25, str(uuid.uuid4()))])
+        match_orders()
+        match_orders_atomic()
+        messages = read_messages(self.sub)
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(messages[0]['bids'], [[239, 0]])
+        for msg in messages:
+            self.assertTrue(book.apply(msg))
+        snapshot = get_depth_snapshot()
+        self.assertEqual(book.get_depth(), {'seq': snapshot['seq'], 'bids': [[240, 2.25]],
+                                            'asks': [[241, 1]]})
+
+    def test_gap(self):
+        book = DepthBook()
+        self.assertFalse(book.apply({'type': 'delta', 'seq': 1, 'bids': [[240, 1]], 'asks': {}}))
+        book.load({'seq': 5, 'bids': [[240, 1]], 'asks': []})
+        self.assertTrue(book.apply({'type': 'delta', 'seq': 5, 'bids': [[240, 2]], 'asks': {}}))
+        self.assertEqual(book.bids, {240: 1})
+        self.assertTrue(book.apply({'type': 'delta', 'seq': 6, 'bids': [[240, 0]], 'asks': [[241, 1]]}))
+        self.assertEqual(book.get_depth(), {'seq': 6, 'bids': [], 'asks': [[241, 1]]})
+        self.assertFalse(book.apply({'type': 'delta', 'seq': 8, 'bids': [], 'asks': []}))
+        self.assertFalse(book.synced)
+        self.assertTrue(book.apply({'type': 'snapshot', 'seq': 9, 'bids': [[239, 3]], 'asks': []}))
+        self.assertEqual(book.get_depth(), {'seq': 9, 'bids': [[239, 3]], 'asks': []})
+
+    def test_rebuild_snapshot(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4()))])
+        read_messages(self.sub)
+        rebuild_market_data()
+        messages = read_messages(self.sub)
+        self.assertEqual([m['type'] for m in messages], ['delta', 'snapshot'])
+        self.assertEqual(messages[1]['bids'], [[240, 1]])
+        self.assertEqual(messages[1]['seq'], messages[0]['seq'])
+
+    def test_follow(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4()))])
+        feed = follow(timeout=0.1)
+        book = next(feed)
+        self.assertEqual(book.get_depth()['bids'], [[240, 1]])
+        insert_many_orders([create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))])
+        book = next(feed)
+        self.assertEqual(book.get_depth()['asks'], [[241, 1]])
+        # a lost delta is noticed, and the book reloaded
+        book.seq -= 1
+        insert_many_orders([create_book_order('ask', 242, 0.0, now, 1, str(uuid.uuid4()))])
+        book = next(feed)
+        self.assertTrue(book.synced)
+        self.assertEqual(book.get_depth()['asks'], [[241, 1], [242, 1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
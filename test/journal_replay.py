@@ -0,0 +1,121 @@
+import datetime
+import sys
+import unittest
+import uuid
+from collections import namedtuple
+import redis
+import time
+from util import create_order_book
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node import journal
+from dex_node.bootstrap import load_orders
+from dex_node.book import OrderBook
+from dex_node.matcher import match_orders_atomic, sweep_orders
+from dex_node.interface import (cancel_order, create_book_order, get_order, insert_order,
+                                set_journal, set_member_format, update_order)
+
+
+# an Order table row, as bootstrap reads them
+Row = namedtuple('Row', 'id pair side price amount time')
+
+
+def redis_book():
+    book = OrderBook()
+    book.load()
+    return book
+
+
+def contents(book):
+    return dict((str(o.id), (o.side, o.price, o.amount))
+                for side in ('bid', 'ask') for o in book.iter_orders(side))
+
+
+class Journal(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_journal(True)
+
+    def tearDown(self):
+        set_journal(False)
+        set_member_format('text')
+
+    def test_journal_events(self):
+        now = round(time.time(), 2)
+        bid = create_book_order('bid', 240, 0.0, now, 0.3, str(uuid.uuid4()))
+        insert_order(bid)
+        update_order(bid._replace(amount=0.2))
+        cancel_order(bid.id)
+        events = [e for seq, e in journal.read_journal()]
+        self.assertEqual([e[0] for e in events], ['insert', 'amend', 'remove'])
+        self.assertEqual(events[1][1], bid._replace(amount=0.2))
+        self.assertEqual(journal.get_seq(), 3)
+        self.assertEqual([seq for seq, e in journal.read_journal(2, 2)], [2])
+
+    def test_replay(self):
+        orders = create_order_book(price=240.0, tsize=0.1, size=10, offset=-1, insert=False)
+        for order in orders['bids'] + orders['asks']:
+            insert_order(order)
+        inserted = journal.get_seq()
+        update_order(orders['bids'][0]._replace(amount=0.5))
+        trades = sweep_orders()
+        self.assertGreater(len(trades), 0)
+        book, replayed, seq = journal.replay()
+        self.assertEqual(seq, journal.get_seq())
+        self.assertEqual(replayed, trades)
+        self.assertEqual(contents(book), contents(redis_book()))
+        book, replayed, seq = journal.replay(inserted)
+        self.assertEqual((len(book), replayed, seq), (20, [], inserted))
+
+    def test_replay_atomic(self):
+        for fmt in ('text', 'binary'):
+            red.flushall()
+            set_member_format(fmt)
+            now = round(time.time(), 2)
+            insert_order(create_book_order('bid', 240, 0.0, now, 0.3, str(uuid.uuid4())))
+            insert_order(create_book_order('ask', 239, 0.0, now, 0.1, str(uuid.uuid4())))
+            insert_order(create_book_order('ask', 240, 0.0, now, 0.1, str(uuid.uuid4())))
+            trades = match_orders_atomic(10)
+            self.assertEqual(len(trades), 2)
+            self.assertIsNotNone(trades[0].seq)
+            book, replayed, seq = journal.replay()
+            # the journal does not record the market data seq of a trade
+            self.assertEqual(replayed, [t._replace(seq=None) for t in trades])
+            self.assertEqual(contents(book), contents(redis_book()))
+
+    def test_replay_bootstrap(self):
+        now = round(time.time(), 2)
+        insert_order(create_book_order('bid', 239, 0.0, now, 0.2, str(uuid.uuid4())))
+        # bootstrap writes the book directly, and checkpoints it
+        load_orders([Row(i, 'BTCUSD', 'ask', 24000 + i, 10000000, datetime.datetime.now()) for i in range(3)])
+        cancel_order('1')
+        book, replayed, seq = journal.replay()
+        self.assertEqual(len(book), 3)
+        self.assertEqual(contents(book), contents(redis_book()))
+
+    def test_checkpoint(self):
+        create_order_book(price=240.0, tsize=0.1, size=10, offset=-1)
+        self.assertEqual(journal.checkpoint(trim=True), 20)
+        self.assertEqual(red.llen('journal'), 0)
+        trades = sweep_orders()
+        book, replayed, seq = journal.replay()
+        self.assertEqual(replayed, trades)
+        self.assertEqual(contents(book), contents(redis_book()))
+        self.assertRaises(ValueError, journal.replay, 10)
+
+    def test_restore(self):
+        bid = create_book_order('bid', 240, 0.0, round(time.time(), 2), 0.3, str(uuid.uuid4()))
+        insert_order(bid)
+        cancel_order(bid.id)
+        book, trades, seq = journal.replay(1)
+        journal.restore(book, seq)
+        self.assertEqual(get_order(bid.id), bid)
+        self.assertEqual(journal.get_seq(), 1)
+        self.assertEqual(red.llen('journal'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import logging
+import random
+import sys
+import time
+import unittest
+import urllib2
+import uuid
+import redis
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node import metrics
+from dex_node.interface import create_book_order, insert_many_orders
+from dex_node.matcher import match_orders
+
+
+class Histograms(unittest.TestCase):
+    def test_exact_small_values(self):
+        hist = metrics.Histogram()
+        for value in range(10):
+            hist.record(value)
+        self.assertEqual(hist.percentile(50), 4)
+        self.assertEqual(hist.percentile(100), 9)
+        self.assertEqual(hist.get_summary()['mean'], 4.5)
+
+    def test_relative_error(self):
+        hist = metrics.Histogram(precision_bits=5)
+        values = sorted(random.randint(1, 10000000) for i in range(10000))
+        for value in values:
+            hist.record(value)
+        for pct in (50, 90, 99, 99.9):
+            exact = values[int(round(pct / 100.0 * len(values))) - 1]
+            self.assertGreaterEqual(hist.percentile(pct), exact)
+            self.assertLessEqual(hist.percentile(pct), exact * (1 + 1 / 16.0))
+        self.assertEqual(hist.percentile(100), values[-1])
+        self.assertLess(len(hist._counts), 400)
+
+    def test_empty(self):
+        self.assertEqual(metrics.Histogram().percentile(99), 0)
+
+
+class Instrumentation(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.enable(False)
+
+    def test_disabled(self):
+        @metrics.timed('test.sleep')
+        def sleep():
+            time.sleep(0.001)
+            return 1
+        self.assertEqual(sleep(), 1)
+        metrics.incr('test.calls')
+        self.assertEqual(metrics.get_histogram('test.sleep').count, 0)
+        self.assertEqual(metrics.COUNTERS, {})
+
+    def test_timed(self):
+        metrics.enable()
+
+        @metrics.timed('test.sleep')
+        def sleep():
+            time.sleep(0.002)
+        sleep()
+        with metrics.timing('test.block'):
+            sleep()
+        metrics.incr('test.calls', 2)
+        summary = metrics.get_summary()
+        self.assertEqual(summary['histograms']['test.sleep']['count'], 2)
+        self.assertGreaterEqual(summary['histograms']['test.sleep']['p50'], 2000)
+        self.assertGreaterEqual(summary['histograms']['test.block']['max'], 2000)
+        self.assertEqual(summary['counters'], {'test.calls': 2})
+
+    def test_matching(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4())),
+                            create_book_order('ask', 239, 0.0, now, 1, str(uuid.uuid4()))])
+        metrics.enable()
+        match_orders()
+        summary = metrics.get_summary()['histograms']
+        for name in ('matcher.match_orders', 'interface.get_next_order', 'interface.decode_order',
+                     'interface.apply_book_changes'):
+            self.assertGreater(summary[name]['count'], 0, name)
+
+    def test_render_and_serve(self):
+        metrics.enable()
+        metrics.record('api.get_orders', 0.0015)
+        metrics.incr('api.status_200')
+        text = metrics.render_text()
+        self.assertIn('# TYPE dex_api_get_orders_seconds summary\n', text)
+        self.assertIn('dex_api_get_orders_seconds_count 1\n', text)
+        self.assertIn('dex_api_status_200_total 1\n', text)
+        server = metrics.serve(0, 'localhost')
+        try:
+            body = urllib2.urlopen('http://localhost:%s/metrics' % server.server_port, timeout=5).read()
+        finally:
+            server.shutdown()
+        self.assertEqual(body, text)
+
+    def test_log_summary(self):
+        metrics.enable()
+        metrics.record('api.get_orders', 0.0015)
+        lines = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                lines.append(record.getMessage())
+        logger = logging.getLogger('test_metrics')
+        logger.addHandler(Handler())
+        logger.setLevel(logging.INFO)
+        metrics.log_periodically(logger, interval=0)
+        self.assertEqual(len(lines), 1)
+        self.assertIn('api.get_orders n=1 p50=1500', lines[0])
+        metrics.log_periodically(logger, interval=60)
+        self.assertEqual(len(lines), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
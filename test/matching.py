@@ -12,8 +12,12 @@ HERE = os.path.dirname(os.path.abspath(__file__))
 OB_DIR = os.path.join(os.path.dirname(HERE), 'dex_node')
 
 sys.path.append('../')
-from dex_node.matcher import match_orders, Trade, trade_mq_client, mrunner
-from dex_node.interface import get_next_order, BookOrder, insert_many_orders, create_book_order
+from dex_node.matcher import (match_orders, match_orders_atomic, sweep_orders, Trade,
+                              trade_mq_client, mrunner)
+from dex_node.interface import (get_next_order, get_order, BookOrder, insert_many_orders,
+                                create_book_order, set_member_format, set_fixed_point, to_units,
+                                set_pair, PAIR_UNITS)
+from dex_node.supervisor import Supervisor
 
 
 class MatchOrders(unittest.TestCase):
@@ -71,6 +75,100 @@ class MatchOrders(unittest.TestCase):
         ask = get_next_order('ask')
         self.assertIsNone(ask)
 
+    def test_sweep(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 242, 0.0, now, 0.5, str(uuid.uuid4())),
+                            create_book_order('bid', 239, 0.0, now, 0.5, str(uuid.uuid4())),
+                            create_book_order('ask', 240, 0.0, now, 0.1, str(uuid.uuid4())),
+                            create_book_order('ask', 241, 0.0, now, 0.1, str(uuid.uuid4())),
+                            create_book_order('ask', 242, 0.0, now, 0.2, str(uuid.uuid4()))])
+        trades = sweep_orders()
+        self.assertEqual(len(trades), 3)
+        for trade in trades:
+            self.assertIsInstance(trade, Trade)
+        self.assertEqual(sweep_orders(), [])
+        bid = get_next_order('bid')
+        self.assertEqual(bid.price, 242)
+        self.assertAlmostEqual(bid.amount, 0.1)
+        self.assertEqual(get_order(bid.id), bid)
+        self.assertIsNone(get_next_order('ask'))
+        self.assertEqual(red.hlen('book_index'), 2)
+
+    def test_atomic(self):
+        t1 = round(time.time(), 2)
+        t2 = t1 + 1
+        bid_id = str(uuid.uuid4())
+        insert_many_orders([create_book_order('bid', 242, 0.0, t1, 0.3, bid_id),
+                            create_book_order('ask', 240, 0.0, t2, 0.1, str(uuid.uuid4())),
+                            create_book_order('ask', 241, 1.0, t1, 0.1, str(uuid.uuid4()))])
+        trades = match_orders_atomic()
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].price, 240)
+        self.assertEqual(trades[0].amount, 0.1)
+        self.assertEqual(trades[0].bid_id, bid_id)
+        trades = match_orders_atomic(10)
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].price, 241)
+        bid = get_next_order('bid')
+        self.assertAlmostEqual(bid.amount, 0.1)
+        self.assertEqual(bid.time, t1)
+        self.assertEqual(get_order(bid_id), bid)
+        self.assertIsNone(get_next_order('ask'))
+        self.assertEqual(red.hlen('book_index'), 1)
+        self.assertEqual(match_orders_atomic(), [])
+
+    def test_atomic_binary(self):
+        set_member_format('binary')
+        try:
+            bid_id = str(uuid.uuid4())
+            insert_many_orders([create_book_order('bid', 242, 0.0, round(time.time(), 2), 0.3, bid_id),
+                                create_book_order('ask', 240, 0.0, round(time.time(), 2), 0.1, '7')])
+            trades = match_orders_atomic()
+            self.assertEqual(trades[0].bid_id, bid_id)
+            self.assertEqual(trades[0].ask_id, '7')
+            bid = get_next_order('bid')
+            self.assertAlmostEqual(bid.amount, 0.2)
+            self.assertEqual(get_order(bid_id), bid)
+            self.assertIsNone(get_order('7'))
+        finally:
+            set_member_format('text')
+
+    def test_fixed_point(self):
+        set_fixed_point()
+        try:
+            price, amount = to_units('BTCUSD', '240.01', '0.3')
+            self.assertEqual((price, amount), (24001, 30000000))
+            bid_id = str(uuid.uuid4())
+            insert_many_orders([create_book_order('bid', price, 0.0, round(time.time(), 2), amount, bid_id)] +
+                               [create_book_order('ask', price, 0.0, round(time.time(), 2), to_units('BTCUSD', amount='0.1')[1],
+                                                  str(uuid.uuid4())) for i in range(2)])
+            trade = match_orders()
+            self.assertEqual(trade.amount, 10000000)
+            self.assertIsInstance(trade.amount, int)
+            trades = match_orders_atomic()
+            self.assertEqual(trades[0].price, 24001)
+            self.assertIsInstance(trades[0].amount, int)
+            bid = get_next_order('bid')
+            self.assertEqual(bid.amount, 10000000)
+            self.assertEqual(get_order(bid_id), bid)
+            self.assertIsNone(get_next_order('ask'))
+        finally:
+            set_fixed_point(False)
+
+    def test_speed_sweep(self):
+        book = []
+        for i in range(0, 50000):
+            book.append(create_book_order('bid', 250, 0.0, round(time.time(), 2), 0.1, uuid.uuid4()))
+            book.append(create_book_order('ask', 250, 0.0, round(time.time(), 2), 0.1, uuid.uuid4()))
+        insert_many_orders(book)
+        t1 = time.time()
+        while sweep_orders():
+            pass
+        t2 = time.time()
+        self.assertIsNone(get_next_order('bid'))
+        self.assertLessEqual(t2 - t1, 30)
+        print "time to sweep 100k orders: %s" % (t2 - t1)
+
     def test_speed(self):
         book = []
         for i in range(0, 50000):
@@ -88,6 +186,61 @@ class MatchOrders(unittest.TestCase):
         print "time to process 100k orders: %s" % (t3 - t2)
 
 
+def match_pair_once(pair, price):
+    """
+    A Supervisor worker matching a single crossing order pair of its book.
+    """
+    set_pair(pair)
+    insert_many_orders([create_book_order('bid', price, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4())),
+                        create_book_order('ask', price, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4()))])
+    trade = match_orders()
+    red.rpush('test_trades', '%s %s' % (trade.pair, trade.price))
+    time.sleep(60)
+
+
+class MultiPair(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_pair('BTCUSD', namespace=True)
+        PAIR_UNITS['ETHUSD'] = {'price': 100, 'amount': 100000000}
+
+    def tearDown(self):
+        set_pair('BTCUSD', namespace=False)
+        del PAIR_UNITS['ETHUSD']
+
+    def test_namespaces(self):
+        set_pair('BTCUSD')
+        insert_many_orders([create_book_order('bid', 240, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4()))])
+        set_pair('ETHUSD')
+        self.assertIsNone(get_next_order('bid'))
+        insert_many_orders([create_book_order('ask', 230, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4()))])
+        self.assertIsNone(match_orders())
+        set_pair('BTCUSD')
+        self.assertIsNone(match_orders())
+        insert_many_orders([create_book_order('ask', 240, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4()))])
+        self.assertEqual(match_orders().pair, 'BTCUSD')
+        self.assertTrue(red.exists('ETHUSD_book_ask'))
+        self.assertFalse(red.exists('book_ask'))
+
+    def test_refuse_shared_keys(self):
+        set_pair('BTCUSD', namespace=False)
+        self.assertRaises(ValueError, Supervisor, ['BTCUSD', 'ETHUSD'])
+        self.assertEqual(Supervisor(['ETHUSD']).pairs, ['ETHUSD'])
+        self.assertRaises(ValueError, Supervisor, ['XYZUSD'])
+        self.assertRaises(ValueError, Supervisor, ['BTCUSD'], backend='memory')
+
+    def test_supervisor(self):
+        supervisor = Supervisor(['BTCUSD', 'ETHUSD'], target=match_pair_once, price=240)
+        supervisor.start()
+        try:
+            results = [red.blpop('test_trades', timeout=10)[1] for i in range(2)]
+            self.assertEqual(sorted(results), ['BTCUSD 240.0', 'ETHUSD 240.0'])
+            self.assertEqual(supervisor.check(), [])
+        finally:
+            supervisor.stop()
+        self.assertEqual(supervisor.workers, {})
+
+
 class MatchThread(threading.Thread):
 
    def run(self):
@@ -0,0 +1,214 @@
+import sys
+import unittest
+import uuid
+import redis
+import time
+from util import create_order_book
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node import interface
+from dex_node.book import OrderBook
+from dex_node.matcher import match_orders, sweep_orders, MatchRunner, Trade
+from dex_node.store import create_store, MemoryBookStore, RedisBookStore
+from dex_node.interface import (cancel_order, create_book_order, get_next_order, get_order,
+                                insert_many_orders, rem_order, set_book_inbox)
+
+
+class MemoryBookOrders(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook()
+
+    def test_insert_get_order(self):
+        order = create_book_order('bid', 240, 0.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        self.book.insert_order(order)
+        self.assertEqual(self.book.get_next_order('bid'), order)
+        self.assertEqual(self.book.get_next_order('bid', pop=True), order)
+        self.assertIsNone(self.book.get_next_order('bid'))
+        self.assertEqual(len(self.book), 0)
+
+    def test_price_time_priority(self):
+        now = round(time.time(), 2)
+        first = create_book_order('ask', 240, 0.0, now, 1, str(uuid.uuid4()))
+        second = create_book_order('ask', 240, 0.0, now + 1, 1, str(uuid.uuid4()))
+        urgent = create_book_order('ask', 240, 0.0, now - 1, 1, str(uuid.uuid4()))
+        best = create_book_order('ask', 239, 2.0, now + 2, 1, str(uuid.uuid4()))
+        worst = create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))
+        self.book.insert_many_orders([first, worst, second, urgent, best])
+        got = [self.book.get_next_order('ask', pop=True) for i in range(5)]
+        self.assertEqual(got, [best, urgent, first, second, worst])
+
+    def test_bids_descending(self):
+        self.book.insert_many_orders(create_order_book(price=250.0, tsize=0.1, size=10, offset=10,
+                                                       insert=False)['bids'])
+        lastbid = 500
+        while True:
+            o = self.book.get_next_order('bid', pop=True)
+            if not o:
+                break
+            self.assertLessEqual(o.price, lastbid)
+            lastbid = o.price
+
+    def test_update_keeps_place(self):
+        now = round(time.time(), 2)
+        first = create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4()))
+        second = create_book_order('bid', 240, 0.0, now + 1, 1, str(uuid.uuid4()))
+        self.book.insert_many_orders([first, second])
+        smaller = first._replace(amount=0.5)
+        self.book.update_order(smaller)
+        self.assertEqual(self.book.get_next_order('bid'), smaller)
+        moved = second._replace(price=241.0)
+        self.book.update_order(moved)
+        self.assertEqual(self.book.get_next_order('bid'), moved)
+        self.assertEqual(len(self.book), 2)
+
+    def test_rem_order(self):
+        order = create_book_order('ask', 240, 0.0, round(time.time(), 2), 1, str(uuid.uuid4()))
+        self.book.insert_order(order)
+        self.assertFalse(self.book.rem_order('bid', order))
+        self.assertTrue(self.book.rem_order('ask', order.id))
+        self.assertIsNone(self.book.get_next_order('ask'))
+
+    def test_level_queue(self):
+        now = round(time.time(), 2)
+        orders = [create_book_order('ask', 240, 0.0, now + i, 1, str(uuid.uuid4())) for i in range(4)]
+        self.book.insert_many_orders(orders)
+        self.assertTrue(self.book.cancel_order(orders[1].id))
+        self.book.update_order(orders[2]._replace(amount=0.5))
+        self.book.insert_order(orders[0]._replace(amount=2))
+        got = [self.book.get_next_order('ask', pop=True) for i in range(3)]
+        self.assertEqual(got, [orders[0]._replace(amount=2), orders[2]._replace(amount=0.5), orders[3]])
+        self.assertEqual(len(self.book), 0)
+        self.assertIsNone(self.book.best_price('ask'))
+
+
+class MemoryBookMatching(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook()
+
+    def test_match_different_amounts(self):
+        self.book.insert_many_orders([create_book_order('bid', 240, 0.0, round(time.time(), 2), 0.2, str(uuid.uuid4())),
+                                      create_book_order('ask', 240, 0.0, round(time.time(), 2), 0.1, str(uuid.uuid4()))])
+        trade = match_orders(self.book)
+        self.assertIsInstance(trade, Trade)
+        bid = self.book.get_next_order('bid')
+        self.assertAlmostEqual(bid.amount, 0.1)
+        self.assertIsNone(self.book.get_next_order('ask'))
+        self.assertIsNone(match_orders(self.book))
+
+    def test_persist_load(self):
+        red.flushall()
+        create_order_book(price=250.0, tsize=0.1, size=10, offset=10)
+        self.book.load()
+        self.assertEqual(len(self.book), 20)
+        self.assertEqual(self.book.get_next_order('bid'), get_next_order('bid'))
+        self.book.get_next_order('ask', pop=True)
+        self.book.persist()
+        self.assertEqual(red.zcard('book_ask'), 9)
+
+    def test_speed(self):
+        for i in range(0, 50000):
+            self.book.insert_many_orders([
+                create_book_order('bid', 250, 0.0, round(time.time(), 2), 0.1, uuid.uuid4()),
+                create_book_order('ask', 250, 0.0, round(time.time(), 2), 0.1, uuid.uuid4())])
+        t1 = time.time()
+        while match_orders(self.book):
+            pass
+        t2 = time.time()
+        self.assertEqual(len(self.book), 0)
+        self.assertLessEqual(t2 - t1, 5)
+        print "time to process 100k orders in memory: %s" % (t2 - t1)
+
+
+class MemoryStore(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_book_inbox(True)
+
+    def tearDown(self):
+        set_book_inbox(False)
+
+    def test_write_through_and_sync(self):
+        now = round(time.time(), 2)
+        resting = create_book_order('bid', 240, 0.0, now, 0.2, str(uuid.uuid4()))
+        insert_many_orders([resting])
+        store = create_store('memory')
+        store.load()
+        self.assertEqual(store.get_order(resting.id), resting)
+        self.assertEqual(store.sync(), 0)
+        # orders from other processes reach the store through the inbox
+        ask = create_book_order('ask', 239, 0.0, now, 0.1, str(uuid.uuid4()))
+        cancelled = create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))
+        insert_many_orders([ask, cancelled])
+        cancel_order(cancelled.id)
+        runner = MatchRunner(store)
+        trades = runner.next_trades()
+        self.assertEqual([(t.bid_id, t.ask_id) for t in trades], [(resting.id, ask.id)])
+        self.assertIsNone(store.get_order(cancelled.id))
+        # and the fill is written through to Redis
+        self.assertAlmostEqual(get_order(resting.id).amount, 0.1)
+        self.assertIsNone(get_order(ask.id))
+        self.assertEqual(red.zcard('book_ask'), 0)
+        self.assertEqual(red.llen('book_inbox'), 0)
+
+    def test_sync_removed(self):
+        now = round(time.time(), 2)
+        orders = [create_book_order('bid', 240 - i, 0.0, now, 0.2, str(uuid.uuid4())) for i in range(3)]
+        insert_many_orders(orders)
+        store = create_store('memory')
+        store.load()
+        # removed by other processes, other than by cancel_order
+        get_next_order('bid', pop=True)
+        rem_order('bid', orders[1])
+        self.assertEqual(store.sync(), 2)
+        self.assertEqual([o.id for o in store.iter_orders('bid')], [orders[2].id])
+
+
+class BookStores(unittest.TestCase):
+    def test_create_store(self):
+        self.assertIsInstance(create_store('memory'), MemoryBookStore)
+        store = create_store('redis', max_connections=4, socket_timeout=5, socket_keepalive=True)
+        self.assertIsInstance(store, RedisBookStore)
+        self.assertEqual(store.pool.max_connections, 4)
+        self.assertRaises(ValueError, create_store, 'sql')
+
+    def test_own_clients(self):
+        red.flushall()
+        store = create_store('redis', url='redis://localhost:6379/1')
+        bid = create_book_order('bid', 240, 0.0, round(time.time(), 2), 0.2, str(uuid.uuid4()))
+        store.insert_order(bid)
+        self.assertEqual(store.get_order(bid.id), bid)
+        # the default client is left on db 0
+        self.assertIsNone(get_order(bid.id))
+        self.assertEqual(redis.StrictRedis(db=1).zcard('book_bid'), 1)
+        self.assertEqual(red.zcard('book_bid'), 0)
+        with interface.using(store.connection):
+            self.assertEqual(get_order(bid.id), bid)
+        self.assertIsNone(get_order(bid.id))
+
+    def test_redis_url(self):
+        url, interface.REDIS_URL = interface.REDIS_URL, 'redis://localhost:6379/1'
+        try:
+            connection = interface.Connection(max_connections=2)
+        finally:
+            interface.REDIS_URL = url
+        self.assertEqual(connection.red.connection_pool.connection_kwargs['db'], 1)
+        self.assertEqual(connection.red.connection_pool.max_connections, 2)
+
+    def test_same_operations(self):
+        red.flushall()
+        for store in (create_store('memory'), create_store('redis', url='redis://localhost:6379/0')):
+            now = round(time.time(), 2)
+            bid = create_book_order('bid', 240, 0.0, now, 0.2, str(uuid.uuid4()))
+            store.insert_many_orders([bid, create_book_order('ask', 240, 0.0, now, 0.1, str(uuid.uuid4()))])
+            self.assertEqual(store.get_order(bid.id), bid)
+            self.assertEqual(len(sweep_orders(store)), 1)
+            self.assertAlmostEqual(store.get_next_order('bid').amount, 0.1)
+            self.assertTrue(store.cancel_order(bid.id))
+            self.assertIsNone(store.get_next_order('bid'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,8 +10,14 @@ red_sub = red.pubsub()
 
 sys.path.append('../')
 
-from dex_node.interface import (get_next_order, insert_order,
-                                insert_many_orders, create_book_order)
+from dex_node.interface import (get_next_order, insert_order, insert_many_orders,
+                                create_book_order, get_order, update_order, cancel_order,
+                                create_order_key, decode_order, set_member_format,
+                                migrate_members, get_ticker, get_depth, rem_order, Trade,
+                                set_fixed_point, to_units, BookModeError, update_market_data,
+                                set_journal, parse_pair_units, PAIR_UNITS)
+from dex_node.matcher import match_orders, match_orders_atomic, sweep_orders
+from dex_node.redis_keys import BOOK_CHANNEL, RKEY
 
 
 class CreateOrders(unittest.TestCase):
@@ -47,6 +53,219 @@ class CreateOrders(unittest.TestCase):
         got_ask = get_next_order('ask', pop=True)
         self.assertEqual(got_ask, ask)
 
+    def test_insert_notifies(self):
+        red_sub.subscribe(BOOK_CHANNEL)
+        red_sub.get_message(timeout=1)
+        order = create_book_order('ask', 240, 0.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        insert_order(order)
+        msg = red_sub.get_message(timeout=1)
+        red_sub.unsubscribe(BOOK_CHANNEL)
+        self.assertEqual(msg['channel'], BOOK_CHANNEL)
+        self.assertEqual(msg['data'], 'ask')
+
+
+class UpdateOrders(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+
+    def test_update_by_id(self):
+        now = round(time.time(), 2)
+        create_order_book(price=240.0, tsize=0.1, size=10)
+        order = create_book_order('bid', 240, 0.0, now, 1.01, str(uuid.uuid4()))
+        insert_order(order)
+        self.assertEqual(get_order(order.id), order)
+        smaller = order._replace(amount=0.5)
+        update_order(smaller)
+        self.assertEqual(get_order(order.id), smaller)
+        self.assertEqual(red.zcard('book_bid'), 11)
+
+    def test_update_upsert(self):
+        order = create_book_order('ask', 240, 0.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        update_order(order, upsert=False)
+        self.assertIsNone(get_order(order.id))
+        update_order(order)
+        self.assertEqual(get_next_order('ask'), order)
+
+    def test_cancel(self):
+        order = create_book_order('ask', 240, 0.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        insert_order(order)
+        self.assertTrue(cancel_order(order.id))
+        self.assertFalse(cancel_order(order.id))
+        self.assertIsNone(get_next_order('ask'))
+
+    def test_pop_clears_index(self):
+        order = create_book_order('bid', 240, 0.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        insert_order(order)
+        get_next_order('bid', pop=True)
+        self.assertIsNone(get_order(order.id))
+
+
+class BinaryMembers(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_member_format('binary')
+
+    def tearDown(self):
+        set_member_format('text')
+
+    def test_roundtrip(self):
+        uorder = create_book_order('bid', 240, 1.0, round(time.time(), 2), 1.01, str(uuid.uuid4()))
+        iorder = create_book_order('ask', 240, 0.0, round(time.time(), 2), 3, '42')
+        for order in (uorder, iorder):
+            key = create_order_key(order)
+            self.assertEqual(len(key), 42)
+            self.assertEqual(decode_order(order.side, (key, order.price)), order)
+
+    def test_sort_and_update(self):
+        now = round(time.time(), 2)
+        highorder = create_book_order('ask', 240, 10.0, now, 1.01, str(uuid.uuid4()))
+        loworder = create_book_order('ask', 240, 9.0, now, 1.01, str(uuid.uuid4()))
+        insert_many_orders([highorder, loworder])
+        update_order(loworder._replace(amount=0.5))
+        self.assertEqual(get_next_order('ask', pop=True), loworder._replace(amount=0.5))
+        self.assertEqual(get_next_order('ask', pop=True), highorder)
+
+    def test_time_priority_across_id_types(self):
+        now = round(time.time(), 2)
+        older = create_book_order('ask', 240, 0.0, now, 1, '42')
+        newer = create_book_order('ask', 240, 0.0, now + 1, 1, str(uuid.uuid4()))
+        insert_many_orders([newer, older])
+        self.assertEqual(get_next_order('ask', pop=True), older)
+        self.assertEqual(get_next_order('ask', pop=True), newer)
+
+    def test_mixed_formats(self):
+        # members written before the switch must still be removed, by the
+        # member in the book rather than one encoded anew
+        set_member_format('text')
+        now = round(time.time(), 2)
+        bid = create_book_order('bid', 240, 0.0, now, 2, str(uuid.uuid4()))
+        asks = [create_book_order('ask', 240, 0.0, now, 1, str(uuid.uuid4())) for i in range(3)]
+        insert_many_orders([bid] + asks)
+        set_member_format('binary')
+        self.assertIsInstance(match_orders(), Trade)
+        self.assertEqual(len(sweep_orders()), 1)
+        self.assertIsNone(match_orders())
+        self.assertEqual(red.zcard('book_bid'), 0)
+        self.assertEqual(red.zcard('book_ask'), 1)
+        rem_order('ask', get_next_order('ask'))
+        self.assertEqual(red.zcard('book_ask'), 0)
+        self.assertEqual(red.hlen('book_index'), 0)
+        insert_many_orders([asks[0]])
+        set_member_format('text')
+        self.assertEqual(get_next_order('ask', pop=True), asks[0])
+        self.assertEqual(red.hlen('book_index'), 0)
+
+    def test_migrate(self):
+        set_member_format('text')
+        create_order_book(price=250.0, tsize=0.1, size=10)
+        bid = get_next_order('bid')
+        set_member_format('binary')
+        self.assertEqual(migrate_members(batch=3), 20)
+        self.assertEqual(migrate_members(), 0)
+        self.assertEqual(red.zcard('book_bid'), 10)
+        self.assertEqual(get_next_order('bid'), bid)
+        self.assertEqual(get_order(bid.id), bid)
+
+
+class BookMode(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        set_fixed_point(False)
+
+    def tearDown(self):
+        set_fixed_point(False)
+
+    def test_to_units(self):
+        self.assertEqual(to_units('BTCUSD', '240.01', '0.3'), (24001, 30000000))
+        self.assertEqual(to_units('BTCUSD', 240.5), (24050, None))
+        self.assertRaises(ValueError, to_units, 'BTCUSD', '240.015')
+        self.assertRaises(ValueError, to_units, 'BTCUSD', amount='0.000000001')
+
+    def test_pair_units(self):
+        self.assertEqual(parse_pair_units(' ETHUSD:100:100000000, '),
+                         {'ETHUSD': {'price': 100, 'amount': 100000000}})
+        self.assertRaises(ValueError, parse_pair_units, 'ETHUSD:100')
+        self.assertRaises(ValueError, to_units, 'ETHUSD', 240.5)
+        PAIR_UNITS.update(parse_pair_units('ETHUSD:100:1000'))
+        try:
+            self.assertEqual(to_units('ETHUSD', 240.5, 0.25), (24050, 250))
+        finally:
+            del PAIR_UNITS['ETHUSD']
+
+    def test_refuse_other_mode(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4()))])
+        self.assertEqual(red.get(RKEY['book_mode']), 'float')
+        set_fixed_point()
+        self.assertRaises(BookModeError, insert_order, create_book_order('ask', 24000, 0.0, now, 100000000))
+        self.assertRaises(BookModeError, match_orders_atomic)
+        self.assertEqual(red.zcard('book_ask'), 0)
+
+
+class MarketData(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+
+    def test_depth(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4())),
+                            create_book_order('bid', 240, 0.0, now, 2, str(uuid.uuid4())),
+                            create_book_order('bid', 239, 0.0, now, 1, str(uuid.uuid4())),
+                            create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))])
+        depth = get_depth()
+        self.assertEqual(depth['bids'], [[240, 3], [239, 1]])
+        self.assertEqual(depth['asks'], [[241, 1]])
+        ticker = get_ticker()
+        self.assertEqual((ticker['bid'], ticker['ask']), (240, 241))
+        self.assertEqual(ticker['seq'], depth['seq'])
+        ask = get_next_order('ask', pop=True)
+        depth = get_depth()
+        self.assertEqual(depth['asks'], [])
+        self.assertIsNone(get_ticker()['ask'])
+        self.assertGreater(depth['seq'], ticker['seq'])
+
+    def test_trades(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 240, 0.0, now, 1, str(uuid.uuid4())),
+                            create_book_order('ask', 239, 0.0, now, 0.25, str(uuid.uuid4())),
+                            create_book_order('ask', 240, 0.0, now, 0.5, str(uuid.uuid4()))])
+        match_orders()
+        ticker = get_ticker()
+        self.assertEqual(ticker['last'], 239)
+        self.assertEqual(ticker['volume'], 0.25)
+        match_orders_atomic()
+        ticker = get_ticker()
+        self.assertEqual(ticker['last'], 240)
+        self.assertEqual(ticker['volume'], 0.75)
+        self.assertEqual(get_depth()['bids'], [[240, 0.25]])
+        self.assertEqual(get_depth()['asks'], [])
+
+    def test_scripts_flushed(self):
+        bid = create_book_order('bid', 240, 0.0, round(time.time(), 2), 1, str(uuid.uuid4()))
+        insert_order(bid)
+        red.script_flush()
+        # loads the market data script again, but not the journal one
+        update_market_data([])
+        set_journal(True)
+        try:
+            update_order(bid._replace(amount=0.4))
+        finally:
+            set_journal(False)
+        self.assertEqual(get_depth()['bids'], [[240, 0.4]])
+        self.assertEqual(get_next_order('bid').amount, 0.4)
+        self.assertEqual(red.llen(RKEY['journal']), 1)
+
+    def test_volume_window(self):
+        bucket = int(time.time() // 300)
+        # a bucket just over 24h old is left out when reading, without a write
+        red.hmset(RKEY['volume'], {'oldest': bucket - 288, 'total': 3, str(bucket - 288): 2,
+                                   str(bucket): 1, 'last': 240})
+        ticker = get_ticker()
+        self.assertEqual((ticker['volume'], ticker['last']), (1, 240))
+        self.assertEqual(red.hget(RKEY['volume'], 'total'), '3')
+        red.hset(RKEY['volume'], 'oldest', bucket - 1000)
+        self.assertEqual(get_ticker()['volume'], 0)
+
 
 class GetOrders(unittest.TestCase):
     def setUp(self):
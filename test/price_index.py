@@ -0,0 +1,91 @@
+import json
+import sys
+import time
+import unittest
+import uuid
+import redis
+
+red = redis.StrictRedis()
+
+sys.path.append('../')
+
+from dex_node.interface import create_book_order, insert_many_orders
+from dex_node.price_index import IndexAggregator, publish_index, ticker_price
+from dex_node.redis_keys import INDEX_EXTERNAL_CHANNEL
+
+
+class Aggregator(unittest.TestCase):
+    def test_ticker_price(self):
+        self.assertEqual(ticker_price({'bid': 239, 'ask': 241, 'last': 100}), 240)
+        self.assertEqual(ticker_price({'bid': 239, 'last': '242.5'}), 242.5)
+        self.assertIsNone(ticker_price({'bid': 239}))
+
+    def test_sources(self):
+        agg = IndexAggregator(source_ttl=10, window=100)
+        self.assertIsNone(agg.external)
+        agg.add_ticker('a', 100.0, now=0)
+        agg.add_ticker('b', 110.0, now=1)
+        self.assertEqual(agg.external, 105)
+        agg.add_ticker('a', 104.0, now=5)
+        self.assertEqual(agg.external, 107)
+        # b has not been heard from in over 10 seconds
+        agg.add_ticker('a', 102.0, now=12)
+        self.assertEqual(agg.external, 102)
+        self.assertEqual(agg.get_index(None, now=12)['sources'], 1)
+        self.assertIsNone(agg.get_index(None, now=30)['external'])
+
+    def test_window(self):
+        agg = IndexAggregator(source_ttl=1000, window=10)
+        for t, price in enumerate([100.0, 102.0, 104.0]):
+            agg.add_ticker('a', price, now=t)
+        mean, stdev, count = agg.stats(now=2)
+        self.assertEqual((mean, count), (102, 3))
+        self.assertAlmostEqual(stdev, (8 / 3.0) ** 0.5)
+        # the first sample leaves the window
+        mean, stdev, count = agg.stats(now=10.5)
+        self.assertEqual((mean, stdev, count), (103, 1, 2))
+        self.assertEqual(agg.stats(now=100), (None, None, 0))
+
+    def test_divergence(self):
+        agg = IndexAggregator(max_divergence=0.02)
+        agg.add_ticker('a', 100.0, now=0)
+        index = agg.get_index(101.0, now=0)
+        self.assertAlmostEqual(index['divergence'], 0.01)
+        self.assertFalse(index['warning'])
+        self.assertTrue(agg.get_index(97.0, now=0)['warning'])
+        self.assertFalse(agg.get_index(None, now=0)['warning'])
+
+    def test_speed(self):
+        agg = IndexAggregator(source_ttl=5, window=60)
+        start = time.time()
+        for i in range(100000):
+            agg.add_ticker(i % 20, 100.0 + i % 7, now=i * 0.001)
+        self.assertEqual(agg.get_index(100.0, now=100)['sources'], 20)
+        self.assertLess(time.time() - start, 5)
+
+
+class Publish(unittest.TestCase):
+    def setUp(self):
+        red.flushall()
+        self.sub = red.pubsub()
+        self.sub.subscribe(INDEX_EXTERNAL_CHANNEL)
+        self.sub.get_message(timeout=1)
+
+    def tearDown(self):
+        self.sub.close()
+
+    def test_publish(self):
+        now = round(time.time(), 2)
+        insert_many_orders([create_book_order('bid', 239, 0.0, now, 1, str(uuid.uuid4())),
+                            create_book_order('ask', 241, 0.0, now, 1, str(uuid.uuid4()))])
+        agg = IndexAggregator()
+        agg.add_ticker('a', 250.0)
+        self.assertEqual(publish_index(agg)['internal'], 240)
+        msg = self.sub.get_message(ignore_subscribe_messages=True, timeout=1)
+        index = json.loads(msg['data'])
+        self.assertEqual((index['internal'], index['external']), (240, 250))
+        self.assertTrue(index['warning'])
+
+
+if __name__ == "__main__":
+    unittest.main()
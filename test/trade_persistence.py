@@ -0,0 +1,152 @@
+import datetime
+import sys
+import unittest
+from collections import namedtuple
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+from sqlalchemy.ext.declarative import declarative_base
+
+sys.path.append('../')
+
+from dex_node.interface import Trade as MTrade, set_fixed_point
+from dex_node.publisher import content_type, encode_trades
+from dex_node.trade_consumer import TradeConsumer, write_trades
+
+Base = declarative_base()
+
+
+class Order(Base):
+    __tablename__ = "order"
+    id = sa.Column(sa.Integer, primary_key=True)
+    pair = sa.Column(sa.String(6), nullable=False)
+    side = sa.Column(sa.String(3), nullable=False)
+    amount = sa.Column(sa.Integer, nullable=False)
+    price = sa.Column(sa.Integer, nullable=False)
+    time = sa.Column(sa.DateTime, nullable=False)
+    state = sa.Column(sa.String(7), nullable=False, default='open')
+    filled = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class Trade(Base):
+    __tablename__ = "trade"
+    id = sa.Column(sa.Integer, primary_key=True)
+    pair = sa.Column(sa.String(6), nullable=False)
+    amount = sa.Column(sa.Integer, nullable=False)
+    price = sa.Column(sa.Integer, nullable=False)
+    ask_id = sa.Column(sa.Integer, sa.ForeignKey('order.id'), nullable=False)
+    bid_id = sa.Column(sa.Integer, sa.ForeignKey('order.id'), nullable=False)
+    seq = sa.Column(sa.BigInteger, nullable=False, default=0)
+    __table_args__ = (sa.UniqueConstraint('bid_id', 'ask_id', 'seq'),)
+
+
+Method = namedtuple('Method', 'delivery_tag')
+Properties = namedtuple('Properties', 'content_type')
+FIXED = Properties(content_type('json', True))
+
+
+class Channel(object):
+    """records the acks and nacks of a TradeConsumer"""
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacks.append((delivery_tag, multiple, requeue))
+
+
+class Persistence(unittest.TestCase):
+    def setUp(self):
+        eng = sa.create_engine('sqlite://')
+        Base.metadata.create_all(eng)
+        self.ses = orm.sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 1, 1)
+        self.ses.add_all([Order(id=1, pair='BTCUSD', side='bid', amount=300, price=24000, time=now),
+                          Order(id=2, pair='BTCUSD', side='ask', amount=100, price=24000, time=now),
+                          Order(id=3, pair='BTCUSD', side='ask', amount=200, price=23900, time=now)])
+        self.ses.commit()
+
+    def tearDown(self):
+        set_fixed_point(False)
+
+    def states(self):
+        return [(o.id, o.state, o.filled) for o in self.ses.query(Order).order_by(Order.id)]
+
+    def test_write_trades(self):
+        trades = [MTrade('BTCUSD', 24000, 100, '1', '2'),
+                  MTrade('BTCUSD', 23900, 50, 1, 3),
+                  MTrade('BTCUSD', 23900, 50, 'x', 3)]
+        self.assertEqual(write_trades(self.ses, Order, Trade, trades, fixed=True), 2)
+        self.ses.commit()
+        self.assertEqual(self.states(), [(1, 'partial', 150), (2, 'filled', 100), (3, 'partial', 50)])
+        self.assertEqual(self.ses.query(Trade.bid_id, Trade.ask_id, Trade.amount).order_by(Trade.id).all(),
+                         [(1, 2, 100), (1, 3, 50)])
+
+    def test_decimal_units(self):
+        write_trades(self.ses, Order, Trade, [MTrade('BTCUSD', 240.0, 0.000001, 1, 2)])
+        self.assertEqual(self.ses.query(Trade.price, Trade.amount).one(), (24000, 100))
+
+    def test_ack_after_commit(self):
+        channel = Channel()
+        consumer = TradeConsumer(channel, self.ses, Order, Trade, max_batch=2, max_wait=60)
+        set_fixed_point()
+        consumer.add(Method(1), encode_trades([MTrade('BTCUSD', 24000, 100, 1, 2)], 'binary'))
+        self.assertEqual(channel.acks, [])
+        self.assertEqual(self.ses.query(Trade).count(), 0)
+        consumer.add(Method(2), encode_trades([MTrade('BTCUSD', 23900, 200, 1, 3)]), FIXED)
+        self.assertEqual(channel.acks, [(2, True)])
+        self.assertEqual(self.states(), [(1, 'filled', 300), (2, 'filled', 100), (3, 'filled', 200)])
+
+    def test_units_from_content_type(self):
+        consumer = TradeConsumer(Channel(), self.ses, Order, Trade, max_batch=2, max_wait=60)
+        # integral decimals are not mistaken for units
+        consumer.add(Method(1), encode_trades([MTrade('BTCUSD', 240, 1, 1, 2)]),
+                     Properties(content_type('json', False)))
+        consumer.add(Method(2), encode_trades([MTrade('BTCUSD', 23900, 50, 1, 3)]), FIXED)
+        self.assertEqual(self.ses.query(Trade.price, Trade.amount).order_by(Trade.id).all(),
+                         [(24000, 100000000), (23900, 50)])
+
+    def test_redelivered_trades(self):
+        trades = [MTrade('BTCUSD', 24000, 50, 1, 2, 7), MTrade('BTCUSD', 24000, 50, 1, 2, 7)]
+        self.assertEqual(write_trades(self.ses, Order, Trade, trades, fixed=True), 1)
+        self.ses.commit()
+        trades.append(MTrade('BTCUSD', 24000, 50, 1, 2, 8))
+        self.assertEqual(write_trades(self.ses, Order, Trade, trades, fixed=True), 1)
+        self.ses.commit()
+        self.assertEqual(self.ses.query(Trade.seq).order_by(Trade.id).all(), [(7,), (8,)])
+        self.assertEqual(self.states()[:2], [(1, 'partial', 100), (2, 'filled', 100)])
+
+    def test_dead_letter_on_failure(self):
+        channel = Channel()
+        consumer = TradeConsumer(channel, self.ses, Order, Trade, max_batch=10, max_wait=60, max_attempts=2)
+        # a trade without a pair fails the insert
+        poison = encode_trades([MTrade(None, 24000, 100, 1, 2)])
+        consumer.add(Method(1), poison, FIXED)
+        consumer.add(Method(2), encode_trades([MTrade('BTCUSD', 23900, 50, 1, 3)]), FIXED)
+        # the batch fails, then its messages are written one at a time
+        self.assertEqual(consumer.flush(), 1)
+        self.assertEqual(channel.acks, [(2, False)])
+        self.assertEqual(channel.nacks, [(1, False, True)])
+        # the requeued message fails again, and goes to the dead letters
+        consumer.add(Method(3), poison, FIXED)
+        self.assertEqual(consumer.flush(), 0)
+        self.assertEqual(channel.nacks, [(1, False, True), (3, False, False)])
+        self.assertEqual(self.ses.query(Trade).count(), 1)
+        self.assertEqual(self.states(), [(1, 'partial', 50), (2, 'open', 0), (3, 'partial', 50)])
+
+    def test_dead_letter_undecodable(self):
+        channel = Channel()
+        consumer = TradeConsumer(channel, self.ses, Order, Trade, max_batch=10, max_wait=60)
+        consumer.add(Method(1), encode_trades([MTrade('BTCUSD', 23900, 50, 1, 3)]), FIXED)
+        consumer.add(Method(2), 'not json')
+        # a pair without units, and an amount finer than a satoshi
+        consumer.add(Method(3), encode_trades([MTrade('XYZUSD', 240.0, 0.5, 1, 2)]))
+        consumer.add(Method(4), encode_trades([MTrade('BTCUSD', 240.0, 0.123456789, 1, 2)]))
+        self.assertEqual(channel.nacks, [(2, False, False), (3, False, False), (4, False, False)])
+        self.assertEqual(consumer.flush(), 1)
+        self.assertEqual(channel.acks, [(1, True)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import sys
+import unittest
+import uuid
+
+sys.path.append('../')
+
+from dex_node.interface import Trade, set_fixed_point
+from dex_node.publisher import TradePublisher, content_type, encode_trades, decode_trades, is_fixed_point
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, message):
+        self.messages.append(message)
+
+
+def create_trades(count, price=240.0, amount=0.1):
+    return [Trade('BTCUSD', price, amount, str(uuid.uuid4()), str(i)) for i in range(count)]
+
+
+class EncodeTrades(unittest.TestCase):
+    def test_json_roundtrip(self):
+        trades = create_trades(3)
+        self.assertEqual(decode_trades(encode_trades(trades)), trades)
+
+    def test_binary_roundtrip(self):
+        trades = create_trades(3)
+        body = encode_trades(trades, 'binary')
+        self.assertEqual(decode_trades(body), trades)
+        self.assertLess(len(body), len(encode_trades(trades)))
+
+    def test_binary_long_pair(self):
+        trades = [Trade('ETHUSDT', 1800.5, 0.25, str(uuid.uuid4()), str(uuid.uuid4()))]
+        self.assertEqual(decode_trades(encode_trades(trades, 'binary')), trades)
+        trades = [Trade('X' * 256, 1800.5, 0.25, '1', '2')]
+        self.assertRaises(ValueError, encode_trades, trades, 'binary')
+
+    def test_binary_fixed_point(self):
+        set_fixed_point()
+        try:
+            trades = create_trades(2, price=24001, amount=10000000)
+            decoded = decode_trades(encode_trades(trades, 'binary'))
+        finally:
+            set_fixed_point(False)
+        self.assertEqual(decoded, trades)
+        self.assertIsInstance(decoded[0].amount, (int, long))
+
+    def test_seq_roundtrip(self):
+        trades = [t._replace(seq=7) for t in create_trades(2)]
+        for encoding in ('json', 'binary'):
+            self.assertEqual(decode_trades(encode_trades(trades, encoding)), trades)
+        # without a seq on every trade, none is sent
+        body = encode_trades(trades[:1] + create_trades(1), 'binary')
+        self.assertEqual([t.seq for t in decode_trades(body)], [None, None])
+
+    def test_units(self):
+        self.assertEqual(content_type('json', True), 'text/plain; units=fixed')
+        self.assertTrue(is_fixed_point('[]', content_type('json', True)))
+        self.assertFalse(is_fixed_point('[]', content_type('json', False)))
+        self.assertFalse(is_fixed_point('[]', 'text/plain'))
+        set_fixed_point()
+        try:
+            body = encode_trades(create_trades(1, price=24001, amount=10000000), 'binary')
+        finally:
+            set_fixed_point(False)
+        self.assertTrue(is_fixed_point(body, 'application/octet-stream; units=float'))
+
+
+class PublishTrades(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def test_single_json(self):
+        publisher = TradePublisher(self.client)
+        trades = create_trades(2)
+        publisher.add(trades)
+        self.assertEqual(len(self.client.messages), 2)
+        self.assertEqual(decode_trades(self.client.messages[0]), trades[:1])
+
+    def test_batches(self):
+        publisher = TradePublisher(self.client, max_batch=4, max_linger=60, encoding='binary')
+        trades = create_trades(10)
+        publisher.add(trades)
+        self.assertEqual(len(self.client.messages), 2)
+        publisher.flush()
+        self.assertEqual(len(self.client.messages), 3)
+        decoded = []
+        for body in self.client.messages:
+            decoded.extend(decode_trades(body))
+        self.assertEqual(decoded, trades)
+
+    def test_linger(self):
+        publisher = TradePublisher(self.client, max_batch=100, max_linger=0)
+        publisher.add(create_trades(3))
+        self.assertEqual(len(self.client.messages), 1)
+        self.assertEqual(len(decode_trades(self.client.messages[0])), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()